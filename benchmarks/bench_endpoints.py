@@ -0,0 +1,269 @@
+"""
+End-to-end latency of the main pages and API routes on seeded databases.
+
+For every --scales entry (number of seeded customers) a fresh SQLite file is
+filled with seeding.seed and served by create_app(). Each endpoint is then
+measured twice:
+- "test_client": --requests sequential requests through Flask's test client,
+  which is the view, template and database cost without any networking;
+- "wsgi": a threaded Werkzeug server on a local port, driven by --clients
+  concurrent clients (each logged in with its own session) for --requests
+  requests each.
+
+Every result row has p50/p95/p99/mean latency in milliseconds, the mean
+number of SQL statements per request (from the Server-Timing header; the
+rows streamed by /api/users after the view returns are not counted),
+throughput and errors, plus the process RSS after the run. The report is
+printed and written as JSON to --output. With --compare, the p95 of each
+row is compared with an earlier report, e.g. one made on another commit:
+
+    python benchmarks/bench_endpoints.py --scales 1000 10000 --output benchmarks/before.json
+    git checkout my-branch
+    python benchmarks/bench_endpoints.py --scales 1000 10000 --output benchmarks/after.json --compare benchmarks/before.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import create_app
+from db import db
+from extensions import bcrypt
+from models import Drug, Role, User
+from catalog import drug_catalog
+import seeding
+
+PHARMACIST_EMAIL = 'bench.pharmacist@example.com'
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+# name, who is logged in, method, path(rng, scale_info), upload?
+ENDPOINTS = (
+    ('GET /orders', 'customer', 'GET', lambda rng, info: '/orders', False),
+    ('GET /dashboard', 'customer', 'GET', lambda rng, info: '/dashboard', False),
+    ('GET /pharmacistdash', 'pharmacist', 'GET', lambda rng, info: '/pharmacistdash', False),
+    ('GET /review_order/<id>', 'pharmacist', 'GET', lambda rng, info: f"/review_order/{rng.randint(1, info['orders'])}", False),
+    ('POST /upload', 'customer', 'POST', lambda rng, info: '/upload', True),
+    ('GET /api/drugs', None, 'GET', lambda rng, info: '/api/drugs', False),
+    ('GET /api/drugs/<id>', None, 'GET', lambda rng, info: f"/api/drugs/{rng.randint(1, info['drugs'])}", False),
+    ('GET /api/users', None, 'GET', lambda rng, info: '/api/users', False),
+)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def summarize(samples, elapsed=None):
+    latencies = sorted(seconds * 1000 for seconds, _, ok in samples if ok)
+    queries = [count for _, count, ok in samples if ok and count is not None]
+    row = {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+    }
+    if elapsed:
+        row['throughput_rps'] = len(samples) / elapsed
+    return row
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def scan(rng):
+    # Distinct bytes, so every upload stores a new blob
+    return b'%PDF-1.4 bench ' + rng.randbytes(2048)
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def build(tmp, users, rng_seed, overrides):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+        'UPLOAD_PARTIAL_FOLDER': os.path.join(tmp, 'partial'),
+        'WTF_CSRF_ENABLED': False,
+        'SLOW_REQUEST_MS': float('inf'),
+        'SLOW_QUERY_MS': float('inf'),
+        # Every client logs in as the pharmacist; the login limits would reject them
+        'RATELIMIT_ENABLED': False,
+        **overrides,
+    })
+    with app.app_context():
+        db.create_all()
+        totals = seeding.seed(db.engine, users, rng_seed=rng_seed)
+        if db.session.get(Role, 1) is None:
+            db.session.add(Role(id=1, name='Pharmacist'))
+        db.session.add(User(name='Bench Pharmacist', email=PHARMACIST_EMAIL, phn='8000000000', role_id=1,
+                            password=bcrypt.generate_password_hash(seeding.SEED_PASSWORD).decode()))
+        db.session.commit()
+        customers = db.session.execute(db.select(User.email).where(User.role_id == seeding.USER_ROLE_ID)).scalars().all()
+        drugs = db.session.execute(db.select(db.func.max(Drug.id))).scalar()
+    drug_catalog.invalidate()
+    return app, {'customers': customers, 'orders': totals['orders'], 'drugs': drugs}
+
+def queries_of(headers):
+    # Werkzeug keeps repeated headers apart, requests joins them with commas
+    values = headers.getlist('Server-Timing') if hasattr(headers, 'getlist') else [headers.get('Server-Timing', '')]
+    match = QUERIES.search(', '.join(values))
+    return int(match.group(1)) if match else None
+
+def log_in(post, email):
+    response = post('/login', data={'email': email, 'password': seeding.SEED_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f"Could not log in as {email}")
+
+def run_test_client(app, info, requests_per_endpoint, rng):
+    clients = {None: app.test_client()}
+    for role, email in (('customer', rng.choice(info['customers'])), ('pharmacist', PHARMACIST_EMAIL)):
+        clients[role] = app.test_client()
+        log_in(clients[role].post, email)
+    results = {}
+    for name, role, method, path, upload in ENDPOINTS:
+        samples = []
+        for _ in range(requests_per_endpoint):
+            kwargs = {'data': {'file': (io.BytesIO(scan(rng)), 'scan.pdf')}, 'content_type': 'multipart/form-data'} if upload else {}
+            start = time.perf_counter()
+            response = clients[role].open(path(rng, info), method=method, **kwargs)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            samples.append((elapsed, queries_of(response.headers), response.status_code < 400))
+        results[name] = summarize(samples)
+    return results
+
+def run_wsgi(app, info, clients, requests_per_client, rng):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    sessions = []
+    for i in range(clients):
+        by_role = {None: requests.Session()}
+        for role, email in (('customer', info['customers'][i % len(info['customers'])]), ('pharmacist', PHARMACIST_EMAIL)):
+            by_role[role] = session = requests.Session()
+            log_in(lambda path, **kwargs: session.post(base + path, allow_redirects=False, **kwargs), email)
+        sessions.append(by_role)
+
+    results = {}
+    try:
+        for name, role, method, path, upload in ENDPOINTS:
+            samples = []
+            lock = threading.Lock()
+
+            def client(by_role, seed):
+                client_rng = random.Random(seed)
+                mine = []
+                for _ in range(requests_per_client):
+                    files = {'file': ('scan.pdf', scan(client_rng))} if upload else None
+                    start = time.perf_counter()
+                    try:
+                        response = by_role[role].request(method, base + path(client_rng, info), files=files, allow_redirects=False)
+                        mine.append((time.perf_counter() - start, queries_of(response.headers), response.status_code < 400))
+                    except requests.RequestException:
+                        mine.append((time.perf_counter() - start, None, False))
+                with lock:
+                    samples.extend(mine)
+
+            workers = [threading.Thread(target=client, args=(by_role, rng.random())) for by_role in sessions]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            results[name] = summarize(samples, time.perf_counter() - start)
+    finally:
+        server.shutdown()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fmt(value, spec='8.1f'):
+    return format(value, spec) if value is not None else f"{'-':>8}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000], help="seeded customers per database")
+    parser.add_argument('--requests', type=int, default=100, help="requests per endpoint (per client for wsgi)")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-results.json'),
+                        help="JSON report path (default: benchmarks/benchmark-results.json, not tracked by git)")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="app config override, VALUE as JSON if it parses (e.g. --set SQLITE_BEGIN=DEFERRED)")
+    parser.add_argument('--compare', help="earlier JSON report to compare p95 latencies with")
+    args = parser.parse_args()
+    overrides = {}
+    for item in args.set:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+
+    report = {'commit': git_commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'config': vars(args), 'results': []}
+    for users in args.scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            rng = random.Random(args.seed)
+            app, info = build(tmp, users, args.seed, overrides)
+            for mode in ('test_client', 'wsgi'):
+                if mode == 'test_client':
+                    results = run_test_client(app, info, args.requests, rng)
+                else:
+                    results = run_wsgi(app, info, args.clients, args.requests, rng)
+                rss = rss_mb()
+                for endpoint, row in results.items():
+                    report['results'].append({'scale': users, 'mode': mode, 'endpoint': endpoint, **row, 'rss_mb': rss})
+            with app.app_context():
+                db.session.remove()
+                db.engine.dispose()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {(row['scale'], row['mode'], row['endpoint']): row for row in json.load(f)['results']}
+
+    print(f"{'scale':>7} {'mode':<12} {'endpoint':<24} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'req/s':>8} {'errors':>6} {'rss MB':>8}"
+          + (f" {'p95 was':>8} {'change':>8}" if previous else ''))
+    for row in report['results']:
+        line = (f"{row['scale']:>7} {row['mode']:<12} {row['endpoint']:<24} {fmt(row['p50_ms'])} {fmt(row['p95_ms'])} "
+                f"{fmt(row['p99_ms'])} {fmt(row['queries_per_request'])} {fmt(row.get('throughput_rps'))} {row['errors']:>6} {row['rss_mb']:8.0f}")
+        before = previous.get((row['scale'], row['mode'], row['endpoint']))
+        if before and before['p95_ms'] and row['p95_ms']:
+            line += f" {fmt(before['p95_ms'])} {(row['p95_ms'] / before['p95_ms'] - 1) * 100:+7.1f}%"
+        print(line)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == '__main__':
+    main()
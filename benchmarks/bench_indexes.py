@@ -0,0 +1,118 @@
+"""
+Shows how the hot-path indexes from migration 1 change SQLite query plans.
+
+Builds a throwaway database with the current models, reverts it to the
+pre-index schema, seeds it with --drug-orders rows (1M by default), and prints
+EXPLAIN QUERY PLAN output plus timings for the dashboard, orders and login
+queries before and after `migrations.upgrade`.
+
+    python benchmarks/bench_indexes.py --drug-orders 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine
+from db import db
+import models  # noqa: F401 (registers the tables on db.metadata)
+import migrations
+
+QUERIES = {
+    'pending tab': (
+        "SELECT id, order_id FROM drug_order WHERE prescription_approved IS NULL "
+        "ORDER BY date_ordered DESC LIMIT 10", ()),
+    'user orders': (
+        'SELECT id FROM "order" WHERE user_id = ?', (4242,)),
+    'unpaid approved count': (
+        'SELECT COUNT(DISTINCT d.order_id) FROM "order" o JOIN drug_order d ON d.order_id = o.id '
+        'WHERE o.user_id = ? AND d.prescription_approved = 1 AND d.paid = 0', (4242,)),
+    'pay lines of order': (
+        'SELECT id FROM drug_order WHERE order_id = ? AND paid = 0', (31337,)),
+    'login lookup': (
+        'SELECT id FROM users WHERE lower(email) = lower(?)', ('User4242@example.com',)),
+}
+
+def seed(path, n_users, n_drug_orders, lines_per_order, rng):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT INTO users (id, name, email, password, phn, role_id) VALUES (?, ?, ?, 'x', ?, 2)",
+        ((i, f'User {i}', f'user{i}@example.com', f'{i:010d}') for i in range(1, n_users + 1)))
+    conn.executemany("INSERT INTO drug (id, name, price) VALUES (?, ?, ?)",
+                     ((i, f'Drug {i}', 10 + i) for i in range(1, 201)))
+
+    n_orders = n_drug_orders // lines_per_order
+    conn.executemany('INSERT INTO "order" (id, user_id) VALUES (?, ?)',
+                     ((i, rng.randint(1, n_users)) for i in range(1, n_orders + 1)))
+
+    now = datetime.now()
+
+    def lines():
+        for order_id in range(1, n_orders + 1):
+            approved = rng.choice((None, True, True, True, False))
+            paid = approved is True and rng.random() < 0.8
+            date = (now - timedelta(minutes=rng.randint(0, 525600))).isoformat(' ')
+            for _ in range(lines_per_order):
+                yield (order_id, rng.randint(1, 200), rng.randint(1, 200), date, approved, paid, 0)
+
+    conn.executemany(
+        "INSERT INTO drug_order (order_id, drug_id, quantity, date_ordered, prescription_approved, paid, refills) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", lines())
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+def report(engine, label, repeat):
+    print(f"\n=== {label} ===")
+    with engine.connect() as conn:
+        for name, (sql, params) in QUERIES.items():
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.exec_driver_sql(sql, params).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+            print(f"{name:<24} {elapsed:9.3f} ms")
+            for row in plan:
+                print(f"    {row[-1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drug-orders', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--lines-per-order', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=2024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        engine = create_engine(f'sqlite:///{path}')
+        db.metadata.create_all(engine)
+        migrations.stamp(engine)
+        migrations.downgrade(engine, 0)
+
+        start = time.perf_counter()
+        seed(path, args.users, args.drug_orders, args.lines_per_order, random.Random(args.seed))
+        print(f"Seeded {args.drug_orders:,} drug orders in {time.perf_counter() - start:.1f}s")
+
+        report(engine, 'before (version 0, no indexes)', args.repeat)
+
+        start = time.perf_counter()
+        migrations.upgrade(engine, target=1)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+        print(f"\nMigration 1 took {time.perf_counter() - start:.1f}s")
+
+        report(engine, 'after (version 1, hot path indexes)', args.repeat)
+        engine.dispose()
+
+if __name__ == '__main__':
+    main()
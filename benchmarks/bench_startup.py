@@ -0,0 +1,51 @@
+"""
+Cold start time: importing app, building the application and serving the
+first request, each measured in a fresh interpreter.
+
+Every run starts a new Python process in the repository root, so nothing is
+already imported. The process reports three times in milliseconds:
+"import" is `import app`, "create" is create_app() (the module-level `app`
+on trees without a factory), and "first request" is the first GET / through
+the test client. The report shows the median over --runs processes.
+
+    python benchmarks/bench_startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app() if hasattr(module, 'create_app') else module.app
+created = time.perf_counter()
+application.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create': created - imported, 'first request': served - created}))
+"""
+
+def measure(root):
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=root, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--root', default=ROOT, help="checkout to measure (e.g. a worktree of an older commit)")
+    args = parser.parse_args()
+
+    runs = [measure(args.root) for _ in range(args.runs)]
+    for phase in ('import', 'create', 'first request'):
+        print(f"{phase:<14} {statistics.median(run[phase] for run in runs) * 1000:8.1f} ms")
+    total = statistics.median(sum(run.values()) for run in runs)
+    print(f"{'total':<14} {total * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Uploads per second for prescription order creation, before and after
+single-transaction order creation.
+
+Both variants store a distinct file in a throwaway blob store and write one
+Order and one DrugOrder to a throwaway SQLite file (default journal settings,
+so every commit is an fsync). "before" commits the Order and then the
+DrugOrder, as upload() used to; "after" is order_service.create_prescription_order.
+
+    python benchmarks/bench_uploads.py --uploads 500 --size 200000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask
+from db import db
+from models import User, Order, DrugOrder
+import order_summary  # noqa: F401 (the summary hooks run on every real upload too)
+import blobstore
+import order_service
+
+def create_two_commits(user_id, stream, extension):
+    image_file = blobstore.store(stream, extension)
+    order = Order(user_id=user_id)
+    db.session.add(order)
+    db.session.commit()
+    drug_order = DrugOrder(order_id=order.id, image_file=image_file, prescription_approved=None,
+                           date_ordered=datetime.now(timezone.utc))
+    db.session.add(drug_order)
+    db.session.commit()
+    return drug_order
+
+VARIANTS = {
+    'before (two commits)': create_two_commits,
+    'after (one commit)': order_service.create_prescription_order,
+}
+
+def run(create, uploads, size, rng):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            user = User(name='Bench', email='bench@example.com', password='x', phn='0000000000', role_id=2)
+            db.session.add(user)
+            db.session.commit()
+            # Distinct contents, so every upload writes a new blob
+            files = [rng.randbytes(size) for _ in range(uploads)]
+
+            start = time.perf_counter()
+            for data in files:
+                create(user.id, io.BytesIO(data), '.jpg')
+            elapsed = time.perf_counter() - start
+            db.session.remove()
+            db.engine.dispose()
+    return uploads / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uploads', type=int, default=500)
+    parser.add_argument('--size', type=int, default=200_000, help="bytes per uploaded file")
+    parser.add_argument('--seed', type=int, default=2024)
+    args = parser.parse_args()
+
+    for label, create in VARIANTS.items():
+        rate = run(create, args.uploads, args.size, random.Random(args.seed))
+        print(f"{label:<22} {rate:8.1f} uploads/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import event, func, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import attributes
+from db import db
+from models import Blob, DrugOrder
+
+# Content-addressed storage for uploaded files.
+#
+# A file is stored once under its SHA-256, sharded by the first two byte pairs
+# (blobs/ab/cd/abcd...), however many times it is uploaded. DrugOrder columns
+# reference blobs as "<sha256><ext>"; the extension only records how to serve
+# the bytes. The blob table keeps a reference count that the DrugOrder flush
+# events below maintain, and `python manage.py gc-blobs` removes blobs nothing
+# references any more. Names that are not blob references are legacy uploads
+# in the flat upload folder.
+#
+# Files are only ever deleted under the database write lock (lock_blobs), with
+# the blob row rechecked in the same transaction: the rollback cleanup only
+# removes files whose row nobody committed, and gc-blobs only those whose row
+# is unreferenced and has not been referenced for GC_GRACE_SECONDS. store()
+# writes the row (taking the same lock) before it publishes the file, so a
+# concurrent identical upload either sees the file kept or publishes it again.
+
+CHUNK_SIZE = 64 * 1024
+
+# Blobs referenced (or files written) more recently than this are never
+# collected, e.g. a thumbnail stored just before the row that points at it
+GC_GRACE_SECONDS = 3600
+
+BLOB_REF = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]{1,8})?$')
+
+# DrugOrder columns that may hold blob references
+REFERENCE_COLUMNS = ('image_file', 'thumb_file', 'preview_file')
+
+
+def parse_ref(ref):
+    """
+    Returns the blob id of a "<sha256><ext>" reference, or None for anything
+    else (legacy file names, None).
+    """
+    match = BLOB_REF.match(ref or '')
+    return match.group(1) if match else None
+
+
+def blob_root(config=None):
+    config = config if config is not None else current_app.config
+    return config.get('BLOB_FOLDER') or os.path.join(config['UPLOAD_FOLDER'], 'blobs')
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, blob_id):
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    def exists(self, blob_id):
+        return os.path.exists(self.path(blob_id))
+
+    def write(self, stream, chunk_size=CHUNK_SIZE):
+        """
+        Copies `stream` into the store, hashing it on the way, and returns
+        (blob_id, size). Only one chunk is held in memory at a time.
+        """
+        blob_id, size, _ = self.put(stream, chunk_size)
+        return blob_id, size
+
+    def put(self, stream, chunk_size=CHUNK_SIZE):
+        """
+        Like `write`, but also returns whether this call created the file.
+        """
+        blob_id, size, temp_path = self.stage(stream, chunk_size)
+        return blob_id, size, self.publish(blob_id, temp_path)
+
+    def stage(self, stream, chunk_size=CHUNK_SIZE):
+        """
+        Copies `stream` to a temp file in the store, hashing it on the way.
+        Returns (blob_id, size, temp_path); publish() moves it into place.
+        """
+        temp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest.hexdigest(), size, temp_path
+
+    def publish(self, blob_id, temp_path):
+        """
+        Moves a staged file to its blob path, unless identical content is
+        already there. Returns whether this call created the file.
+        """
+        path = self.path(blob_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unlike an exists() check followed by a rename, linking fails
+            # atomically when another upload got there first
+            os.link(temp_path, path)
+            created = True
+        except FileExistsError:
+            created = False
+        finally:
+            os.unlink(temp_path)
+        return created
+
+    def delete(self, blob_id):
+        try:
+            os.unlink(self.path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    def files(self):
+        """
+        Yields (blob_id, path) for every stored blob and ('', path) for
+        leftover temp files.
+        """
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                yield (name if parse_ref(name) else ''), path
+
+
+def get_store(config=None):
+    return BlobStore(blob_root(config))
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def lock_blobs(connection):
+    """
+    Takes the lock that file deletions and store() serialise on, held until
+    the transaction ends.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("LOCK TABLE blob IN EXCLUSIVE MODE"))
+    else:
+        # SQLite has a single write lock, and any write statement takes it
+        connection.execute(update(Blob).where(Blob.id.is_(None)).values(refcount=Blob.refcount))
+
+
+def _touch(blob_id, now):
+    return db.session.execute(update(Blob).where(Blob.id == blob_id).values(last_referenced_at=now),
+                              execution_options={'synchronize_session': False}).rowcount
+
+
+def store(stream, extension='', config=None):
+    """
+    Stores `stream` and makes sure its blob row exists in the current
+    session. Returns the reference to save on a DrugOrder column. A file
+    this call created is deleted again if the session rolls back and no
+    other transaction has committed the same blob meanwhile.
+    """
+    blob_store = get_store(config)
+    blob_id, size, temp_path = blob_store.stage(stream)
+    try:
+        # Writing the row first takes the write lock, so nothing deletes the
+        # file published below before this transaction ends
+        now = _utcnow()
+        if not _touch(blob_id, now):
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Blob(id=blob_id, size=size, refcount=0, created_at=now, last_referenced_at=now))
+            except IntegrityError:
+                _touch(blob_id, now)  # stored concurrently by another upload
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    if blob_store.publish(blob_id, temp_path):
+        db.session.info.setdefault('new_blobs', []).append((blob_id, blob_store.path(blob_id)))
+    return blob_id + (extension or '').lower()
+
+
+def local_path(ref, config=None):
+    """
+    Filesystem path of a stored reference, blob or legacy upload.
+    """
+    config = config if config is not None else current_app.config
+    blob_id = parse_ref(ref)
+    if blob_id:
+        return get_store(config).path(blob_id)
+    return os.path.join(config['UPLOAD_FOLDER'], ref)
+
+
+# Files written for a transaction that never commits are not kept around
+# until gc-blobs, unless another transaction committed the same blob in the
+# meantime. Savepoints (as in `store`) fire these events too and are ignored.
+
+@event.listens_for(db.session, 'after_commit')
+def _keep_new_blobs(session):
+    if not session.in_nested_transaction():
+        session.info.pop('new_blobs', None)
+
+@event.listens_for(db.session, 'after_rollback')
+def _remove_new_blobs(session):
+    if session.in_nested_transaction():
+        return
+    new_blobs = session.info.pop('new_blobs', None)
+    if not new_blobs:
+        return
+    with db.engine.begin() as connection:
+        lock_blobs(connection)
+        committed = set(connection.execute(select(Blob.id).where(Blob.id.in_([blob_id for blob_id, _ in new_blobs]))).scalars())
+        for blob_id, path in new_blobs:
+            if blob_id not in committed:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+# Reference counting, kept in step on every DrugOrder flush
+
+def _adjust(connection, deltas):
+    for blob_id, delta in deltas.items():
+        if delta:
+            connection.execute(update(Blob).where(Blob.id == blob_id).values(refcount=Blob.refcount + delta))
+
+def _count(deltas, ref, delta):
+    blob_id = parse_ref(ref)
+    if blob_id:
+        deltas[blob_id] = deltas.get(blob_id, 0) + delta
+
+# Load the previous value when a reference column is assigned, even if it was
+# expired, so after_update always sees which blob lost a reference
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+for _column in REFERENCE_COLUMNS:
+    event.listen(getattr(DrugOrder, _column), 'set', _keep_previous, active_history=True, retval=True)
+
+@event.listens_for(DrugOrder, 'after_insert')
+def _count_inserted(mapper, connection, target):
+    deltas = {}
+    for column in REFERENCE_COLUMNS:
+        _count(deltas, getattr(target, column), 1)
+    _adjust(connection, deltas)
+
+@event.listens_for(DrugOrder, 'after_update')
+def _count_updated(mapper, connection, target):
+    deltas = {}
+    for column in REFERENCE_COLUMNS:
+        history = attributes.get_history(target, column)
+        for ref in history.added:
+            _count(deltas, ref, 1)
+        for ref in history.deleted:
+            _count(deltas, ref, -1)
+    _adjust(connection, deltas)
+
+@event.listens_for(DrugOrder, 'after_delete')
+def _count_deleted(mapper, connection, target):
+    deltas = {}
+    for column in REFERENCE_COLUMNS:
+        history = attributes.get_history(target, column)
+        for ref in (history.deleted or history.unchanged):
+            _count(deltas, ref, -1)
+    _adjust(connection, deltas)
+
+
+def recount(session):
+    """
+    Recomputes every refcount from the DrugOrder columns, e.g. after bulk
+    statements that skipped the flush events. Returns the number corrected.
+    """
+    actual = {}
+    rows = session.execute(select(*[getattr(DrugOrder, column) for column in REFERENCE_COLUMNS])
+                           .execution_options(yield_per=1000))
+    for row in rows:
+        for ref in row:
+            _count(actual, ref, 1)
+    corrected = 0
+    for blob_id, refcount in session.execute(select(Blob.id, Blob.refcount)).all():
+        if refcount != actual.get(blob_id, 0):
+            session.execute(update(Blob).where(Blob.id == blob_id).values(refcount=actual.get(blob_id, 0)))
+            corrected += 1
+    return corrected
+
+
+def collect_garbage(session, blob_store, grace_seconds=GC_GRACE_SECONDS, dry_run=False):
+    """
+    Deletes unreferenced blobs and stray files older than the grace period.
+    Returns counts of what was (or, with dry_run, would be) removed.
+    """
+    if not dry_run:
+        # Held until the commit below, while rows are rechecked and files deleted
+        lock_blobs(session.connection())
+    stats = {'recounted': recount(session), 'blobs': 0, 'files': 0, 'bytes': 0}
+    cutoff = _utcnow() - timedelta(seconds=grace_seconds)
+    unused = (Blob.refcount <= 0) & (func.coalesce(Blob.last_referenced_at, Blob.created_at) < cutoff)
+
+    orphans = session.execute(select(Blob.id, Blob.size).where(unused)).all()
+    removed = set()
+    for blob_id, size in orphans:
+        if not dry_run:
+            if not session.execute(Blob.__table__.delete().where(Blob.id == blob_id, unused)).rowcount:
+                continue
+            blob_store.delete(blob_id)
+            removed.add(blob_id)
+        stats['blobs'] += 1
+        stats['bytes'] += size
+
+    # Files with no blob row: crashed uploads and leftover temp files
+    known = set(session.execute(select(Blob.id)).scalars()) - removed
+    stale_before = time.time() - grace_seconds
+    for blob_id, path in list(blob_store.files()):
+        if blob_id in known or blob_id in removed or os.path.getmtime(path) >= stale_before:
+            continue
+        stats['files'] += 1
+        stats['bytes'] += os.path.getsize(path)
+        if not dry_run:
+            os.unlink(path)
+    if not dry_run:
+        session.commit()
+    return stats
@@ -0,0 +1,7 @@
+# One blueprint per area of the site, registered by app.create_app:
+#   main        home page and support form
+#   auth        registration, login, account pages and the users API
+#   pharmacist  dashboard and prescription review
+#   orders      customer orders, tracking and payment
+#   catalog     drug list and drug API
+#   uploads     prescription uploads and serving uploaded files
@@ -0,0 +1,185 @@
+from flask import Blueprint, Response, stream_with_context, render_template, jsonify, request, redirect, url_for, flash
+from flask_login import login_required, current_user, login_user, logout_user
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from db import db
+from database import read_only
+from models import User
+from counters import order_counters
+from extensions import login_manager
+from passwords import hash_password, check_password, needs_rehash
+from forms import RegistrationForm, LoginForm, UserUpdateForm
+from http_cache import conditional, TableVersion
+import user_listing
+import principal
+import rate_limit
+from rate_limit import limit
+
+bp = Blueprint('auth', __name__)
+
+# Served from the session-cached principal; see principal.py
+login_manager.user_loader(principal.load)
+
+# Registration form
+@bp.route("/register", methods=['GET', 'POST'])
+def register():
+    form = RegistrationForm()
+    if request.method == 'POST':
+        if form.validate():
+            # Only submissions that pass validation count, so typos cannot lock out a shared address
+            rate_limit.check('register')
+            user = User.query.filter(func.lower(User.email) == func.lower(form.email.data)).first()
+            user_phn = User.query.filter_by(phn=form.phn.data).first()
+            if user:
+                flash('A user with this email already exists. Please log in or use a different email.', 'danger')
+            elif user_phn:
+                flash('A user with this PHN already exists. Please log in or use a different PHN.', 'danger')
+            else:
+                hashed_password = hash_password(form.password.data)
+                user = User(name=form.name.data, email=form.email.data.lower(), phn=form.phn.data, password=hashed_password, role_id=2) 
+                db.session.add(user)
+                db.session.commit()
+                flash('Your account has been created! You can now log in.', 'success')
+                return redirect(url_for('auth.login'))
+        else:
+            for field, errors in form.errors.items():
+                for error in errors:
+                    flash(f"Error in {getattr(form, field).label.text}: {error}", 'danger')
+    return render_template('register.html', title='Register', form=form)
+
+# Login route
+@bp.route("/login", methods=['GET', 'POST'])
+@limit('login', account=lambda: request.form.get('email', '').strip().lower())
+def login():
+    form = LoginForm()
+    if form.validate_on_submit():
+        user = User.query.filter(func.lower(User.email) == func.lower(form.email.data)).first()
+        if user:
+            if check_password(form.password.data, user.password):
+                # Upgrade hashes made with another bcrypt cost while the password is at hand
+                if needs_rehash(user.password):
+                    user.password = hash_password(form.password.data)
+                    db.session.commit()
+                login_user(user)
+                principal.remember(user)
+                flash('You have successfully logged in!', 'success')
+                return redirect(url_for('auth.dashboard'))
+            else:
+                flash('Incorrect password. Please try again.', 'danger')
+        else:
+            flash('Invalid email.', 'danger')
+    return render_template('login.html', title='Login', form=form)
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    principal.forget()
+    flash('You have successfully logged out.', 'success')
+    return redirect(url_for('main.home'))
+
+# Dashboard Route
+@bp.route("/dashboard")
+@login_required
+@read_only
+def dashboard():
+    if current_user.is_authenticated:
+        if current_user.role_id == 1:  # if the user is a pharmacist, count unapproved orders from all users
+            counters = order_counters()
+        else:  # for other users, only their own orders
+            counters = order_counters(current_user.id)
+
+        return render_template('dashboard.html', title='Dashboard', name=current_user.name, email=current_user.email, unpaid_approved_count=counters.unpaid_approved, total_unapproved_count=counters.unapproved, denied_count=counters.denied)
+    else:
+        return redirect(url_for('auth.login'))
+    
+# User details route
+def format_phone(phone):
+    if phone is None:
+        raise TypeError("Phone number cannot be None")
+    phone = phone.replace("-", "")  # remove any existing dashes
+    phone = "{}-{}-{}".format(phone[:3], phone[3:6], phone[6:])  # insert dashes
+    return phone
+
+@bp.route('/userdetails', methods=['GET', 'POST'])
+@login_required
+def userdetails():
+    form = UserUpdateForm()
+    # current_user is the cached principal; edit the row itself
+    user = db.session.get(User, current_user.id)
+
+    if form.validate_on_submit(): # pragma: no cover
+        if check_password(form.current_password.data, user.password):
+            user.address = form.address.data
+            user.phn = form.phn.data
+
+            # Format phone number with dashes
+            user.phone = format_phone(form.phone.data)
+
+            if form.new_password.data:
+                user.password = hash_password(form.new_password.data)
+
+            db.session.commit()
+            principal.forget()
+            flash('Your account information has been updated!', 'success')
+            return redirect(url_for('auth.userdetails'))
+        else:
+            flash('Incorrect current password.', 'error')
+
+    elif request.method == 'GET':
+        form.name.data = user.name
+        form.address.data = user.address
+        form.phone.data = user.phone
+        form.email.data = user.email
+        form.phn.data = user.phn  # populate PHN field
+
+    return render_template('userdetails.html', title='User Details', form=form)
+
+
+# Moved by the database on every change to users, whoever makes it, so /api/users can answer 304
+users_version = TableVersion(User.__tablename__)
+
+@bp.route("/api/users") 
+@conditional(lambda: users_version.current(), cache_control='private, no-cache', last_modified=lambda current: current.changed_at)
+def users_json():
+    # ?fields=id,name selects only those columns
+    try:
+        fields = user_listing.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # ?format=ndjson (or Accept: application/x-ndjson) writes one user per line
+    ndjson = request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+    serialize, mimetype = (user_listing.ndjson, 'application/x-ndjson') if ndjson else (user_listing.json_array, 'application/json')
+
+    # With ?limit= (and the cursor from the Link header) return one page, otherwise stream everyone
+    limit = request.args.get('limit')
+    if limit is None:
+        return Response(stream_with_context(serialize(user_listing.stream_users(fields))), mimetype=mimetype)
+    if not limit.isdigit() or not 1 <= int(limit) <= user_listing.MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {user_listing.MAX_LIMIT}"}), 400
+
+    page = user_listing.users_page(fields, cursor=request.args.get('cursor'), limit=int(limit))
+    response = Response(serialize(page), mimetype=mimetype)
+    links = []
+    if page.has_next:
+        links.append('<' + url_for('auth.users_json', **dict(request.args, cursor=page.next_cursor)) + '>; rel="next"')
+    if page.has_prev:
+        links.append('<' + url_for('auth.users_json', **dict(request.args, cursor=page.prev_cursor)) + '>; rel="prev"')
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    return response
+
+# API route to create a new user
+@bp.route("/api/users", methods=["POST"])
+def create_user():
+    data = request.json
+    if not data or "name" not in data or "phone" not in data:
+        return "Invalid request", 400
+    new_user = User(name=data["name"], phone=data["phone"]) 
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return "A user with this name already exists", 400
+    return jsonify({"message": "User created successfully!"})
@@ -0,0 +1,25 @@
+from flask import Blueprint, Response, render_template, jsonify
+from catalog import drug_catalog
+from http_cache import conditional
+
+bp = Blueprint('catalog', __name__)
+
+# Drugs Available route
+@bp.route("/drugs")
+def drugs():
+  return render_template("drugs.html", drugs=drug_catalog.all())
+
+# API route to get all drugs in JSON format, served from the catalog cache
+@bp.route("/api/drugs")
+@conditional(lambda: drug_catalog.digest(), cache_control='public, max-age=60', last_modified=lambda digest: drug_catalog.changed_at)
+def drugs_json():
+  return Response(drug_catalog.list_json(), mimetype="application/json")
+
+# API route to get a specific drug in JSON format
+@bp.route("/api/drugs/<int:drug_id>")
+@conditional(lambda drug_id: drug_catalog.digest(), cache_control='public, max-age=60', last_modified=lambda digest: drug_catalog.changed_at)
+def drug_detail_json(drug_id):
+  body = drug_catalog.detail_json(drug_id)
+  if body is None:
+    return jsonify({"error": "Drug not found"}), 404
+  return Response(body, mimetype="application/json")
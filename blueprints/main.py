@@ -0,0 +1,23 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from forms import SupportForm
+
+bp = Blueprint('main', __name__)
+
+# Home route
+@bp.route("/")
+def home():
+    return render_template("base.html", name="Chris")
+
+# Support route
+@bp.route("/support", methods=["GET", "POST"])
+def support():
+    form = SupportForm()
+    if form.validate_on_submit():
+        # Logic to handle support queries
+        flash('Your message has been sent successfully!', 'success')
+        return redirect(url_for('main.support'))
+    elif request.method == 'POST':
+        for field, errors in form.errors.items():
+            for error in errors:
+                flash(f"Error in the {getattr(form, field).label.text} field - {error}", 'error')
+    return render_template("support.html", form=form)
@@ -0,0 +1,95 @@
+from flask import Blueprint, render_template, jsonify, request
+from flask_login import login_required, current_user
+from sqlalchemy.orm import selectinload
+from db import db
+from database import read_only
+from models import Order, DrugOrder
+from pagination import keyset_paginate
+from rate_limit import limit
+
+bp = Blueprint('orders', __name__)
+
+# Payments are throttled per user as well as per address
+def paying_account():
+    return current_user.id if current_user.is_authenticated else None
+
+@bp.route('/track', methods=['GET'])
+@login_required
+def track():
+    order_id = request.args.get('order_id', default = 1, type = int)
+    return render_template('track.html', order_id=order_id)
+
+# Orders route
+@bp.route('/orders')
+@login_required
+@read_only
+def orders():
+    # Orders carry their own status, totals and latest date, so each page is a range scan on (user_id, latest_date_ordered)
+    query = Order.query.filter(Order.user_id == current_user.id, Order.item_count > 0).options(
+        selectinload(Order.items).joinedload(DrugOrder.drug))
+    orders = keyset_paginate(query, [Order.latest_date_ordered, Order.id], cursor=request.args.get('cursor'), per_page=20)
+    return render_template('orders.html', orders=orders)
+
+@bp.route('/getDenyReason', methods=['POST'])
+@limit('deny_reason')
+def get_deny_reason():
+    data = request.get_json()
+    order_id = data.get('orderId')
+
+    if order_id is None:
+        return jsonify({'success': False, 'error': 'No orderId provided'}), 400
+
+    drug_order = db.session.get(DrugOrder, order_id)
+
+    if drug_order is None:
+        return jsonify({'success': False, 'error': 'No order found with this id'}), 404
+
+    return jsonify({'success': True, 'denyReason': drug_order.denyreason})
+
+@bp.route('/pay', methods=['POST'])
+@limit('pay', account=paying_account)
+def pay():
+    data = request.get_json()
+    drug_order_id = data.get('orderId')
+
+    if drug_order_id is None:
+        return jsonify(success=False, error='No order ID provided'), 400
+
+    # Get the DrugOrder with the provided id
+    drug_order = db.session.get(DrugOrder, drug_order_id)
+
+    if drug_order is None:
+        return jsonify(success=False, error='No order found with this ID'), 404
+
+    # Get the Order of the DrugOrder
+    order = drug_order.order
+
+    # Mark all drug_orders in the order as paid
+    for do in order.items:
+        do.paid = True
+
+    db.session.commit()
+
+    return jsonify(success=True)
+
+@bp.route('/payrefill', methods=['POST'])
+@limit('pay', account=paying_account)
+def payrefill():
+    data = request.get_json()
+    order_id = data.get('orderId')
+
+    if order_id is None:
+        return jsonify(success=False, error='No order ID provided'), 400
+
+    drug_order = db.session.get(DrugOrder, order_id)
+
+    if drug_order is None:
+        return jsonify(success=False, error='No order found with this ID'), 404
+
+    if drug_order.refills <= 0:
+        return jsonify(success=False, error='No refills available for this order'), 400
+
+    drug_order.refills -= 1
+    db.session.commit()
+
+    return jsonify(success=True)
@@ -0,0 +1,97 @@
+from flask import Blueprint, render_template, jsonify, request, redirect, url_for, flash
+from flask_login import login_required, current_user
+from db import db
+from database import read_only
+from models import Order
+from dashboard_queries import load_dashboard, TABS
+from catalog import drug_catalog
+import review
+
+bp = Blueprint('pharmacist', __name__)
+
+@bp.route('/pharmacistdash')
+@login_required
+@read_only
+def pharmacistdash():
+    # Each tab pages independently with its own opaque cursor
+    cursors = {tab: request.args.get('cursor_' + tab) for tab in TABS}
+    per_page = 10
+    if current_user.role_id != 1:
+        flash('You do not have access to this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    # Fetch unapproved, approved and denied orders as flat rows (users, items and drugs eager loaded)
+    tabs = load_dashboard(cursors, per_page=per_page)
+
+    # Link to another page of one tab while keeping the other tabs where they are
+    def tab_url(tab, cursor):
+        args = {'cursor_' + t: c for t, c in cursors.items() if c}
+        args['cursor_' + tab] = cursor
+        return url_for('pharmacist.pharmacistdash', **args)
+
+    # Pass the page rows to the template
+    return render_template('pharmacistdash.html', unapproved_prescriptions=tabs['pending'], approved_orders=tabs['approved'], denied_orders=tabs['denied'], tab_url=tab_url)
+
+@bp.route('/review_order/<int:order_id>', methods=['GET', 'POST'])
+@login_required
+def review_order(order_id):
+    # Fetch the order from the database
+    order = db.session.get(Order, order_id)
+
+    # If the order doesn't exist, redirect to a different page or show an error
+    if order is None:
+        flash('Order not found', 'error')
+        return redirect(url_for('pharmacist.pharmacistdash'))
+
+    # Check if the form is submitted
+    if request.method == 'POST':
+        # Group the drug_orders-<id>-<field> keys into lines, then apply the
+        # status once per line with all lines and drugs preloaded
+        try:
+            result = review.apply_reviews([review.decision_from_form(order_id, request.form)], request.url_root)[0]
+        except review.ReviewError as e:
+            result = {'success': False, 'error': str(e)}
+        except Exception as e:
+            print('Update failed:', e)
+            result = {'success': False, 'error': 'Update failed'}
+
+        if result['success']:
+            print('Update successful')
+        else:
+            flash(result['error'], 'danger')
+        return redirect(url_for('pharmacist.pharmacistdash'))
+
+    # Render the review_order template
+    drug_orders = order.items
+    drug_order = drug_orders[0] if drug_orders else None
+    drugs = drug_catalog.all()
+    return render_template('review_order.html', order=order, drug_orders=drug_orders, drugs=drugs, drug_order=drug_order)
+
+@bp.route('/api/review/bulk', methods=['POST'])
+@login_required
+def review_bulk():
+    if current_user.role_id != 1:
+        return jsonify({'success': False, 'error': 'Pharmacists only'}), 403
+
+    # Accept either a bare array of decisions or {"decisions": [...]}
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('decisions')
+    if not isinstance(data, list) or not data:
+        return jsonify({'success': False, 'error': 'Expected a non-empty list of decisions'}), 400
+    if len(data) > review.MAX_BULK_DECISIONS:
+        return jsonify({'success': False, 'error': f'At most {review.MAX_BULK_DECISIONS} decisions per request'}), 400
+
+    # Malformed decisions are reported in place; the rest are applied together
+    decisions, results = [], []
+    for item in data:
+        try:
+            decisions.append(review.decision_from_json(item))
+            results.append(None)
+        except review.ReviewError as e:
+            order_id = item.get('order_id') if isinstance(item, dict) else None
+            results.append({'order_id': order_id, 'success': False, 'error': str(e)})
+
+    applied = iter(review.apply_reviews(decisions, request.url_root)) if decisions else iter(())
+    results = [result if result is not None else next(applied) for result in results]
+    return jsonify({'success': all(result['success'] for result in results), 'results': results})
@@ -0,0 +1,85 @@
+import os
+from flask import Blueprint, abort, current_app, render_template, jsonify, request, url_for, flash
+from flask_login import login_required, current_user
+from werkzeug.utils import secure_filename
+from forms import UploadForm
+import images
+import file_serving
+import resumable_upload
+import order_service
+
+bp = Blueprint('uploads', __name__)
+
+def get_uploader_name():
+    return current_user.name
+
+@bp.route('/upload', methods=['GET', 'POST'])
+@login_required
+def upload():
+    form = UploadForm()
+    filename = None
+    if form.validate_on_submit():
+        f = form.file.data
+        original_filename = secure_filename(f.filename)
+        extension = os.path.splitext(original_filename)[1]  # get the extension from the original filename
+
+        # Stored under its content hash; the order and its line are committed together
+        drug_order = order_service.create_prescription_order(current_user.id, f.stream, extension)
+        filename = drug_order.image_file
+
+        # Thumbnail and preview are made in the background
+        images.image_pipeline.submit(current_app._get_current_object(), drug_order.id)
+
+        flash('Your file has been uploaded and is awaiting approval.', 'success')
+
+    return render_template('upload.html', form=form, filename=filename)
+
+@bp.route('/upload/<filename>')
+def uploaded_file(filename):
+    response = file_serving.serve_upload(filename)
+    if response is None:
+        abort(404)
+    return response
+    
+
+# Chunked, resumable uploads: open, PUT chunks at their offset, complete
+def upload_error(e):
+    return jsonify({'success': False, 'error': str(e), **e.details}), e.status
+
+@bp.route('/api/uploads', methods=['POST'])
+@login_required
+def upload_begin():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = resumable_upload.begin(current_user.id, secure_filename(data.get('filename') or ''), data.get('size'))
+    except resumable_upload.UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, **upload}), 201, {'Location': url_for('uploads.upload_chunk', upload_id=upload['upload_id'])}
+
+@bp.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_chunk(upload_id):
+    try:
+        if request.method == 'GET':
+            return jsonify({'success': True, **resumable_upload.status(upload_id, current_user.id)})
+        if request.method == 'DELETE':
+            resumable_upload.cancel(upload_id, current_user.id)
+            return jsonify({'success': True})
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            return jsonify({'success': False, 'error': 'Upload-Offset header is required'}), 400
+        offset = resumable_upload.write_chunk(upload_id, current_user.id, offset, request.stream, request.content_length)
+    except resumable_upload.UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': offset})
+
+@bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def upload_complete(upload_id):
+    try:
+        drug_order = resumable_upload.complete(upload_id, current_user.id)
+    except resumable_upload.UploadError as e:
+        return upload_error(e)
+    images.image_pipeline.submit(current_app._get_current_object(), drug_order.id)
+    return jsonify({'success': True, 'order_id': drug_order.order_id, 'drug_order_id': drug_order.id,
+                    'image_file': drug_order.image_file, 'url': file_serving.upload_url(drug_order.image_file)}), 201
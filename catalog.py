@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+from typing import NamedTuple
+from decimal import Decimal
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from db import db
+from models import Drug
+
+# In-process cache of the drug catalog.
+#
+# The catalog is small and changes rarely, so it is loaded with one query and
+# then served from memory: id and name indexes for lookups, and pre-serialized
+# JSON bytes for /api/drugs and /api/drugs/<id>. Every insert, update or delete
+# of a Drug bumps the catalog version when its transaction commits, and the
+# next read reloads. Other processes see the change after CATALOG_TTL_SECONDS
+# at the latest. Bulk statements on the drug table skip the ORM events and must
+# call drug_catalog.invalidate() themselves.
+
+CATALOG_TTL_SECONDS = 300
+
+
+class CatalogDrug(NamedTuple):
+    id: int
+    name: str
+    price: Decimal
+
+    def to_json(self):
+        return {"id": self.id, "name": self.name, "price": str(self.price)}
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+class DrugCatalog:
+    def __init__(self, ttl=CATALOG_TTL_SECONDS):
+        self.ttl = ttl
+        self.version = 0
+        self.changed_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._loaded_at = 0.0
+        self._drugs = ()
+        self._by_id = {}
+        self._by_name = {}
+        self._list_json = b'[]'
+        self._detail_json = {}
+        self._digest = None
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def _load(self):
+        # Must run inside an app context
+        with self._lock:
+            fresh = self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.ttl
+            if fresh:
+                self.hits += 1
+                return
+            self.misses += 1
+            version = self.version
+            # Always from the primary: a lagging replica would be cached for the whole TTL
+            rows = db.session.execute(select(Drug.id, Drug.name, Drug.price).order_by(Drug.name),
+                                      bind_arguments={'bind': db.engine}).all()
+            drugs = tuple(CatalogDrug(row.id, row.name, row.price) for row in rows)
+            self._drugs = drugs
+            self._by_id = {drug.id: drug for drug in drugs}
+            self._by_name = {drug.name: drug for drug in drugs}
+            self._list_json = _dumps([drug.to_json() for drug in drugs])
+            self._detail_json = {drug.id: _dumps(drug.to_json()) for drug in drugs}
+            # Reloads after the TTL may pick up changes committed by other processes
+            digest = hashlib.sha256(self._list_json).hexdigest()[:16]
+            if digest != self._digest:
+                self._digest = digest
+                self.changed_at = time.time()
+            self._loaded_version = version
+            self._loaded_at = time.monotonic()
+
+    def all(self):
+        """
+        All drugs ordered by name.
+        """
+        self._load()
+        return self._drugs
+
+    def get(self, drug_id):
+        self._load()
+        return self._by_id.get(drug_id)
+
+    def by_name(self, name):
+        self._load()
+        return self._by_name.get(name)
+
+    def list_json(self):
+        self._load()
+        return self._list_json
+
+    def detail_json(self, drug_id):
+        self._load()
+        return self._detail_json.get(drug_id)
+
+    def digest(self):
+        """
+        Hash of the catalog contents, for ETags.
+        """
+        self._load()
+        return self._digest
+
+    def stats(self):
+        return {'version': self.version, 'hits': self.hits, 'misses': self.misses, 'size': len(self._drugs)}
+
+
+drug_catalog = DrugCatalog()
+
+
+# Remember that a transaction changed drugs, and invalidate once it commits
+def _mark_changed(mapper, connection, target):
+    object_session(target).info['drug_catalog_changed'] = True
+
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Drug, _name, _mark_changed)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('drug_catalog_changed', False):
+        drug_catalog.invalidate()
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_on_rollback(session):
+    session.info.pop('drug_catalog_changed', None)
+
+# Recreating the table (tests, manage.py reset) empties it without any row events
+@event.listens_for(Drug.__table__, 'after_create')
+def _invalidate_on_create(target, connection, **kw):
+    drug_catalog.invalidate()
+
+@event.listens_for(Drug.__table__, 'after_drop')
+def _invalidate_on_drop(target, connection, **kw):
+    drug_catalog.invalidate()
@@ -0,0 +1,32 @@
+from typing import NamedTuple
+from sqlalchemy import and_, case, distinct, func, select
+from db import db
+from models import Order, DrugOrder
+
+# Dashboard counters, computed in the database in a single round trip.
+
+class OrderCounters(NamedTuple):
+    unapproved: int
+    unpaid_approved: int
+    denied: int
+
+
+def _orders_where(condition):
+    # COUNT(DISTINCT CASE WHEN <condition> THEN order_id END) - NULLs are not counted
+    return func.count(distinct(case((condition, DrugOrder.order_id))))
+
+
+def order_counters(user_id=None):
+    """
+    Counts the distinct orders with unapproved, approved-but-unpaid and denied
+    lines, for one customer or (user_id=None) for the whole pharmacy.
+    """
+    stmt = select(
+        _orders_where(DrugOrder.prescription_approved.is_(None)),
+        _orders_where(and_(DrugOrder.prescription_approved == True, DrugOrder.paid == False)),
+        _orders_where(DrugOrder.prescription_approved == False),
+    ).select_from(DrugOrder)
+    if user_id is not None:
+        stmt = stmt.join(Order, Order.id == DrugOrder.order_id).where(Order.user_id == user_id)
+    unapproved, unpaid_approved, denied = db.session.execute(stmt).one()
+    return OrderCounters(unapproved or 0, unpaid_approved or 0, denied or 0)
@@ -0,0 +1,89 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy.orm import joinedload, selectinload
+from models import Order, DrugOrder
+from pagination import keyset_paginate
+
+# Rows handed to pharmacistdash.html, one KeysetPage of them per tab. They only
+# hold plain values, so rendering a page can never fall back to lazy loading
+# order.user / order.items / item.drug.
+
+@dataclass
+class DashboardLine:
+    drug_name: Optional[str]
+    quantity: Optional[int]
+    refills: Optional[int]
+    prescription_approved: Optional[bool]
+
+
+@dataclass
+class DashboardRow:
+    id: int
+    user_name: Optional[str]
+    user_email: Optional[str]
+    user_phn: Optional[str]
+    date_ordered: Optional[datetime]
+    image_file: Optional[str]
+    thumb_file: Optional[str] = None
+    preview_file: Optional[str] = None
+    denyreason: Optional[str] = None
+    lines: List[DashboardLine] = field(default_factory=list)
+
+
+# Dashboard tabs, named after the Order.status values they list
+TABS = ('pending', 'approved', 'denied')
+
+
+def _line_visible(tab, item):
+    # The approved tab lists approved lines, the other two list everything not yet approved
+    if tab == 'approved':
+        return bool(item.prescription_approved)
+    return not item.prescription_approved
+
+
+def _to_row(tab, order):
+    items = order.items
+    user = order.user
+    first = items[0] if items else None
+    row = DashboardRow(
+        id=order.id,
+        user_name=user.name if user else None,
+        user_email=user.email if user else None,
+        user_phn=user.phn if user else None,
+        date_ordered=first.date_ordered if first else None,
+        image_file=first.image_file if first else None,
+        thumb_file=first.thumb_file if first else None,
+        preview_file=first.preview_file if first else None,
+    )
+    for item in items:
+        if tab == 'denied' and item.prescription_approved is False and row.denyreason is None:
+            row.denyreason = item.denyreason
+        if _line_visible(tab, item):
+            row.lines.append(DashboardLine(
+                drug_name=item.drug.name if item.drug else None,
+                quantity=item.quantity,
+                refills=item.refills,
+                prescription_approved=item.prescription_approved,
+            ))
+    return row
+
+
+def tab_query(tab):
+    # Orders carry their own status, so each tab is a range scan on (status, latest_date_ordered).
+    # One SELECT for the page of orders (users joined in), one for their items and drugs,
+    # regardless of how many orders or lines are on the page.
+    return Order.query.filter(Order.status == tab).options(
+        joinedload(Order.user),
+        selectinload(Order.items).joinedload(DrugOrder.drug),
+    )
+
+
+def load_tab(tab, cursor=None, per_page=10):
+    page = keyset_paginate(tab_query(tab), [Order.latest_date_ordered, Order.id], cursor=cursor, per_page=per_page)
+    return page.map(lambda order: _to_row(tab, order))
+
+
+def load_dashboard(cursors=None, per_page=10):
+    cursors = cursors or {}
+    return {tab: load_tab(tab, cursors.get(tab), per_page) for tab in TABS}
@@ -1,7 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
\ No newline at end of file
+# Bind key of the optional read replica (see database.py)
+REPLICA_BIND = 'replica'
+
+class RoutingSession(Session):
+    """
+    Sends the queries of a read-only session to the replica, when one is
+    configured. Flushes and INSERT/UPDATE/DELETE statements always go to the
+    primary.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing and not getattr(clause, 'is_dml', False):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
@@ -0,0 +1,8 @@
+from flask_bcrypt import Bcrypt
+from flask_login import LoginManager
+
+# Extensions shared by the blueprints. They are created unbound and attached
+# to an application in create_app.
+
+bcrypt = Bcrypt()
+login_manager = LoginManager()
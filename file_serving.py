@@ -0,0 +1,96 @@
+import hashlib
+import mimetypes
+import os
+from flask import current_app, make_response, request, send_file, url_for
+from werkzeug.security import safe_join
+import blobstore
+
+# Serving uploaded prescriptions.
+#
+# Every URL handed to a template names one exact version of a file: blob
+# references are content hashes already, and legacy uploads get a ?v= stamp of
+# their size and modification time. Such URLs are sent with a year-long
+# `immutable` Cache-Control, so browsers never revalidate dashboard
+# thumbnails. Responses carry a strong ETag and go through Werkzeug's
+# conditional handling for If-None-Match and Range requests. With
+# UPLOAD_OFFLOAD set, Flask only checks the request and the front proxy sends
+# the bytes (X-Sendfile for Apache/lighttpd, X-Accel-Redirect for nginx with
+# an `internal` location mapping UPLOAD_ACCEL_PREFIX to UPLOAD_FOLDER).
+
+DEFAULT_CONFIG = {
+    'UPLOAD_MAX_AGE': 365 * 24 * 3600,
+    'UPLOAD_OFFLOAD': None,  # None, 'x-sendfile' or 'x-accel-redirect'
+    'UPLOAD_ACCEL_PREFIX': '/protected-uploads',
+}
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    app.jinja_env.globals['upload_url'] = upload_url
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    return hashlib.sha256(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+def upload_url(ref):
+    """
+    Versioned URL of an uploaded file, safe to cache forever.
+    """
+    if blobstore.parse_ref(ref):
+        return url_for('uploads.uploaded_file', filename=ref)
+    try:
+        return url_for('uploads.uploaded_file', filename=ref, v=fingerprint(blobstore.local_path(ref)))
+    except OSError:
+        return url_for('uploads.uploaded_file', filename=ref)
+
+
+def _offload(response, path, config):
+    mode = config['UPLOAD_OFFLOAD']
+    if mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = path
+    elif mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, config['UPLOAD_FOLDER'])
+        if relative.startswith('..'):
+            return False  # outside the folder the proxy knows about
+        response.headers['X-Accel-Redirect'] = config['UPLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + relative.replace(os.sep, '/')
+    else:
+        return False
+    return True
+
+
+def serve_upload(ref):
+    """
+    Response for /upload/<ref>, or None when there is no such file.
+    """
+    config = current_app.config
+    blob_id = blobstore.parse_ref(ref)
+    path = blobstore.local_path(ref, config) if blob_id else safe_join(config['UPLOAD_FOLDER'], ref)
+    if path is None or not os.path.isfile(path):
+        return None
+
+    if blob_id:
+        etag, immutable = blob_id, True
+    else:
+        etag = fingerprint(path)
+        immutable = request.args.get('v') == etag
+    mimetype = mimetypes.guess_type(ref)[0] or 'application/octet-stream'
+
+    if config['UPLOAD_OFFLOAD']:
+        # Answer 304s here; on a 200 the proxy supplies the body
+        response = make_response(b'')
+        response.mimetype = mimetype
+        response.set_etag(etag)
+        response.make_conditional(request)
+        if response.status_code == 200 and not _offload(response, path, config):
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=None)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=None)
+
+    # Prescriptions are personal, so shared caches must not keep them
+    if immutable:
+        response.headers['Cache-Control'] = f"private, max-age={config['UPLOAD_MAX_AGE']}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
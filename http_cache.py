@@ -0,0 +1,88 @@
+import calendar
+import hashlib
+from collections import namedtuple
+from functools import wraps
+from flask import request, make_response
+from werkzeug.http import http_date
+from db import db
+from models import TableVersion as TableVersionRow, version_trigger_ddl
+
+# Conditional GET support for read-only endpoints.
+#
+# @conditional(version) computes a strong ETag from a cheap version before
+# the view runs. When the client's If-None-Match matches, the view is skipped
+# and a bodiless 304 is returned. Versions must mean the same thing in every
+# process: a hash of the content (the drug catalog) or a counter the database
+# keeps (TableVersion), so any worker, before or after a restart, sends the
+# same ETag for the same data.
+
+Validator = namedtuple('Validator', 'version changed_at')
+
+
+class TableVersion:
+    """
+    The `table_version` row of a table, which database triggers bump on every
+    insert, update or delete (see models.TableVersion). Reading it is one
+    primary-key lookup on the primary database.
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def current(self):
+        """
+        A Validator, or None when this database keeps no version for the
+        table (no triggers, or the migration has not run).
+        """
+        if not version_trigger_ddl(db.engine.dialect.name, self.table):
+            return None
+        row = db.session.execute(
+            db.select(TableVersionRow.version, TableVersionRow.changed_at).where(TableVersionRow.name == self.table),
+            bind_arguments={'bind': db.engine}).first()
+        if row is None:
+            return None
+        return Validator(row.version, calendar.timegm(row.changed_at.timetuple()) + row.changed_at.microsecond / 1e6)
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return digest[:32]
+
+
+def conditional(version, cache_control='no-cache', last_modified=None):
+    """
+    `version` is called with the view's arguments and returns anything that
+    changes whenever the response would, or None to serve the view without
+    validators; the request's query string is included automatically.
+    `last_modified`, if given, is called with that version and returns a
+    unix time.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = version(*args, **kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+            etag = make_etag(request.path, request.query_string.decode(), current)
+            modified = last_modified(current) if last_modified else None
+
+            # If-Modified-Since only counts when the client sent no ETag
+            if request.if_none_match:
+                not_modified = etag in request.if_none_match
+            else:
+                since = request.if_modified_since
+                not_modified = modified is not None and since is not None and since.timestamp() >= int(modified)
+
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            if modified is not None:
+                response.headers['Last-Modified'] = http_date(modified)
+            return response
+        return wrapper
+    return decorator
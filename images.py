@@ -0,0 +1,145 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from db import db
+from models import DrugOrder
+import blobstore
+
+# Prescription image pipeline.
+#
+# After an upload commits, the line's image is handed to a small thread pool
+# (Pillow releases the GIL while decoding, resizing and encoding) which writes
+# a size-capped thumbnail for the dashboards and a web-optimized preview into
+# the blob store, then records dimensions, byte sizes and the derived blob
+# references on the DrugOrder. Derived files are re-encoded from pixels only, so
+# EXIF data (GPS position, device, timestamps) never reaches them; the
+# original is kept byte for byte as the prescription of record. PDFs and
+# unreadable files are left alone and the templates fall back to the original.
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'IMAGE_WORKERS': 2,
+    'IMAGE_THUMBNAIL_SIZE': (240, 240),
+    'IMAGE_PREVIEW_SIZE': (1600, 1600),
+    'IMAGE_THUMBNAIL_QUALITY': 70,
+    'IMAGE_PREVIEW_QUALITY': 82,
+    # Run the pipeline in the request instead of the pool (always on under TESTING
+    # so tests never race their own teardown)
+    'IMAGE_PIPELINE_EAGER': False,
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+# Orientations 5-8 are rotated by 90 degrees, so width and height swap
+EXIF_ORIENTATION = 0x0112
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+
+def _output_format():
+    from PIL import features
+    return ('WEBP', '.webp') if features.check('webp') else ('JPEG', '.jpg')
+
+
+def render_derivatives(source, config):
+    """
+    Renders the preview and thumbnail of the image at `source`. Returns the
+    DrugOrder column values describing the original and a list of
+    (kind, encoded bytes, extension) for the derived files.
+    """
+    from PIL import Image, ImageOps
+
+    image_format, extension = _output_format()
+    values = {'image_bytes': os.path.getsize(source)}
+    derived = []
+    with Image.open(source) as image:
+        # Record the upright size of the full image, before any reduced-scale decoding
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        values['image_width'], values['image_height'] = width, height
+
+        # Let JPEG decode at a reduced scale when the preview is much smaller
+        image.draft('RGB', tuple(config['IMAGE_PREVIEW_SIZE']))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        for kind, size, quality in (('preview', config['IMAGE_PREVIEW_SIZE'], config['IMAGE_PREVIEW_QUALITY']),
+                                    ('thumb', config['IMAGE_THUMBNAIL_SIZE'], config['IMAGE_THUMBNAIL_QUALITY'])):
+            # thumbnail() keeps the aspect ratio and never enlarges; the preview feeds the smaller thumbnail
+            image.thumbnail(tuple(size), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, image_format, quality=quality)
+            derived.append((kind, out.getvalue(), extension))
+    return values, derived
+
+
+def process_drug_order(drug_order_id, config):
+    """
+    Runs the pipeline for one line and commits the result. Returns the values
+    written, or None when there was nothing to do.
+    """
+    line = db.session.get(DrugOrder, drug_order_id)
+    if line is None or not line.image_file:
+        return None
+    if os.path.splitext(line.image_file)[1].lower() not in IMAGE_EXTENSIONS:
+        return None
+    try:
+        values, derived = render_derivatives(blobstore.local_path(line.image_file, config), config)
+    except Exception as e:
+        log.warning("Could not process image %s of line %s: %s", line.image_file, drug_order_id, e)
+        return None
+    for kind, data, extension in derived:
+        values[f'{kind}_file'] = blobstore.store(io.BytesIO(data), extension, config)
+        values[f'{kind}_bytes'] = len(data)
+    for column, value in values.items():
+        setattr(line, column, value)
+    db.session.commit()
+    return values
+
+
+class ImagePipeline:
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, app, drug_order_id):
+        with app.app_context():
+            try:
+                return process_drug_order(drug_order_id, app.config)
+            except Exception:
+                log.exception("Image pipeline failed for line %s", drug_order_id)
+            finally:
+                db.session.remove()
+
+    def submit(self, app, drug_order_id):
+        """
+        Queues a committed line for processing and returns a Future.
+        """
+        if app.config['IMAGE_PIPELINE_EAGER'] or app.testing:
+            future = Future()
+            try:
+                future.set_result(process_drug_order(drug_order_id, app.config))
+            except Exception as e:
+                log.exception("Image pipeline failed for line %s", drug_order_id)
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS'], thread_name_prefix='images')
+            return self._executor.submit(self._run, app, drug_order_id)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+image_pipeline = ImagePipeline()
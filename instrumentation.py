@@ -0,0 +1,174 @@
+import bisect
+import logging
+import threading
+import time
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from db import db
+
+# Request and SQL instrumentation.
+#
+# Every request is timed from before_request to after_request, and cursor
+# events on each engine count the statements it runs and the time spent in
+# the database. The totals are
+# - sent back in a Server-Timing header (app and db durations, query count),
+#   so the browser's network panel shows them per request,
+# - logged when a request takes longer than SLOW_REQUEST_MS, or a statement
+#   longer than SLOW_QUERY_MS (with its SQL; the bound parameters hold
+#   emails, password hashes and health numbers, so they are only logged at
+#   DEBUG),
+# - aggregated per endpoint into latency and queries-per-request histograms,
+#   served in Prometheus text format at METRICS_PATH.
+#
+# The metrics page shows endpoint names and traffic, so it is off unless
+# METRICS_PATH is set, and then only belongs behind the proxy, where the
+# scraper reaches it and the public does not. Statements run outside a
+# request, by the image pipeline or the mail worker, still go to the slow
+# query log.
+
+DEFAULT_CONFIG = {
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_QUERY_MS': 100,
+    'SERVER_TIMING': True,
+    'METRICS_PATH': None,  # e.g. '/metrics'
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram, one series per label value.
+    """
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label, value):
+        series = self._series.get(label)
+        if series is None:
+            series = self._series.setdefault(label, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label, (counts, total, count) in sorted(self._series.items()):
+            labels = f'{label_name}="{_escape(label)}"'
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram('drugs2door_request_duration_seconds', 'Request latency by endpoint.', LATENCY_BUCKETS)
+        self.queries = Histogram('drugs2door_request_queries', 'SQL statements per request by endpoint.', QUERY_BUCKETS)
+        self.query_time = Histogram('drugs2door_request_db_seconds', 'Time spent in SQL per request by endpoint.', LATENCY_BUCKETS)
+        self.statuses = {}
+
+    def record(self, endpoint, status, seconds, queries, query_seconds):
+        with self._lock:
+            self.latency.observe(endpoint, seconds)
+            self.queries.observe(endpoint, queries)
+            self.query_time.observe(endpoint, query_seconds)
+            self.statuses[(endpoint, status)] = self.statuses.get((endpoint, status), 0) + 1
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.latency, self.queries, self.query_time):
+                lines += histogram.render('endpoint')
+            lines += ['# HELP drugs2door_requests_total Requests by endpoint and status.',
+                      '# TYPE drugs2door_requests_total counter']
+            for (endpoint, status), count in sorted(self.statuses.items()):
+                lines.append(f'drugs2door_requests_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+        from catalog import drug_catalog
+        lines += ['# HELP drugs2door_catalog Drug catalog cache counters.', '# TYPE drugs2door_catalog gauge']
+        for key, value in drug_catalog.stats().items():
+            lines.append(f'drugs2door_catalog{{stat="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def init_app(app):
+    """
+    Installs the request timers, the SQL hooks and the metrics endpoint.
+    Must run after database.init_app, which creates the engines.
+    """
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    metrics = app.extensions['instrumentation'] = Metrics()
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine, app.config['SLOW_QUERY_MS'])
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+
+    @app.after_request
+    def _record(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        metrics.record(endpoint, response.status_code, elapsed, g.query_count, g.query_time)
+        if app.config['SERVER_TIMING']:
+            response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+            response.headers.add('Server-Timing', f'db;dur={g.query_time * 1000:.1f};desc="{g.query_count} queries"')
+        if elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+            log.warning("Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms", request.method, request.path,
+                        endpoint, elapsed * 1000, g.query_count, g.query_time * 1000)
+        return response
+
+    if app.config['METRICS_PATH']:
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', metrics_view)
+
+
+def metrics_view():
+    body = current_app.extensions['instrumentation'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def instrument_engine(engine, slow_query_ms):
+    """
+    Counts and times the statements run on `engine`.
+    """
+    # The start time is kept on the execution context (or on the connection
+    # for the few statements without one), so a statement that fails leaves
+    # nothing behind
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = time.perf_counter()
+        else:
+            conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = context.query_started if context is not None else conn.info.pop('query_started')
+        elapsed = time.perf_counter() - started
+        if has_request_context() and 'request_started' in g:
+            g.query_count += 1
+            g.query_time += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            log.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+            log.debug("Slow query parameters: %.500r", parameters)
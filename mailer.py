@@ -0,0 +1,262 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, insert, update
+from db import db
+from models import EmailOutbox
+
+# Transactional email outbox.
+#
+# Routes never talk to SMTP. enqueue_email adds a row to email_outbox in the
+# caller's session, so the email is committed (or rolled back) together with
+# the change it announces. A background OutboxWorker, started with
+# `python manage.py mail-worker` or start_outbox_worker(app), delivers due rows
+# in batches over one reused SMTP connection and retries failures with
+# exponential backoff. The SMTP account comes from MAIL_USERNAME and
+# MAIL_PASSWORD in the environment; the worker does not start without them.
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'MAIL_SERVER': os.environ.get('MAIL_SERVER', 'smtp.gmail.com'),
+    'MAIL_PORT': int(os.environ.get('MAIL_PORT', 587)),
+    'MAIL_USE_TLS': os.environ.get('MAIL_USE_TLS', '1') == '1',
+    'MAIL_USERNAME': os.environ.get('MAIL_USERNAME'),
+    'MAIL_PASSWORD': os.environ.get('MAIL_PASSWORD'),
+    'MAIL_TIMEOUT': 30,
+    'MAIL_BATCH_SIZE': 50,
+    'MAIL_MAX_ATTEMPTS': 8,
+    'MAIL_RETRY_BASE_SECONDS': 30,
+    'MAIL_RETRY_MAX_SECONDS': 3600,
+    'MAIL_POLL_SECONDS': 5,
+}
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+
+def utcnow():
+    # Naive UTC, like the outbox timestamps already stored
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_configured(config):
+    return bool(config['MAIL_USERNAME'] and config['MAIL_PASSWORD'])
+
+
+def enqueue_email(to_address, subject, body, order_id=None, status=None):
+    """
+    Queues an email in the current session; the caller's commit makes it
+    visible to the worker. For a given (order_id, status) only one email is
+    kept: a still-queued one is updated in place, and an already-sent one is
+    queued again, so a re-approval after a denial still notifies the user.
+    """
+    message = None
+    if order_id is not None and status is not None:
+        message = EmailOutbox.query.filter_by(order_id=order_id, status=status).first()
+    if message is None:
+        message = EmailOutbox(order_id=order_id, status=status)
+        db.session.add(message)
+    _requeue(message, to_address, subject, body, utcnow())
+    return message
+
+
+def enqueue_emails(messages):
+    """
+    Queues many emails at once, deduplicated like enqueue_email. `messages`
+    are dicts of enqueue_email's arguments. The existing rows of all their
+    orders are read with one IN query and the missing ones are inserted with
+    one statement.
+    """
+    now = utcnow()
+    keyed, new = {}, []
+    for message in messages:
+        if message.get('order_id') is not None and message.get('status') is not None:
+            keyed[message['order_id'], message['status']] = message
+        else:
+            new.append(message)
+    if keyed:
+        existing = db.session.execute(
+            db.select(EmailOutbox).where(EmailOutbox.order_id.in_({order_id for order_id, _ in keyed}))).scalars()
+        for row in existing:
+            message = keyed.pop((row.order_id, row.status), None)
+            if message is not None:
+                _requeue(row, message['to_address'], message['subject'], message['body'], now)
+        new.extend(keyed.values())
+    if new:
+        db.session.execute(insert(EmailOutbox), [
+            {'order_id': message.get('order_id'), 'status': message.get('status'), 'to_address': message['to_address'],
+             'subject': message['subject'], 'body': message['body'], 'attempts': 0, 'next_attempt_at': now}
+            for message in new])
+
+
+def _requeue(message, to_address, subject, body, now):
+    if message.id is not None and message.sent_at is None and message.subject == subject and message.body == body:
+        return
+    message.to_address = to_address
+    message.subject = subject
+    message.body = body
+    message.attempts = 0
+    message.sent_at = None
+    message.last_error = None
+    message.next_attempt_at = now
+
+
+def build_message(sender, message):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    # setup the MIME
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = message.to_address
+    msg['Subject'] = message.subject
+
+    # add in the message body
+    msg.attach(MIMEText(message.body, 'plain'))
+    return msg
+
+
+class SMTPConnection:
+    """
+    One lazily opened SMTP session that is reused across sends and batches,
+    and reopened if the server dropped it.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+
+    def _open(self):
+        import smtplib
+        server = smtplib.SMTP(self.config['MAIL_SERVER'], self.config['MAIL_PORT'], timeout=self.config['MAIL_TIMEOUT'])
+        if self.config['MAIL_USE_TLS']:
+            server.starttls()
+        if self.config['MAIL_USERNAME'] and self.config['MAIL_PASSWORD']:
+            server.login(self.config['MAIL_USERNAME'], self.config['MAIL_PASSWORD'])
+        return server
+
+    def get(self):
+        if self.server is not None:
+            try:
+                if self.server.noop()[0] == 250:
+                    return self.server
+            except Exception:
+                pass
+            self.close()
+        self.server = self._open()
+        return self.server
+
+    def send(self, msg):
+        self.get().sendmail(msg['From'], [msg['To']], msg.as_string())
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+def retry_delay(config, attempts):
+    delay = config['MAIL_RETRY_BASE_SECONDS'] * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, config['MAIL_RETRY_MAX_SECONDS']))
+
+
+def _claim(message_ids, lease):
+    # Push next_attempt_at forward so a second worker does not pick up the same
+    # rows. One UPDATE claims the whole batch; the rows now leased until our
+    # timestamp are the ones this worker got.
+    if not message_ids:
+        return []
+    now = utcnow()
+    leased_until = now + lease
+    db.session.execute(
+        update(EmailOutbox).where(and_(EmailOutbox.id.in_(message_ids), EmailOutbox.sent_at.is_(None),
+                                       EmailOutbox.next_attempt_at <= now))
+        .values(next_attempt_at=leased_until), execution_options={'synchronize_session': False})
+    claimed = db.session.execute(
+        db.select(EmailOutbox.id).where(EmailOutbox.id.in_(message_ids),
+                                        EmailOutbox.next_attempt_at == leased_until)).scalars().all()
+    db.session.commit()
+    return claimed
+
+
+def deliver_due(config, connection, batch_size=None):
+    """
+    Sends one batch of due emails over `connection`. Must run inside an app
+    context. Returns (sent, failed).
+    """
+    batch_size = batch_size or config['MAIL_BATCH_SIZE']
+    due = db.session.execute(
+        db.select(EmailOutbox.id).where(
+            EmailOutbox.sent_at.is_(None),
+            EmailOutbox.next_attempt_at <= utcnow(),
+            EmailOutbox.attempts < config['MAIL_MAX_ATTEMPTS'],
+        ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(batch_size)).scalars().all()
+    # Messages are sent one after another, each within MAIL_TIMEOUT, plus one
+    # timeout to connect; the lease must outlast the whole batch
+    claimed = _claim(due, timedelta(seconds=config['MAIL_TIMEOUT'] * (len(due) + 1)))
+    if not claimed:
+        return 0, 0
+
+    sent = failed = 0
+    messages = EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all()
+    for message in messages:
+        message.attempts += 1
+        try:
+            connection.send(build_message(config['MAIL_USERNAME'] or 'no-reply@drugs2door', message))
+        except Exception as e:
+            failed += 1
+            connection.close()
+            message.last_error = str(e)[:255]
+            message.next_attempt_at = utcnow() + retry_delay(config, message.attempts)
+            log.warning("Email %s to %s failed (attempt %s): %s", message.id, message.to_address, message.attempts, e)
+        else:
+            sent += 1
+            message.sent_at = utcnow()
+            message.last_error = None
+    db.session.commit()
+    return sent, failed
+
+
+class OutboxWorker(threading.Thread):
+    def __init__(self, app, poll_seconds=None):
+        super().__init__(name='email-outbox', daemon=True)
+        self.app = app
+        self.poll_seconds = poll_seconds if poll_seconds is not None else app.config['MAIL_POLL_SECONDS']
+        self.connection = SMTPConnection(app.config)
+        self._stopping = threading.Event()
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                return deliver_due(self.app.config, self.connection)
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                sent, failed = self.run_once()
+            except Exception:
+                log.exception("Email outbox worker failed")
+                sent = failed = 0
+            # Keep draining while there is a backlog, otherwise poll
+            if sent + failed == 0:
+                self._stopping.wait(self.poll_seconds)
+        self.connection.close()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.join(timeout)
+
+
+def start_outbox_worker(app, poll_seconds=None):
+    if not is_configured(app.config):
+        raise RuntimeError("MAIL_USERNAME and MAIL_PASSWORD must be set to run the email outbox worker")
+    worker = OutboxWorker(app, poll_seconds)
+    worker.start()
+    return worker
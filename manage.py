@@ -1,11 +1,21 @@
-from app import app
+from app import create_app
 from db import db
 from models import Drug, Order, DrugOrder, User, Role
 import csv 
 import random
-from sqlalchemy.sql import func
 from datetime import datetime, timedelta
 import bcrypt
+import argparse
+import migrations
+from order_summary import refresh_order_summaries, verify_order_summaries
+import mailer
+import images
+import blobstore
+import resumable_upload
+import seeding
+import passwords
+
+app = create_app()
 
 # Drop all tables in the database
 def drop_tables():
@@ -16,6 +26,20 @@ def drop_tables():
 def create_tables():
     with app.app_context():
         db.create_all()
+        # create_all builds the latest schema, so record it as fully migrated
+        migrations.stamp(db.engine)
+
+# Apply pending schema migrations to an existing database
+def migrate(target=None):
+    with app.app_context():
+        with db.engine.begin() as conn:
+            before = migrations.current_version(conn)
+        applied = migrations.upgrade(db.engine, target)
+    if applied:
+        print(f"Migrated from version {before} to {applied[-1]}: applied {applied}")
+    else:
+        print(f"Database is up to date at version {before}")
+    return applied
 
 def import_data():
   """
@@ -70,6 +94,7 @@ def import_data():
 def create_random_orders(): # pragma: no cover
   with app.app_context():
     users = User.query.join(Role).filter(Role.name != 'Pharmacist').all()  # only get users who are not pharmacists
+    drugs = Drug.query.all()  # picked from in Python; ORDER BY random() is not portable
     for user in users:
 
       num_orders = random.randint(2, 5)
@@ -93,8 +118,7 @@ def create_random_orders(): # pragma: no cover
 
         num_drugs = random.randint(1, 3)  # select a random number of drugs between 1 and 3
         for _ in range(num_drugs):
-            drug_stmt = db.select(Drug).order_by(func.random()).limit(1)
-            drug = db.session.execute(drug_stmt).scalar()
+            drug = random.choice(drugs)
             rand_qty = random.randint(50, 200)
 
             association = DrugOrder(order=order, drug=drug, quantity=rand_qty, date_ordered=date_ordered, date_delivered=date_delivered, prescription_approved=prescription_approved, paid=paid)
@@ -119,9 +143,119 @@ def create_pharmacist():
         db.session.add(pharmacist)
         db.session.commit()
 
-if __name__ == "__main__": # pragma: no cover
+# Recompute the denormalized status and totals on every order
+def backfill_orders():
+    with app.app_context():
+        with db.engine.begin() as conn:
+            refresh_order_summaries(conn)
+            total = conn.execute(db.select(db.func.count(Order.id))).scalar()
+    print(f"Refreshed the summary of {total} orders")
+
+# Report orders whose stored status and totals disagree with their lines
+def verify_orders():
+    with app.app_context():
+        with db.engine.connect() as conn:
+            mismatches = verify_order_summaries(conn)
+    for order_id, column, stored, expected in mismatches:
+        print(f"Order {order_id}: {column} is {stored!r}, expected {expected!r}")
+    print(f"{len(mismatches)} mismatched values")
+    return mismatches
+
+# Make thumbnails and previews for uploads that do not have them yet
+def process_images():
+    with app.app_context():
+        pending = db.session.execute(db.select(DrugOrder.id).where(
+            DrugOrder.image_file.isnot(None), DrugOrder.thumb_file.is_(None))).scalars().all()
+        futures = [images.image_pipeline.submit(app, drug_order_id) for drug_order_id in pending]
+        processed = sum(1 for future in futures if future.result() is not None)
+    images.image_pipeline.shutdown()
+    print(f"Processed {processed} of {len(pending)} images")
+    return processed
+
+# Remove stored files that no order references any more, and abandoned chunked uploads
+def gc_blobs(grace_seconds=blobstore.GC_GRACE_SECONDS, dry_run=False):
+    with app.app_context():
+        stats = blobstore.collect_garbage(db.session, blobstore.get_store(), grace_seconds, dry_run)
+        stats['uploads'] = 0 if dry_run else resumable_upload.expire(app.config)
+    action = "Would remove" if dry_run else "Removed"
+    print(f"{action} {stats['blobs']} unreferenced blobs and {stats['files']} stray files "
+          f"({stats['bytes']} bytes); corrected {stats['recounted']} reference counts")
+    print(f"Removed {stats['uploads']} abandoned chunked uploads")
+    return stats
+
+# Add many users with orders in bulk, for load tests and benchmarks
+def seed_database(users, orders_per_user=(2, 5), lines_per_order=(1, 3), batch_size=5000, rng_seed=2024, as_of=None):
+    with app.app_context():
+        db.create_all()
+        start = datetime.now()
+        totals = seeding.seed(db.engine, users, orders_per_user, lines_per_order, batch_size, rng_seed, as_of)
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"Seeded {totals['users']} users, {totals['orders']} orders and {totals['lines']} order lines in {elapsed:.1f}s")
+    return totals
+
+# Measure the bcrypt cost to pin in PASSWORD_HASH_ROUNDS on this machine
+def calibrate_passwords(target_ms=250):
+    rounds = passwords.calibrate(target_ms)
+    print(f"PASSWORD_HASH_ROUNDS={rounds}")
+    return rounds
+
+# Deliver queued emails until interrupted
+def run_mail_worker(): # pragma: no cover
+    worker = mailer.start_outbox_worker(app)
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+# Rebuild the database from scratch with sample data
+def reset_database(): # pragma: no cover
     drop_tables()
     create_tables()
     import_data()
     create_random_orders()
-    create_pharmacist() 
+    create_pharmacist()
+
+if __name__ == "__main__": # pragma: no cover
+    parser = argparse.ArgumentParser(description="Drugs2Door management commands")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("reset", help="drop and recreate the database with sample data (default)")
+    migrate_parser = commands.add_parser("migrate", help="apply pending schema migrations")
+    migrate_parser.add_argument("--to", type=int, default=None, help="stop at this migration version")
+    commands.add_parser("backfill-orders", help="recompute the stored status and totals of every order")
+    commands.add_parser("verify-orders", help="check stored order status and totals against their lines")
+    commands.add_parser("mail-worker", help="send queued emails from the outbox")
+    commands.add_parser("process-images", help="make thumbnails and previews for unprocessed uploads")
+    gc_parser = commands.add_parser("gc-blobs", help="delete stored files that nothing references")
+    gc_parser.add_argument("--grace", type=int, default=blobstore.GC_GRACE_SECONDS, help="keep files younger than this many seconds")
+    gc_parser.add_argument("--dry-run", action="store_true", help="only report what would be removed")
+    calibrate_parser = commands.add_parser("calibrate-passwords", help="print the bcrypt cost to pin for this machine")
+    calibrate_parser.add_argument("--target-ms", type=float, default=250, help="how long one password hash should take")
+    seed_parser = commands.add_parser("seed", help="bulk-insert generated users and orders for load tests")
+    seed_parser.add_argument("--users", type=int, required=True)
+    seed_parser.add_argument("--orders-per-user", type=int, nargs=2, default=(2, 5), metavar=("MIN", "MAX"))
+    seed_parser.add_argument("--lines-per-order", type=int, nargs=2, default=(1, 3), metavar=("MIN", "MAX"))
+    seed_parser.add_argument("--batch-size", type=int, default=5000, help="users per transaction")
+    seed_parser.add_argument("--seed", type=int, default=2024, help="random seed; the same seed gives the same rows")
+    seed_parser.add_argument("--as-of", type=datetime.fromisoformat, default=None, help="date the order dates count back from (default: today)")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.to)
+    elif args.command == "backfill-orders":
+        backfill_orders()
+    elif args.command == "verify-orders":
+        if verify_orders():
+            raise SystemExit(1)
+    elif args.command == "mail-worker":
+        run_mail_worker()
+    elif args.command == "process-images":
+        process_images()
+    elif args.command == "gc-blobs":
+        gc_blobs(args.grace, args.dry_run)
+    elif args.command == "calibrate-passwords":
+        calibrate_passwords(args.target_ms)
+    elif args.command == "seed":
+        seed_database(args.users, tuple(args.orders_per_user), tuple(args.lines_per_order), args.batch_size, args.seed, args.as_of)
+    else:
+        reset_database()
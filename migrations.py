@@ -0,0 +1,267 @@
+from sqlalchemy import text, inspect, Boolean, DateTime, Integer, Numeric, String, Text, Column, ForeignKey, Index, MetaData, Table, UniqueConstraint
+
+# Lightweight versioned schema migrations.
+#
+# Each migration has an integer version, a description and upgrade/downgrade
+# functions that receive an open connection. The applied version is stored in
+# a one row `schema_version` table. Migrations are written as plain DDL so they
+# describe the schema as it was at that version, not as models.py says today.
+# Run them with `python manage.py migrate`.
+
+MIGRATIONS = []
+
+class Migration:
+    def __init__(self, version, description, upgrade, downgrade=None):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.downgrade = downgrade
+
+def migration(version, description):
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+    return register
+
+def downgrade_for(version):
+    def register(downgrade):
+        get_migration(version).downgrade = downgrade
+        return downgrade
+    return register
+
+def get_migration(version):
+    for m in MIGRATIONS:
+        if m.version == version:
+            return m
+    raise KeyError(f"No migration with version {version}")
+
+def head():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+def _ensure_version_table(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    if conn.execute(text("SELECT COUNT(*) FROM schema_version")).scalar() == 0:
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (0)"))
+
+def current_version(conn):
+    _ensure_version_table(conn)
+    return conn.execute(text("SELECT version FROM schema_version")).scalar()
+
+def _set_version(conn, version):
+    conn.execute(text("UPDATE schema_version SET version = :v"), {"v": version})
+
+def stamp(engine, version=None):
+    """
+    Marks the database as being at `version` (head by default) without running
+    anything. Used after db.create_all(), which already builds the head schema.
+    """
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        _set_version(conn, head() if version is None else version)
+
+def upgrade(engine, target=None):
+    """
+    Applies every migration newer than the stored version, each in its own
+    transaction. Returns the list of versions that were applied.
+    """
+    target = head() if target is None else target
+    applied = []
+    for m in MIGRATIONS:
+        with engine.begin() as conn:
+            if m.version <= current_version(conn) or m.version > target:
+                continue
+            m.upgrade(conn)
+            _set_version(conn, m.version)
+            applied.append(m.version)
+    return applied
+
+def downgrade(engine, target=0):
+    """
+    Reverts migrations newer than `target`, newest first.
+    """
+    reverted = []
+    for m in reversed(MIGRATIONS):
+        with engine.begin() as conn:
+            if m.version > current_version(conn) or m.version <= target:
+                continue
+            if m.downgrade is None:
+                raise RuntimeError(f"Migration {m.version} cannot be reverted")
+            m.downgrade(conn)
+            _set_version(conn, m.version - 1)
+            reverted.append(m.version)
+    return reverted
+
+def has_column(conn, table, column):
+    return column in [c['name'] for c in inspect(conn).get_columns(table)]
+
+def add_column(conn, table, column, type_, default=None):
+    if has_column(conn, table, column):
+        return
+    ddl = f'ALTER TABLE "{table}" ADD COLUMN {column} {type_.compile(dialect=conn.dialect)}'
+    if default is not None:
+        ddl += f' NOT NULL DEFAULT {default}'
+    conn.execute(text(ddl))
+
+
+# Migrations
+
+HOT_PATH_INDEXES = [
+    ('ix_drug_order_approved_date', 'drug_order (prescription_approved, date_ordered)'),
+    ('ix_drug_order_order_paid', 'drug_order (order_id, paid)'),
+    ('ix_order_user_id', '"order" (user_id)'),
+    ('ix_users_email_lower', 'users (lower(email))'),
+]
+
+@migration(1, "Indexes for dashboard, orders and login lookups")
+def add_hot_path_indexes(conn):
+    for name, target in HOT_PATH_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+
+@downgrade_for(1)
+def drop_hot_path_indexes(conn):
+    for name, _ in HOT_PATH_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+ORDER_SUMMARY_COLUMNS = [
+    ('status', String(10), None),
+    ('paid', Boolean(), 'FALSE'),
+    ('item_count', Integer(), '0'),
+    ('total_amount', Numeric(10, 2), '0'),
+    ('latest_date_ordered', DateTime(), None),
+]
+
+ORDER_SUMMARY_INDEXES = [
+    ('ix_order_status_date', '"order" (status, latest_date_ordered)'),
+    ('ix_order_user_date', '"order" (user_id, latest_date_ordered)'),
+]
+
+@migration(2, "Denormalized status and totals on order")
+def add_order_summary(conn):
+    from order_summary import refresh_order_summaries
+    for column, type_, default in ORDER_SUMMARY_COLUMNS:
+        add_column(conn, 'order', column, type_, default)
+    for name, target in ORDER_SUMMARY_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+    refresh_order_summaries(conn)
+
+@downgrade_for(2)
+def drop_order_summary(conn):
+    for name, _ in ORDER_SUMMARY_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for column, _, _ in ORDER_SUMMARY_COLUMNS:
+        if has_column(conn, 'order', column):
+            conn.execute(text(f'ALTER TABLE "order" DROP COLUMN {column}'))
+
+@migration(3, "Email outbox")
+def add_email_outbox(conn):
+    metadata = MetaData()
+    Table('order', metadata, Column('id', Integer, primary_key=True))
+    outbox = Table(
+        'email_outbox', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('order_id', Integer, ForeignKey('order.id'), nullable=True),
+        Column('status', String(20), nullable=True),
+        Column('to_address', String(120), nullable=False),
+        Column('subject', String(255), nullable=False),
+        Column('body', Text, nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('next_attempt_at', DateTime, nullable=False),
+        Column('sent_at', DateTime, nullable=True),
+        Column('last_error', String(255), nullable=True),
+        UniqueConstraint('order_id', 'status', name='uq_email_outbox_order_status'),
+        Index('ix_email_outbox_due', 'sent_at', 'next_attempt_at'),
+    )
+    outbox.create(conn, checkfirst=True)
+
+@downgrade_for(3)
+def drop_email_outbox(conn):
+    conn.execute(text("DROP TABLE IF EXISTS email_outbox"))
+
+IMAGE_COLUMNS = [
+    ('image_width', Integer()),
+    ('image_height', Integer()),
+    ('image_bytes', Integer()),
+    ('thumb_file', String(120)),
+    ('thumb_bytes', Integer()),
+    ('preview_file', String(120)),
+    ('preview_bytes', Integer()),
+]
+
+@migration(4, "Prescription image dimensions and derived files")
+def add_image_columns(conn):
+    for column, type_ in IMAGE_COLUMNS:
+        add_column(conn, 'drug_order', column, type_)
+
+@downgrade_for(4)
+def drop_image_columns(conn):
+    for column, _ in IMAGE_COLUMNS:
+        if has_column(conn, 'drug_order', column):
+            conn.execute(text(f'ALTER TABLE drug_order DROP COLUMN {column}'))
+
+@migration(5, "Content-addressed blob store")
+def add_blob_table(conn):
+    metadata = MetaData()
+    blob = Table(
+        'blob', metadata,
+        Column('id', String(64), primary_key=True),
+        Column('size', Integer, nullable=False),
+        Column('refcount', Integer, nullable=False),
+        Column('created_at', DateTime, nullable=False),
+        Index('ix_blob_refcount', 'refcount'),
+    )
+    blob.create(conn, checkfirst=True)
+
+@downgrade_for(5)
+def drop_blob_table(conn):
+    conn.execute(text("DROP TABLE IF EXISTS blob"))
+
+@migration(6, "Table versions kept by triggers, for /api/users validators")
+def add_table_versions(conn):
+    from datetime import datetime, timezone
+    from models import VERSIONED_TABLES, version_trigger_ddl
+    metadata = MetaData()
+    table_version = Table(
+        'table_version', metadata,
+        Column('name', String(64), primary_key=True),
+        Column('version', Integer, nullable=False),
+        Column('changed_at', DateTime, nullable=False),
+    )
+    table_version.create(conn, checkfirst=True)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for table in VERSIONED_TABLES:
+        if conn.execute(text("SELECT 1 FROM table_version WHERE name = :name"), {"name": table}).first() is None:
+            conn.execute(table_version.insert().values(name=table, version=0, changed_at=now))
+        for statement in version_trigger_ddl(conn.dialect.name, table):
+            conn.exec_driver_sql(statement)
+
+@downgrade_for(6)
+def drop_table_versions(conn):
+    from models import VERSIONED_TABLES
+    for table in VERSIONED_TABLES:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_version ON {table}"))
+        else:
+            for op in ('insert', 'update', 'delete'):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_version_{op}"))
+    conn.execute(text("DROP TABLE IF EXISTS table_version"))
+
+@migration(7, "Last reference time of blobs, for the garbage collector's grace period")
+def add_blob_last_referenced(conn):
+    add_column(conn, 'blob', 'last_referenced_at', DateTime())
+
+@downgrade_for(7)
+def drop_blob_last_referenced(conn):
+    if has_column(conn, 'blob', 'last_referenced_at'):
+        conn.execute(text("ALTER TABLE blob DROP COLUMN last_referenced_at"))
+
+@migration(8, "Built-in roles, so users.role_id can be checked")
+def add_builtin_roles(conn):
+    from models import BUILTIN_ROLES
+    for id, name in BUILTIN_ROLES:
+        if conn.execute(text("SELECT 1 FROM roles WHERE id = :id"), {"id": id}).first() is None:
+            conn.execute(text("INSERT INTO roles (id, name) VALUES (:id, :name)"), {"id": id, "name": name})
+
+@downgrade_for(8)
+def keep_builtin_roles(conn):
+    pass  # users still refer to them
@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, Float, Numeric, ForeignKey, Integer, String, DateTime
+from sqlalchemy import event, Boolean, Float, Numeric, ForeignKey, Integer, String, DateTime, Index, Text, UniqueConstraint, func
 from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
 from db import db
 
 # Define the Role model
@@ -11,6 +12,17 @@ class Role(db.Model):
 
     users = relationship('User', backref='role')
 
+# Roles the code refers to by id: registration creates customers with role 2
+# and role 1 sees the pharmacist dashboard. Every database starts with them,
+# so users.role_id can be a checked foreign key.
+PHARMACIST_ROLE_ID = 1
+USER_ROLE_ID = 2
+BUILTIN_ROLES = ((PHARMACIST_ROLE_ID, 'Pharmacist'), (USER_ROLE_ID, 'user'))
+
+@event.listens_for(Role.__table__, 'after_create')
+def _add_builtin_roles(target, connection, **kw):
+  connection.execute(target.insert(), [{'id': id, 'name': name} for id, name in BUILTIN_ROLES])
+
 # Define the User model
 class User(db.Model):
   __tablename__ = 'users'
@@ -24,6 +36,9 @@ class User(db.Model):
   phn = db.Column(db.String(120), unique=True, nullable=False)
   role_id = db.Column(db.Integer, db.ForeignKey('roles.id')) 
 
+  # Logins and registration look users up by lower(email)
+  __table_args__ = (Index('ix_users_email_lower', func.lower(email)),)
+
 
   @property
   def is_active(self):
@@ -65,21 +80,33 @@ class Drug(db.Model):
     return {
       "id": self.id,
       "name": self.name,
-      "price": self.price,
-      "stock": self.stock,
+      "price": str(self.price),
     }
 
 # Define the Order model
 class Order(db.Model):
   id = db.Column(Integer, primary_key=True)
-  user_id = db.Column(db.Integer, ForeignKey('users.id')) 
+  user_id = db.Column(db.Integer, ForeignKey('users.id'), index=True) 
   items = relationship('DrugOrder', back_populates='order')
 
+  # Summary of the order's DrugOrder lines, kept up to date by order_summary on every flush
+  status = db.Column(db.String(10))  # NULL: no lines yet, 'pending', 'approved' or 'denied'
+  paid = db.Column(Boolean, default=False, nullable=False)
+  item_count = db.Column(Integer, default=0, nullable=False)
+  total_amount = db.Column(db.Numeric(10, 2), default=0, nullable=False)
+  latest_date_ordered = db.Column(DateTime)
+
+  # Pharmacist tabs filter on status, customers list their own orders, both newest first
+  __table_args__ = (
+    Index('ix_order_status_date', 'status', 'latest_date_ordered'),
+    Index('ix_order_user_date', 'user_id', 'latest_date_ordered'),
+  )
+
   def to_json(self):
     return {
       "id": self.id,
       "user_id": self.user_id,
-      "total": sum([item.drug.price * item.quantity for item in self.items]),
+      "total": self.total_amount,
     }
 
 class DrugOrder(db.Model):
@@ -97,6 +124,21 @@ class DrugOrder(db.Model):
   image_file = db.Column(db.String(120), nullable=True)
   paid = db.Column(Boolean, default=False, nullable=False)
 
+  # Filled in by the image pipeline (images.py) after upload; NULL until then or for PDFs
+  image_width = db.Column(Integer, nullable=True)
+  image_height = db.Column(Integer, nullable=True)
+  image_bytes = db.Column(Integer, nullable=True)
+  thumb_file = db.Column(db.String(120), nullable=True)
+  thumb_bytes = db.Column(Integer, nullable=True)
+  preview_file = db.Column(db.String(120), nullable=True)
+  preview_bytes = db.Column(Integer, nullable=True)
+
+  # Dashboard tabs filter on approval and sort by date; orders/payments look up lines by order
+  __table_args__ = (
+    Index('ix_drug_order_approved_date', 'prescription_approved', 'date_ordered'),
+    Index('ix_drug_order_order_paid', 'order_id', 'paid'),
+  )
+
   def to_json(self):
     return {
       "id": self.id,
@@ -110,4 +152,85 @@ class DrugOrder(db.Model):
       "denyreason": self.denyreason,
       "image_file": self.image_file,
       "paid": self.paid,
-    }
\ No newline at end of file
+    }
+
+# Emails waiting to be sent by the outbox worker (see mailer.py)
+class EmailOutbox(db.Model):
+  __tablename__ = 'email_outbox'
+
+  id = db.Column(Integer, primary_key=True)
+  order_id = db.Column(Integer, ForeignKey('order.id'), nullable=True)
+  status = db.Column(String(20), nullable=True)  # what the email announces, e.g. 'approved' or 'denied'
+  to_address = db.Column(String(120), nullable=False)
+  subject = db.Column(String(255), nullable=False)
+  body = db.Column(Text, nullable=False)
+  attempts = db.Column(Integer, default=0, nullable=False)
+  next_attempt_at = db.Column(DateTime, nullable=False)
+  sent_at = db.Column(DateTime, nullable=True)  # NULL until delivered
+  last_error = db.Column(String(255), nullable=True)
+
+  # At most one email per order and status; the worker scans unsent rows that are due
+  __table_args__ = (
+    UniqueConstraint('order_id', 'status', name='uq_email_outbox_order_status'),
+    Index('ix_email_outbox_due', 'sent_at', 'next_attempt_at'),
+  )
+
+# A stored file, named by the SHA-256 of its content (see blobstore.py)
+class Blob(db.Model):
+  __tablename__ = 'blob'
+
+  id = db.Column(String(64), primary_key=True)
+  size = db.Column(Integer, nullable=False)
+  refcount = db.Column(Integer, default=0, nullable=False)  # DrugOrder columns referencing it
+  created_at = db.Column(DateTime, nullable=False)
+  last_referenced_at = db.Column(DateTime, nullable=True)  # last store() of this content; NULL: created_at
+
+  # The garbage collector looks for unreferenced blobs
+  __table_args__ = (
+    Index('ix_blob_refcount', 'refcount'),
+  )
+
+# Change counters kept by the database itself. Triggers bump a table's row on
+# every insert, update or delete, so writes from other workers, from bulk Core
+# statements (seeding.py) and from other programs all move it. /api/users
+# builds its ETag and Last-Modified from the `users` row (see http_cache.py).
+class TableVersion(db.Model):
+  __tablename__ = 'table_version'
+
+  name = db.Column(String(64), primary_key=True)
+  version = db.Column(Integer, default=0, nullable=False)
+  changed_at = db.Column(DateTime, nullable=False)  # UTC
+
+VERSIONED_TABLES = ('users',)
+
+def version_trigger_ddl(dialect_name, table):
+  """
+  The statements that create the triggers bumping `table`'s row of
+  table_version. Only SQLite and PostgreSQL have them; elsewhere the row
+  never moves and http_cache does not answer 304 from it.
+  """
+  if dialect_name == 'sqlite':
+    bump = (f"UPDATE table_version SET version = version + 1, "
+            f"changed_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE name = '{table}';")
+    return [f"CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON {table} BEGIN {bump} END"
+            for op in ('INSERT', 'UPDATE', 'DELETE')]
+  if dialect_name == 'postgresql':
+    return [
+      "CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$ BEGIN "
+      "UPDATE table_version SET version = version + 1, changed_at = now() AT TIME ZONE 'utc' "
+      "WHERE name = TG_TABLE_NAME; RETURN NULL; END $$ LANGUAGE plpgsql",
+      f"CREATE OR REPLACE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE ON {table} "
+      f"FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()",
+    ]
+  return []
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def _add_version_rows(target, connection, **kw):
+  connection.execute(target.insert(), [{'name': table, 'version': 0, 'changed_at': datetime.now(timezone.utc).replace(tzinfo=None)}
+                                       for table in VERSIONED_TABLES])
+
+@event.listens_for(db.metadata, 'after_create')
+def _add_version_triggers(target, connection, **kw):
+  for table in VERSIONED_TABLES:
+    for statement in version_trigger_ddl(connection.dialect.name, table):
+      connection.exec_driver_sql(statement)
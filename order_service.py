@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+from db import db
+from models import Order, DrugOrder
+import blobstore
+
+# Creating orders from uploaded prescriptions.
+#
+# The Order is flushed to get its id and the DrugOrder goes into the same
+# transaction, so there is a single commit (one fsync on SQLite rather than two).
+# A failure part way through can no longer leave behind an Order with no
+# items. The file goes into the blob store first: it is written to a temp file
+# and linked into place once its blob row is written. If the transaction rolls
+# back, the blob store deletes that file again, unless another upload of the
+# same content has committed it meanwhile. An order's rows and its file
+# therefore exist together or not at all.
+
+def create_prescription_order(user_id, stream, extension, config=None):
+    """
+    Stores the uploaded `stream` and creates its Order and DrugOrder. Returns
+    the committed DrugOrder.
+    """
+    try:
+        image_file = blobstore.store(stream, extension, config)
+        order = Order(user_id=user_id)
+        db.session.add(order)
+        db.session.flush()  # assigns order.id
+        drug_order = DrugOrder(order_id=order.id, image_file=image_file, prescription_approved=None,
+                               date_ordered=datetime.now(timezone.utc))
+        db.session.add(drug_order)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return drug_order
@@ -0,0 +1,113 @@
+from decimal import Decimal
+from itertools import chain
+from sqlalchemy import and_, case, event, func, select, update
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm.util import identity_key
+from db import db
+from models import Drug, Order, DrugOrder
+
+# Keeps the summary columns on Order (status, paid, item_count, total_amount,
+# latest_date_ordered) in step with its DrugOrder lines.
+#
+# After every flush that touches a DrugOrder (or a drug's price), the affected
+# orders are recomputed with one UPDATE in the same transaction, so upload,
+# review_order, pay and payrefill never have to remember to do it. Code that
+# writes DrugOrder rows with bulk statements, which skip flush events, must
+# call refresh_order_summaries itself.
+
+SUMMARY_COLUMNS = ('status', 'paid', 'item_count', 'total_amount', 'latest_date_ordered')
+
+# Orders per UPDATE ... WHERE id IN (...) so the parameter list stays small
+BATCH_SIZE = 500
+
+def _summary_expressions():
+    # Correlated subqueries over an order's lines, usable in UPDATE ... SET and in SELECT
+    def over_lines(expr):
+        return select(expr).where(DrugOrder.order_id == Order.id).scalar_subquery()
+
+    line_count = func.count(DrugOrder.id)
+    pending = func.sum(case((DrugOrder.prescription_approved.is_(None), 1), else_=0))
+    denied = func.sum(case((DrugOrder.prescription_approved == False, 1), else_=0))
+    unpaid = func.sum(case((DrugOrder.paid == True, 0), else_=1))
+
+    total = select(func.coalesce(func.sum(Drug.price * DrugOrder.quantity), 0)).select_from(DrugOrder).join(
+        Drug, Drug.id == DrugOrder.drug_id).where(DrugOrder.order_id == Order.id).scalar_subquery()
+
+    return {
+        'status': over_lines(case((line_count == 0, None), (pending > 0, 'pending'), (denied > 0, 'denied'), else_='approved')),
+        'paid': over_lines(case((and_(line_count > 0, unpaid == 0), True), else_=False)),
+        'item_count': over_lines(line_count),
+        'total_amount': total,
+        'latest_date_ordered': over_lines(func.max(DrugOrder.date_ordered)),
+    }
+
+def refresh_order_summaries(conn, order_ids=None):
+    """
+    Recomputes the summary columns for the given orders, or for every order
+    when order_ids is None (used by `manage.py backfill-orders`).
+    """
+    stmt = update(Order.__table__).values(**_summary_expressions())
+    if order_ids is None:
+        conn.execute(stmt)
+        return
+    order_ids = sorted(set(order_ids))
+    for start in range(0, len(order_ids), BATCH_SIZE):
+        conn.execute(stmt.where(Order.__table__.c.id.in_(order_ids[start:start + BATCH_SIZE])))
+
+def _normalize(column, value):
+    if value is None:
+        return None
+    if column == 'total_amount':
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    if column == 'paid':
+        return bool(value)
+    if column == 'latest_date_ordered' and isinstance(value, str):
+        return value.replace('T', ' ')
+    return value
+
+def verify_order_summaries(conn):
+    """
+    Returns [(order_id, column, stored, expected)] for every summary value that
+    does not match the order's lines.
+    """
+    expected = _summary_expressions()
+    stored = [getattr(Order, column) for column in SUMMARY_COLUMNS]
+    computed = [expected[column].label('expected_' + column) for column in SUMMARY_COLUMNS]
+    mismatches = []
+    for row in conn.execute(select(Order.id, *stored, *computed).order_by(Order.id)):
+        for i, column in enumerate(SUMMARY_COLUMNS):
+            have = _normalize(column, row[1 + i])
+            want = _normalize(column, row[1 + len(SUMMARY_COLUMNS) + i])
+            if have != want:
+                mismatches.append((row[0], column, have, want))
+    return mismatches
+
+def _touched_order_ids(session):
+    order_ids = set()
+    repriced_drugs = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, DrugOrder):
+            history = attributes.get_history(obj, 'order_id')
+            order_ids.update(oid for oid in chain(history.added, history.unchanged, history.deleted) if oid is not None)
+        elif isinstance(obj, Drug) and obj in session.dirty and attributes.get_history(obj, 'price').has_changes():
+            repriced_drugs.add(obj.id)
+    if repriced_drugs:
+        rows = session.connection().execute(
+            select(DrugOrder.order_id).where(DrugOrder.drug_id.in_(repriced_drugs)).distinct())
+        order_ids.update(row[0] for row in rows)
+    return order_ids
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_after_flush(session, flush_context):
+    order_ids = _touched_order_ids(session)
+    if order_ids:
+        refresh_order_summaries(session.connection(), order_ids)
+        session.info.setdefault('order_summary_refreshed', set()).update(order_ids)
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_refreshed(session, flush_context):
+    # Orders already loaded in this session still hold the pre-flush summary
+    for order_id in session.info.pop('order_summary_refreshed', ()):
+        order = session.identity_map.get(identity_key(Order, order_id))
+        if order is not None:
+            session.expire(order, SUMMARY_COLUMNS)
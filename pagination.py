@@ -0,0 +1,123 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import tuple_
+
+# Keyset (cursor) pagination.
+#
+# Instead of OFFSET, each page remembers the sort key of its first and last
+# row and the next query asks for rows strictly after (or before) that key,
+# so page 1000 costs the same index range scan as page 1 and no COUNT(*) is
+# needed. Cursors are opaque url-safe tokens that carry the direction, the
+# boundary key and the page number for display.
+
+class KeysetPage:
+    def __init__(self, items, number, has_prev, has_next, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.number = number
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def map(self, function):
+        # Same page with every item converted, e.g. ORM objects into template rows
+        return KeysetPage([function(item) for item in self.items], self.number, self.has_prev,
+                          self.has_next, self.prev_cursor, self.next_cursor)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+def encode_cursor(direction, key, number):
+    payload = json.dumps({'d': direction, 'k': [_encode_value(v) for v in key], 'n': number}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """
+    Returns (direction, key, page number), or None for a missing or malformed
+    token, which callers treat as "first page".
+    """
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        direction = payload['d']
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, [_decode_value(v) for v in payload['k']], int(payload['n'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def _fits(key, columns):
+    # A cursor made for another listing (or by hand) must not reach the query
+    if len(key) != len(columns):
+        return False
+    for value, column in zip(key, columns):
+        if value is None:
+            continue
+        try:
+            expected = column.type.python_type
+        except NotImplementedError:
+            continue
+        if expected is datetime:
+            if not isinstance(value, datetime):
+                return False
+        elif expected in (int, float, Decimal):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return False
+        elif not isinstance(value, expected):
+            return False
+    return True
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10, descending=True):
+    """
+    Returns one KeysetPage of `query` ordered by `columns` (the last of which
+    must be unique, e.g. the primary key). `query` must not be ordered yet. A
+    cursor that is malformed or does not fit `columns` gives the first page.
+    """
+    row_key = lambda item: [getattr(item, column.key) for column in columns]
+    decoded = decode_cursor(cursor)
+    if decoded and not _fits(decoded[1], columns):
+        decoded = None
+    direction, key, number = decoded if decoded else ('next', None, 1)
+
+    # Walking backwards flips both the comparison and the ordering; rows are reversed afterwards
+    forward = direction == 'next'
+    newest_first = descending == forward
+    if key is not None:
+        boundary = tuple_(*columns) < tuple_(*key) if newest_first else tuple_(*columns) > tuple_(*key)
+        query = query.filter(boundary)
+    query = query.order_by(*[column.desc() if newest_first else column.asc() for column in columns])
+
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if forward:
+        has_prev, has_next = key is not None and number > 1, more
+    else:
+        items.reverse()
+        has_prev, has_next = more, True
+
+    prev_cursor = encode_cursor('prev', row_key(items[0]), number - 1) if has_prev and items else None
+    next_cursor = encode_cursor('next', row_key(items[-1]), number + 1) if has_next and items else None
+    return KeysetPage(items, number, has_prev and bool(items), has_next and bool(items), prev_cursor, next_cursor)
@@ -0,0 +1,147 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+
+# Password hashing off the request threads.
+#
+# bcrypt is deliberately slow, so hashing (register, password changes) and
+# checking (login, userdetails) run on a small process pool. A bounded number
+# of requests may wait for it at once; beyond PASSWORD_HASH_MAX_PENDING the
+# request fails fast with 503 and Retry-After, so a login storm cannot tie up
+# every worker. The bcrypt cost is PASSWORD_HASH_ROUNDS, the same for every
+# worker. `python manage.py calibrate-passwords` measures the cost whose hash
+# takes about 250 ms on the target machine; pin it at deploy time through the
+# PASSWORD_HASH_ROUNDS environment variable. Hashes with a lower cost are
+# upgraded at the next successful login, never downgraded.
+
+# Calibration never goes below the cost Flask-Bcrypt used, nor above what is
+# still usable
+MIN_ROUNDS = 12
+MAX_ROUNDS = 16
+
+DEFAULT_CONFIG = {
+    'PASSWORD_HASH_ROUNDS': int(os.environ.get('PASSWORD_HASH_ROUNDS', MIN_ROUNDS)),
+    'PASSWORD_HASH_WORKERS': 2,
+    'PASSWORD_HASH_MAX_PENDING': 16,  # hashes queued or running before 503
+    'PASSWORD_HASH_RETRY_AFTER': 2,  # seconds
+    # Hash in the request instead of the pool (always on under TESTING)
+    'PASSWORD_HASH_EAGER': False,
+}
+
+
+class HashingBusy(Exception):
+    """
+    Too many password hashes are already queued.
+    """
+    def __init__(self, retry_after):
+        super().__init__('Too many sign-ins at once, please try again shortly.')
+        self.retry_after = retry_after
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.errorhandler(HashingBusy)
+    def _busy(e):
+        return str(e), 503, {'Retry-After': str(e.retry_after)}
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def rounds_of(hashed):
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def calibrate(target_ms, minimum=MIN_ROUNDS, maximum=MAX_ROUNDS):
+    """
+    The bcrypt cost whose hash takes about `target_ms` here. Each extra
+    round doubles the time, so one measurement is enough. Run at deploy
+    time, not per process: workers that measure different costs would keep
+    rehashing each other's hashes.
+    """
+    start = time.perf_counter()
+    _hash('calibration', minimum)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    extra = math.floor(math.log2(target_ms / elapsed_ms)) if elapsed_ms < target_ms else 0
+    return max(minimum, min(maximum, minimum + extra))
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._limit = None
+        self._lock = threading.Lock()
+
+    def _call(self, config, fn, *args):
+        with self._lock:
+            if self._limit != config['PASSWORD_HASH_MAX_PENDING']:
+                # Calls already holding a slot release it on the old semaphore
+                self._limit = config['PASSWORD_HASH_MAX_PENDING']
+                self._slots = threading.BoundedSemaphore(self._limit)
+            slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingBusy(config['PASSWORD_HASH_RETRY_AFTER'])
+        try:
+            if config['PASSWORD_HASH_EAGER'] or config.get('TESTING'):
+                return fn(*args)
+            with self._lock:
+                if self._executor is None:
+                    # Fresh interpreters rather than forks of a threaded server
+                    self._executor = ProcessPoolExecutor(max_workers=config['PASSWORD_HASH_WORKERS'],
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                executor = self._executor
+            return executor.submit(fn, *args).result()
+        finally:
+            slots.release()
+
+    def hash(self, password, config):
+        return self._call(config, _hash, password, config['PASSWORD_HASH_ROUNDS'])
+
+    def check(self, password, hashed, config):
+        if not hashed:
+            return False
+        return self._call(config, _check, password, hashed)
+
+    def needs_rehash(self, hashed, config):
+        # Only upgrades: a hash stronger than the configured cost is kept
+        return (rounds_of(hashed) or 0) < config['PASSWORD_HASH_ROUNDS']
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return password_hasher.hash(password, current_app.config)
+
+
+def check_password(password, hashed):
+    return password_hasher.check(password, hashed, current_app.config)
+
+
+def needs_rehash(hashed):
+    return password_hasher.needs_rehash(hashed, current_app.config)
@@ -0,0 +1,100 @@
+import time
+from flask import current_app, session
+from db import db
+from models import User
+
+# The logged-in user, without a users-table lookup on every request.
+#
+# Flask-Login calls the user loader on each authenticated request. Instead of
+# a full User, the loader returns a Principal holding only the fields views
+# and templates read (id, name, email, role_id). Those are cached in the
+# signed session cookie, so while the entry is younger than PRINCIPAL_TTL the
+# request does not query the users table at all. Anything else (orders,
+# address, password, ...) loads the User row on first access.
+#
+# Code that changes a user's cached fields calls forget() so the next request
+# reloads them. Changes made elsewhere (another process, an admin edit) show
+# up once the entry expires.
+
+DEFAULT_CONFIG = {
+    'PRINCIPAL_TTL': 300,  # seconds
+}
+
+SESSION_KEY = '_principal'
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+
+class Principal:
+    """
+    The cached identity of the logged-in user. Behaves like the User for
+    Flask-Login and for attribute reads; other attributes come from the
+    User row, loaded once per request when first needed.
+    """
+    __slots__ = ('id', 'name', 'email', 'role_id', '_user')
+
+    def __init__(self, id, name, email, role_id):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.role_id = role_id
+        self._user = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_active(self):
+        return bool(self.name)
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+
+def remember(user):
+    """
+    Caches `user` as the principal of the current session, e.g. at login.
+    """
+    session[SESSION_KEY] = {'id': user.id, 'name': user.name, 'email': user.email, 'role_id': user.role_id,
+                            'at': time.time()}
+
+
+def forget():
+    session.pop(SESSION_KEY, None)
+
+
+def load(user_id):
+    """
+    User loader: the cached principal when it is fresh, otherwise the
+    fields are read (and cached) again. None for unknown users and users
+    without a password, who cannot be logged in.
+    """
+    user_id = int(user_id)
+    cached = session.get(SESSION_KEY)
+    if cached and cached['id'] == user_id and time.time() - cached['at'] < current_app.config['PRINCIPAL_TTL']:
+        return Principal(cached['id'], cached['name'], cached['email'], cached['role_id'])
+    row = db.session.execute(db.select(User.id, User.name, User.email, User.role_id, User.password)
+                             .where(User.id == user_id)).first()
+    if row is None or not row.password:
+        forget()
+        return None
+    remember(row)
+    return Principal(row.id, row.name, row.email, row.role_id)
@@ -0,0 +1,178 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, request
+
+# Request throttling for the login, registration and payment endpoints.
+#
+# @limit('login', account=...) checks the scope's rules before the view runs:
+# the client IP is checked first, then the account (the submitted email, or
+# the logged-in user), so a rejected request costs no database query and no
+# bcrypt work. Each rule is a sliding window of (requests, seconds). The
+# count is estimated from the current and previous fixed windows, weighted by
+# how much of the previous one still overlaps, which needs two counters per
+# key. Rejected requests get 429 with Retry-After. A view that should only
+# count some requests calls check() itself instead: registration counts the
+# submissions that pass form validation, so a few typos from an office behind
+# one NAT do not use up its hourly allowance.
+#
+# RATELIMIT_STORE picks where the counters live: 'memory' keeps them in this
+# process (least recently used keys are evicted past RATELIMIT_MEMORY_KEYS),
+# 'sqlite' shares them between the workers of one host through a small SQLite
+# file of their own. Behind a proxy, wrap the app in werkzeug's ProxyFix so
+# remote_addr is the client's address.
+
+DEFAULT_CONFIG = {
+    'RATELIMIT_ENABLED': None,  # None: on, except under TESTING
+    'RATELIMIT_STORE': 'memory',  # or 'sqlite'
+    'RATELIMIT_MEMORY_KEYS': 100_000,
+    'RATELIMIT_SQLITE_PATH': None,  # default: ratelimit.db in the instance folder
+    'RATELIMIT_RULES': {
+        'login': {'ip': (20, 60), 'account': (5, 60)},
+        'register': {'ip': (5, 3600)},
+        'deny_reason': {'ip': (60, 60)},
+        'pay': {'ip': (30, 60), 'account': (10, 60)},
+    },
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Too many requests, please try again later.')
+        self.retry_after = retry_after
+
+
+def _sliding_window(window_start, current, previous, limit, window, now):
+    """
+    Advances the counters of one key to `now`. Returns the new counters and
+    how many seconds to wait, 0 when this request is allowed (and counted).
+    """
+    start = now - now % window
+    if start != window_start:
+        previous = current if start - window == window_start else 0
+        current = 0
+        window_start = start
+    overlap = 1 - (now - start) / window
+    if previous * overlap + current >= limit:
+        # Wait until enough of the previous window has slid out (or the next window)
+        if previous and current < limit:
+            wait = (1 - (limit - current) / previous) * window - (now - start)
+        else:
+            wait = window - (now - start)
+        return (window_start, current, previous), max(1, int(wait + 0.999))
+    return (window_start, current + 1, previous), 0
+
+
+class MemoryStore:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            counters, wait = _sliding_window(*self._counters.get(key, (0, 0, 0)), limit, window, now)
+            self._counters[key] = counters
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        return wait
+
+
+class SQLiteStore:
+    # Every PURGE_EVERY hits, keys idle for two of their windows are deleted
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = itertools.count(1)  # next() is atomic, unlike += from many threads
+        self._connect().execute("CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, window REAL, "
+                                "window_start REAL, current INTEGER, previous INTEGER)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")  # losing counters in a crash is harmless
+        return conn
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT window_start, current, previous FROM rate_limit WHERE key = ?", (key,)).fetchone()
+            counters, wait = _sliding_window(*(row or (0, 0, 0)), limit, window, now)
+            conn.execute("INSERT OR REPLACE INTO rate_limit VALUES (?, ?, ?, ?, ?)", (key, window, *counters))
+            if next(self._hits) % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limit WHERE window_start < ? - 2 * window", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    if app.config['RATELIMIT_STORE'] == 'sqlite':
+        path = app.config['RATELIMIT_SQLITE_PATH'] or os.path.join(app.instance_path, 'ratelimit.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        app.extensions['rate_limit'] = SQLiteStore(path)
+    else:
+        app.extensions['rate_limit'] = MemoryStore(app.config['RATELIMIT_MEMORY_KEYS'])
+
+    @app.errorhandler(RateLimited)
+    def _limited(e):
+        headers = {'Retry-After': str(e.retry_after)}
+        if request.is_json:
+            return jsonify(success=False, error=str(e)), 429, headers
+        return str(e), 429, headers
+
+
+def check(scope, account=None):
+    """
+    Counts this request against the rules of `scope` and raises RateLimited
+    when one of them is exhausted. `account` is only called once the IP
+    rule has passed.
+    """
+    config = current_app.config
+    enabled = config['RATELIMIT_ENABLED']
+    if enabled is False or (enabled is None and current_app.testing):
+        return
+    store = current_app.extensions['rate_limit']
+    rules = config['RATELIMIT_RULES'].get(scope, {})
+    for kind in ('ip', 'account'):
+        if kind not in rules:
+            continue
+        value = request.remote_addr if kind == 'ip' else account() if account else None
+        if not value:
+            continue
+        count, window = rules[kind]
+        wait = store.hit(f'{scope}:{kind}:{value}', count, window)
+        if wait:
+            raise RateLimited(wait)
+
+
+def limit(scope, account=None, methods=('POST',)):
+    """
+    Applies the `scope` rules to a view's `methods` (showing a form is not
+    counted). `account` returns the account the request is for, or None,
+    e.g. the email being logged into.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods:
+                check(scope, account)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,232 @@
+import json
+import os
+import re
+import secrets
+import time
+from flask import current_app
+import blobstore
+import order_service
+
+# Chunked, resumable uploads for large scanned prescriptions.
+#
+# A client opens an upload with its file name and total size, then PUTs the
+# bytes in chunks, each tagged with the offset it starts at. Chunks are
+# streamed straight onto a partial file in UPLOAD_PARTIAL_FOLDER, so only one
+# read buffer is in memory however large the scan is. After a dropped
+# connection the client asks for the current offset and carries on from there.
+# Type and size are checked while the bytes arrive: the extension against the
+# same list as UploadForm, the leading bytes against the format's signature
+# and the running total against the declared size. Completing the upload moves
+# the file into the blob store and creates the Order and DrugOrder in one
+# transaction.
+
+DEFAULT_CONFIG = {
+    'UPLOAD_PARTIAL_FOLDER': None,  # defaults to UPLOAD_FOLDER/partial
+    'UPLOAD_CHUNK_BYTES': 4 * 1024 * 1024,
+    'UPLOAD_MAX_BYTES': 100 * 1024 * 1024,
+    # Abandoned uploads older than this are removed by `manage.py gc-blobs`
+    'UPLOAD_SESSION_TTL': 24 * 3600,
+}
+
+# Leading bytes of each accepted format
+SIGNATURES = {
+    '.jpg': b'\xff\xd8\xff',
+    '.png': b'\x89PNG\r\n\x1a\n',
+    '.bmp': b'BM',
+    '.pdf': b'%PDF-',
+}
+
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+
+def partial_folder(config=None):
+    config = config if config is not None else current_app.config
+    return config.get('UPLOAD_PARTIAL_FOLDER') or os.path.join(config['UPLOAD_FOLDER'], 'partial')
+
+
+def _paths(upload_id, config):
+    if not UPLOAD_ID.match(upload_id or ''):
+        raise UploadError('Unknown upload', 404)
+    folder = partial_folder(config)
+    return os.path.join(folder, upload_id + '.part'), os.path.join(folder, upload_id + '.json')
+
+
+def _load(upload_id, user_id, config):
+    part_path, meta_path = _paths(upload_id, config)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = None
+    # Someone else's upload id is as unknown as a made-up one
+    if meta is None or meta['user_id'] != user_id or not os.path.exists(part_path):
+        raise UploadError('Unknown upload', 404)
+    return meta, part_path, meta_path
+
+
+def _describe(upload_id, meta, offset, config):
+    return {'upload_id': upload_id, 'offset': offset, 'size': meta['size'],
+            'chunk_size': config['UPLOAD_CHUNK_BYTES']}
+
+
+def begin(user_id, filename, size, config=None):
+    """
+    Opens an upload of `size` bytes and returns its description.
+    """
+    config = config if config is not None else current_app.config
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in SIGNATURES:
+        raise UploadError('Images and PDFs only!', 415)
+    if not isinstance(size, int) or isinstance(size, bool) or size < len(SIGNATURES[extension]):
+        raise UploadError('size must be the file size in bytes')
+    if size > config['UPLOAD_MAX_BYTES']:
+        raise UploadError(f"Files may be at most {config['UPLOAD_MAX_BYTES']} bytes", 413)
+
+    upload_id = secrets.token_hex(16)
+    part_path, meta_path = _paths(upload_id, config)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    meta = {'user_id': user_id, 'extension': extension, 'size': size, 'created': time.time()}
+    open(part_path, 'xb').close()
+    with open(meta_path, 'x') as f:
+        json.dump(meta, f)
+    return _describe(upload_id, meta, 0, config)
+
+
+def status(upload_id, user_id, config=None):
+    """
+    Where an interrupted upload should resume.
+    """
+    config = config if config is not None else current_app.config
+    meta, part_path, _ = _load(upload_id, user_id, config)
+    return _describe(upload_id, meta, os.path.getsize(part_path), config)
+
+
+def write_chunk(upload_id, user_id, offset, stream, length=None, config=None):
+    """
+    Appends the chunk in `stream`, which must start at the current end of the
+    partial file. Returns the new offset.
+    """
+    config = config if config is not None else current_app.config
+    meta, part_path, _ = _load(upload_id, user_id, config)
+    current = os.path.getsize(part_path)
+    if offset != current:
+        raise UploadError('Chunk does not start at the current offset', 409, offset=current)
+    if length is not None and (length > config['UPLOAD_CHUNK_BYTES'] or current + length > meta['size']):
+        raise UploadError('Chunk is too large', 413, offset=current)
+
+    signature = SIGNATURES[meta['extension']]
+    rejected = None
+    # Bytes that arrived before a dropped connection are kept: the client
+    # resumes from whatever offset `status` reports
+    with open(part_path, 'r+b') as out:
+        out.seek(current)
+        written = current
+        while True:
+            piece = stream.read(blobstore.CHUNK_SIZE)
+            if not piece:
+                break
+            if written + len(piece) > meta['size'] or written + len(piece) - current > config['UPLOAD_CHUNK_BYTES']:
+                rejected = UploadError('Chunk is too large', 413, offset=current)
+                break
+            if written < len(signature):
+                # Reject the wrong kind of file on its first bytes, not after the whole chunk
+                head = _read_head(out, written, len(signature)) + piece
+                if not signature.startswith(head[:len(signature)]):
+                    rejected = UploadError('File content does not match its type', 415)
+                    break
+            out.write(piece)
+            written += len(piece)
+        if rejected is not None:
+            out.truncate(current)
+    if rejected is not None:
+        if rejected.status == 415:
+            _discard(upload_id, config)
+        raise rejected
+    return written
+
+
+def _read_head(out, written, count):
+    position = out.tell()
+    out.seek(0)
+    head = out.read(min(written, count))
+    out.seek(position)
+    return head
+
+
+def complete(upload_id, user_id, config=None):
+    """
+    Turns a fully received upload into an order. Returns the new DrugOrder.
+    """
+    config = config if config is not None else current_app.config
+    meta, part_path, meta_path = _load(upload_id, user_id, config)
+    received = os.path.getsize(part_path)
+    if received != meta['size']:
+        raise UploadError('Upload is incomplete', 409, offset=received)
+
+    # Claim the upload so a repeated request cannot create a second order
+    claimed_path = part_path + '.completing'
+    try:
+        os.rename(part_path, claimed_path)
+    except FileNotFoundError:
+        raise UploadError('Unknown upload', 404)
+    try:
+        with open(claimed_path, 'rb') as f:
+            drug_order = order_service.create_prescription_order(user_id, f, meta['extension'], config)
+    except BaseException:
+        os.rename(claimed_path, part_path)
+        raise
+    os.unlink(claimed_path)
+    os.unlink(meta_path)
+    return drug_order
+
+
+def _discard(upload_id, config):
+    part_path, meta_path = _paths(upload_id, config)
+    for path in (part_path, part_path + '.completing', meta_path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def cancel(upload_id, user_id, config=None):
+    config = config if config is not None else current_app.config
+    _load(upload_id, user_id, config)
+    _discard(upload_id, config)
+
+
+def expire(config, now=None):
+    """
+    Removes uploads that were opened more than UPLOAD_SESSION_TTL ago and
+    never completed. Returns how many were removed.
+    """
+    folder = partial_folder(config)
+    if not os.path.isdir(folder):
+        return 0
+    cutoff = (now if now is not None else time.time()) - config['UPLOAD_SESSION_TTL']
+    removed = 0
+    for name in os.listdir(folder):
+        upload_id, extension = os.path.splitext(name)
+        if extension != '.json':
+            continue
+        try:
+            with open(os.path.join(folder, name)) as f:
+                created = json.load(f)['created']
+        except (OSError, ValueError, KeyError):
+            created = os.path.getmtime(os.path.join(folder, name))
+        if created < cutoff:
+            _discard(upload_id, config)
+            removed += 1
+    return removed
@@ -0,0 +1,221 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+from sqlalchemy import insert, update
+from sqlalchemy.orm import joinedload
+from db import db
+from models import Order, DrugOrder
+from catalog import drug_catalog
+from mailer import enqueue_emails
+from order_summary import refresh_order_summaries
+
+# Applying pharmacist review decisions to orders.
+#
+# A decision says approve or deny for one order, optionally with edited or new
+# lines. apply_reviews handles any number of decisions with a fixed number of
+# queries: orders (with users) and their lines are each loaded with one IN
+# query, drugs are resolved from the catalog cache, lines are written with
+# bulk UPDATE/INSERT statements, the review emails are queued with one outbox
+# lookup and one bulk INSERT, and everything is committed once.
+
+# Largest number of decisions accepted in one bulk request
+MAX_BULK_DECISIONS = 500
+
+STATUSES = {'approve': 'approved', 'approved': 'approved', 'deny': 'denied', 'denied': 'denied'}
+
+
+class ReviewError(ValueError):
+    pass
+
+
+@dataclass
+class ReviewLine:
+    id: Optional[int] = None            # existing DrugOrder id; anything else becomes a new line
+    drug: Union[int, str, None] = None  # drug id, or drug name
+    quantity: Optional[int] = None
+    refills: Optional[int] = None
+
+
+@dataclass
+class ReviewDecision:
+    order_id: int
+    status: Optional[str]               # 'approved', 'denied' or None to only edit lines
+    reason: Optional[str] = None
+    lines: Optional[List[ReviewLine]] = None  # None: apply the status to every line of the order
+
+
+def _optional_int(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ReviewError(f"{name} must be a whole number")
+
+
+def decision_from_json(data):
+    """
+    Builds a ReviewDecision from one element of the /api/review/bulk payload.
+    """
+    if not isinstance(data, dict):
+        raise ReviewError("Each decision must be an object")
+    order_id = _optional_int(data.get('order_id'), 'order_id')
+    if order_id is None:
+        raise ReviewError("No order_id provided")
+    status = STATUSES.get(data.get('decision') or data.get('status'))
+    if status is None:
+        raise ReviewError("decision must be 'approve' or 'deny'")
+    lines = None
+    if data.get('items') is not None:
+        if not isinstance(data['items'], list):
+            raise ReviewError("items must be a list")
+        lines = []
+        for item in data['items']:
+            if not isinstance(item, dict):
+                raise ReviewError("Each item must be an object")
+            drug = item.get('drug_id', item.get('drug'))
+            lines.append(ReviewLine(
+                id=_optional_int(item.get('id'), 'id'),
+                drug=_optional_int(drug, 'drug_id') if isinstance(drug, int) or (isinstance(drug, str) and drug.isdigit()) else drug,
+                quantity=_optional_int(item.get('quantity'), 'quantity'),
+                refills=_optional_int(item.get('refills'), 'refills'),
+            ))
+    return ReviewDecision(order_id=order_id, status=status, reason=data.get('reason'), lines=lines)
+
+
+def decision_from_form(order_id, form):
+    """
+    Builds a ReviewDecision from the review_order form in one pass over its
+    keys, grouping the drug_orders-<id>-<field> fields into one line per id.
+    """
+    lines = {}
+    for key, value in form.items():
+        if not key.startswith('drug_orders-'):
+            continue
+        try:
+            _, line_id, field = key.split('-')
+            line_id = int(line_id)
+        except ValueError:
+            raise ReviewError(f"Malformed field {key!r}")
+        line = lines.setdefault(line_id, ReviewLine(id=line_id))
+        if field == 'name':
+            # Either a drug id or a drug name
+            line.drug = int(value) if value.isdigit() else value
+        elif field == 'quantity':
+            line.quantity = _optional_int(value, 'quantity')
+        elif field == 'refills':
+            line.refills = _optional_int(value, 'refills')
+    return ReviewDecision(order_id=order_id, status=STATUSES.get(form.get('status')),
+                          reason=form.get('denyReason'), lines=list(lines.values()))
+
+
+def _resolve_drug(drug):
+    # Drugs come from the in-memory catalog, so resolving them costs no queries
+    found = drug_catalog.get(drug) if isinstance(drug, int) else drug_catalog.by_name(drug)
+    return found.id if found is not None else None
+
+
+def _notification(order, status, reason, base_url):
+    if order.user is None:
+        print(f"Order {order.id} has no associated user.")
+        return None
+    if status == 'approved':
+        return dict(to_address=order.user.email, subject="Prescription Approved", body='Your prescription has been approved. Please proceed to <a href="' + base_url + 'orders">payment</a>.', order_id=order.id, status='approved')
+    return dict(to_address=order.user.email, subject="Prescription Denied", body='Your prescription has been denied. Reason: ' + (reason or '') + '. Check your <a href="' + base_url + 'orders">orders</a> for more details.', order_id=order.id, status='denied')
+
+
+def apply_reviews(decisions, base_url):
+    """
+    Applies the decisions in one transaction and returns one result dict per
+    decision, in order. Invalid decisions are reported and skipped; the valid
+    ones are still applied.
+    """
+    order_ids = {d.order_id for d in decisions}
+    orders = {o.id: o for o in Order.query.options(joinedload(Order.user)).filter(Order.id.in_(order_ids))} if order_ids else {}
+
+    # Current state of every line of every order under review
+    line_rows = db.session.execute(
+        db.select(DrugOrder.id, DrugOrder.order_id, DrugOrder.prescription_approved).where(DrugOrder.order_id.in_(order_ids))
+    ).all() if order_ids else []
+    lines_by_order = {}
+    for row in line_rows:
+        lines_by_order.setdefault(row.order_id, {})[row.id] = row.prescription_approved
+
+    now = datetime.now(timezone.utc)
+
+    updates, inserts, results, touched, emails = [], [], [], set(), []
+    for decision in decisions:
+        order = orders.get(decision.order_id)
+        if order is None:
+            results.append({'order_id': decision.order_id, 'success': False, 'error': 'Order not found'})
+            continue
+        if decision.status == 'denied' and not decision.reason:
+            results.append({'order_id': order.id, 'success': False, 'error': 'A reason is required to deny an order'})
+            continue
+
+        existing = lines_by_order.get(order.id, {})
+        lines = decision.lines if decision.lines is not None else [ReviewLine(id=line_id) for line_id in existing]
+        try:
+            line_updates, line_inserts, changed = _plan_lines(order.id, decision, lines, existing, now)
+        except ReviewError as e:
+            results.append({'order_id': order.id, 'success': False, 'error': str(e)})
+            continue
+
+        updates.extend(line_updates)
+        inserts.extend(line_inserts)
+        touched.add(order.id)
+        if changed:
+            email = _notification(order, decision.status, decision.reason, base_url)
+            if email is not None:
+                emails.append(email)
+        results.append({'order_id': order.id, 'success': True, 'status': decision.status,
+                        'updated': len(line_updates), 'created': len(line_inserts)})
+
+    try:
+        if emails:
+            enqueue_emails(emails)
+        if updates:
+            db.session.execute(update(DrugOrder), updates)
+        if inserts:
+            db.session.execute(insert(DrugOrder), inserts)
+        # Bulk statements bypass the flush hooks that maintain the order summary
+        refresh_order_summaries(db.session.connection(), touched)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return results
+
+
+def _plan_lines(order_id, decision, lines, existing, now):
+    updates, inserts, changed = [], [], False
+    for line in lines:
+        values = {}
+        if line.drug is not None and line.drug != '':
+            drug_id = _resolve_drug(line.drug)
+            if drug_id is None:
+                raise ReviewError(f"Unknown drug {line.drug!r}")
+            values['drug_id'] = drug_id
+        if line.quantity is not None:
+            values['quantity'] = line.quantity
+        if line.refills is not None:
+            values['refills'] = line.refills
+
+        # Lines that do not belong to this order (e.g. the form's new-line counters) are new lines
+        is_new = line.id not in existing
+        approved = None if is_new else existing[line.id]
+        if decision.status == 'approved' and not approved:
+            values['prescription_approved'] = True
+            values['denyreason'] = None  # Clear the deny reason if the order is approved
+            changed = True
+        elif decision.status == 'denied' and approved is not False:
+            values['prescription_approved'] = False
+            values['denyreason'] = decision.reason  # Set the deny reason if the order is denied
+            changed = True
+
+        if is_new:
+            inserts.append(dict({'order_id': order_id, 'date_ordered': now, 'prescription_approved': None,
+                                 'refills': 0, 'paid': False}, **values))
+        elif values:
+            updates.append(dict(values, id=line.id))
+    return updates, inserts, changed
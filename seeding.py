@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timedelta
+import bcrypt
+from sqlalchemy import func, insert, select
+from models import Drug, Order, DrugOrder, User, Role
+from order_summary import refresh_order_summaries
+from catalog import drug_catalog
+
+# Bulk test data for load tests and benchmarks (`manage.py seed`).
+#
+# Rows are generated a batch of users at a time, with their orders and order
+# lines, and written with executemany inserts in one transaction per batch.
+# Primary keys are assigned here, so no row has to be read back. Every seeded
+# user shares one password hash, computed once, and order lines pick their
+# drug from ids loaded into memory up front (a catalog of generic drugs is
+# added when the table is empty). The same --seed and --as-of give the same rows.
+
+SEED_PASSWORD = '123123123'
+USER_ROLE_ID = 2
+
+def seed(engine, users, orders_per_user=(2, 5), lines_per_order=(1, 3), batch_size=5000, rng_seed=2024,
+         as_of=None, drugs=500, password=SEED_PASSWORD):
+    """
+    Adds `users` customers with their orders to the database behind
+    `engine`. Returns the number of users, orders and lines written.
+    """
+    rng = random.Random(rng_seed)
+    as_of = as_of or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    totals = {'users': 0, 'orders': 0, 'lines': 0}
+
+    with engine.begin() as conn:
+        if conn.execute(select(Role.id).where(Role.id == USER_ROLE_ID)).first() is None:
+            conn.execute(insert(Role.__table__), [{'id': USER_ROLE_ID, 'name': 'user'}])
+        if not conn.execute(select(func.count(Drug.id))).scalar():
+            conn.execute(insert(Drug.__table__), [{'name': f'Seed drug {i}', 'price': rng.randint(100, 20000) / 100}
+                                                  for i in range(1, drugs + 1)])
+            drug_catalog.invalidate()
+        catalog = conn.execute(select(Drug.id).order_by(Drug.id)).scalars().all()
+        next_user, next_order, next_line = (conn.execute(select(func.coalesce(func.max(table.id), 0))).scalar() + 1
+                                            for table in (User, Order, DrugOrder))
+
+    for start in range(0, users, batch_size):
+        user_rows, order_rows, line_rows = [], [], []
+        for user_id in range(next_user + start, next_user + min(start + batch_size, users)):
+            user_rows.append({'id': user_id, 'name': f'Seed User{user_id}', 'email': f'seed{user_id}@example.com',
+                              'password': hashed_password, 'phone': f'604-{user_id // 10000 % 1000:03d}-{user_id % 10000:04d}',
+                              'phn': f'9{user_id:09d}', 'role_id': USER_ROLE_ID})
+            for _ in range(rng.randint(*orders_per_user)):
+                order_rows.append({'id': next_order, 'user_id': user_id})
+                # Same shape as create_random_orders: delivered orders are approved and paid
+                date_ordered = as_of - timedelta(days=rng.randint(1, 60), seconds=rng.randrange(86400))
+                date_delivered = date_ordered + timedelta(days=rng.randint(1, 30)) if rng.random() < 0.5 else None
+                if date_delivered:
+                    approved, paid = True, True
+                else:
+                    approved = True if rng.random() < 0.5 else None
+                    paid = approved is True and rng.random() < 0.5
+                for _ in range(rng.randint(*lines_per_order)):
+                    line_rows.append({'id': next_line, 'order_id': next_order, 'drug_id': rng.choice(catalog),
+                                      'quantity': rng.randint(50, 200), 'date_ordered': date_ordered,
+                                      'date_delivered': date_delivered, 'prescription_approved': approved,
+                                      'paid': paid, 'refills': 0})
+                    next_line += 1
+                next_order += 1
+
+        with engine.begin() as conn:
+            conn.execute(insert(User.__table__), user_rows)
+            if order_rows:
+                conn.execute(insert(Order.__table__), order_rows)
+                if line_rows:
+                    conn.execute(insert(DrugOrder.__table__), line_rows)
+                # Bulk inserts skip the flush hooks that keep these columns in step
+                refresh_order_summaries(conn, [row['id'] for row in order_rows])
+        totals['users'] += len(user_rows)
+        totals['orders'] += len(order_rows)
+        totals['lines'] += len(line_rows)
+    return totals
@@ -0,0 +1,94 @@
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# SQLite tuning for the production database.
+#
+# Every new DBAPI connection gets the pragmas below through a connect event:
+# - journal_mode=WAL, so readers no longer block the writer (or the other way
+#   round) and pharmacist approvals and customer payments stop failing with
+#   "database is locked".
+# - synchronous=NORMAL, which in WAL mode is still durable across application
+#   crashes and skips the fsync on every commit.
+# - busy_timeout, so a writer waits its turn instead of failing immediately.
+# - a larger page cache, memory-mapped reads and in-memory temp tables.
+# - foreign_keys=ON. The built-in roles are created with the schema (and by
+#   migration 8), so users.role_id always points at a row. On an older
+#   database, run `PRAGMA foreign_key_check` first.
+#
+# pysqlite also defers BEGIN until the first write, which makes SAVEPOINTs
+# commit the surrounding transaction. The driver's own transaction handling
+# is therefore switched off and SQLAlchemy's begin event emits the BEGIN.
+#
+# Transactions start with BEGIN IMMEDIATE, which takes the write lock up
+# front. A read-then-write transaction begun with a plain (deferred) BEGIN
+# holds a snapshot while it reads; when it then writes after another
+# connection has committed, SQLite fails it with "database is locked" at once
+# rather than waiting out busy_timeout. GET, HEAD and OPTIONS requests only
+# read, so they still begin deferred and never wait for writers; so does a
+# connection with the `sqlite_begin='DEFERRED'` execution option.
+
+DEFAULT_CONFIG = {
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # milliseconds
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative means KiB, i.e. 64 MiB per connection
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+    },
+    'SQLITE_BEGIN': 'IMMEDIATE',  # or 'DEFERRED' everywhere
+}
+
+# Requests with these methods do not write, so they begin deferred
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# A handful of pooled connections per process is plenty for one SQLite file:
+# there is still only one writer at a time
+ENGINE_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+}
+
+def init_app(app):
+    """
+    Sets the profile's defaults. Must run before db.init_app, which creates
+    the engines from SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        for key, value in ENGINE_OPTIONS.items():
+            options.setdefault(key, value)
+
+
+def apply(engine, config):
+    """
+    Attaches the profile to `engine`. Does nothing for other databases.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(config['SQLITE_PRAGMAS'])
+    if engine.url.database in (None, '', ':memory:'):
+        pragmas.pop('journal_mode', None)  # WAL needs a file
+    immediate = config['SQLITE_BEGIN'].upper() == 'IMMEDIATE'
+
+    @event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _begin(connection):
+        mode = connection.get_execution_options().get('sqlite_begin')
+        if mode is None:
+            reading = has_request_context() and request.method in READ_METHODS
+            mode = 'IMMEDIATE' if immediate and not reading else 'DEFERRED'
+        connection.exec_driver_sql('BEGIN IMMEDIATE' if mode.upper() == 'IMMEDIATE' else 'BEGIN')
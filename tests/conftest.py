@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import event
+from app import app, db
+
+# Fixtures shared by the test modules.
+#
+# `client` is a test client with empty tables and an app context held for the
+# whole test, so tests can use db.session directly. Uploads go to a temporary
+# folder. Modules that need more (seed rows, other config) override `client`
+# with a fixture of the same name that takes this one. `database` only
+# creates and drops the tables, for tests that must not hold an app context.
+#
+# `statements` records the SQL that the app's engine runs inside a `with`
+# block:
+#
+#     with statements:
+#         client.get('/api/drugs')
+#     assert statements.count == 0
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.parameters = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        self.statements.clear()
+        self.parameters.clear()
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    with app.app_context():
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(database):
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+            db.session.remove()
+
+
+@pytest.fixture
+def statements(database):
+    with app.app_context():
+        return StatementCounter(db.engine)
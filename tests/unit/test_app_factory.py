@@ -0,0 +1,25 @@
+import subprocess
+import sys
+from app import create_app, BLUEPRINTS
+
+def test_create_app_registers_every_blueprint():
+    application = create_app({'TESTING': True})
+    assert set(application.blueprints) == {'main', 'auth', 'pharmacist', 'orders', 'catalog', 'uploads'}
+    assert len(BLUEPRINTS) == len(application.blueprints)
+    with application.test_request_context():
+        from flask import url_for
+        assert url_for('main.home') == '/'
+        assert url_for('auth.login') == '/login'
+        assert url_for('uploads.upload') == '/upload'
+
+def test_create_app_returns_independent_apps():
+    first = create_app({'TESTING': True})
+    second = create_app({'TESTING': True, 'UPLOAD_MAX_AGE': 60})
+    assert first is not second
+    assert second.config['UPLOAD_MAX_AGE'] == 60
+    assert first.config['UPLOAD_MAX_AGE'] != 60
+
+def test_importing_app_does_not_load_the_views():
+    code = "import sys, app; print(sorted(m for m in sys.modules if m.startswith('blueprints') or m in ('forms', 'images', 'review')))"
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    assert out.strip() == '[]'
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+from datetime import datetime, timedelta
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Blob
+import blobstore
+
+def refcount(ref):
+    db.session.expire_all()
+    return db.session.get(Blob, blobstore.parse_ref(ref)).refcount
+
+def add_line(ref):
+    line = DrugOrder(order=Order(), image_file=ref, date_ordered=datetime.now())
+    db.session.add(line)
+    db.session.commit()
+    return line
+
+def test_write_is_sharded_and_deduplicated(tmp_path):
+    store = blobstore.BlobStore(str(tmp_path))
+    data = b'x' * (blobstore.CHUNK_SIZE * 3 + 7)
+    blob_id, size = store.write(io.BytesIO(data))
+    assert blob_id == hashlib.sha256(data).hexdigest()
+    assert size == len(data)
+    assert store.path(blob_id) == os.path.join(str(tmp_path), blob_id[:2], blob_id[2:4], blob_id)
+
+    assert store.write(io.BytesIO(data)) == (blob_id, size)
+    assert [name for name, _ in store.files()] == [blob_id]
+
+def test_publish_keeps_the_first_copy(tmp_path):
+    store = blobstore.BlobStore(str(tmp_path))
+    staged = [store.stage(io.BytesIO(b'scan')) for _ in range(2)]
+    assert [store.publish(blob_id, temp_path) for blob_id, _, temp_path in staged] == [True, False]
+    assert not os.listdir(os.path.join(str(tmp_path), 'tmp'))
+    assert store.exists(staged[0][0])
+
+def test_parse_ref():
+    blob_id = 'a' * 64
+    assert blobstore.parse_ref(blob_id + '.jpg') == blob_id
+    assert blobstore.parse_ref(blob_id) == blob_id
+    assert blobstore.parse_ref('20240101120000_alice.jpg') is None
+    assert blobstore.parse_ref(None) is None
+
+def test_refcounts_follow_drug_orders(client):
+    ref = blobstore.store(io.BytesIO(b'scan'), '.JPG')
+    assert ref.endswith('.jpg')
+    first = add_line(ref)
+    second = add_line(blobstore.store(io.BytesIO(b'scan'), '.jpg'))
+    assert Blob.query.count() == 1
+    assert refcount(ref) == 2
+
+    other = blobstore.store(io.BytesIO(b'other'), '.png')
+    second.image_file = other
+    db.session.commit()
+    assert refcount(ref) == 1 and refcount(other) == 1
+
+    db.session.delete(first)
+    db.session.commit()
+    assert refcount(ref) == 0
+
+def test_gc_removes_only_old_orphans(client, tmp_path):
+    kept = blobstore.store(io.BytesIO(b'kept'), '.jpg')
+    add_line(kept)
+    orphan = blobstore.store(io.BytesIO(b'orphan'), '.jpg')
+    db.session.commit()
+    store = blobstore.get_store()
+    stray = os.path.join(store.root, 'tmp', 'tmpcrashed')
+    with open(stray, 'wb') as f:
+        f.write(b'partial')
+
+    # Everything is inside the grace period
+    stats = blobstore.collect_garbage(db.session, store)
+    assert stats['blobs'] == 0 and stats['files'] == 0
+
+    assert blobstore.collect_garbage(db.session, store, grace_seconds=-1, dry_run=True)['blobs'] == 1
+    assert store.exists(blobstore.parse_ref(orphan))
+
+    stats = blobstore.collect_garbage(db.session, store, grace_seconds=-1)
+    assert stats['blobs'] == 1 and stats['files'] == 1
+    assert not store.exists(blobstore.parse_ref(orphan)) and not os.path.exists(stray)
+    assert store.exists(blobstore.parse_ref(kept))
+    assert [blob.id for blob in Blob.query] == [blobstore.parse_ref(kept)]
+
+def test_rollback_removes_only_uncommitted_blobs(client):
+    store = blobstore.get_store()
+    ref = blobstore.store(io.BytesIO(b'scan'), '.jpg')
+    db.session.rollback()
+    assert not store.exists(blobstore.parse_ref(ref))
+
+    # Another upload of the same scan commits its row before this one rolls back
+    ref = blobstore.store(io.BytesIO(b'scan'), '.jpg')
+    blob_id = blobstore.parse_ref(ref)
+    row = db.session.get(Blob, blob_id)
+    values = {'id': blob_id, 'size': row.size, 'refcount': 1, 'created_at': row.created_at}
+    db.session.rollback()
+    store.write(io.BytesIO(b'scan'))
+    with db.engine.begin() as connection:
+        connection.execute(Blob.__table__.insert().values(**values))
+    db.session.info['new_blobs'] = [(blob_id, store.path(blob_id))]
+    db.session.execute(Blob.__table__.select())
+    db.session.rollback()
+    assert store.exists(blob_id)
+
+def test_gc_waits_for_the_last_reference(client):
+    store = blobstore.get_store()
+    ref = blobstore.store(io.BytesIO(b'scan'), '.jpg')
+    blob_id = blobstore.parse_ref(ref)
+    old = datetime.now() - timedelta(days=1)
+    db.session.execute(Blob.__table__.update().values(created_at=old, last_referenced_at=old))
+    db.session.commit()
+    os.utime(store.path(blob_id), (0, 0))
+
+    # Uploaded again a moment ago, by a request that has not saved its line yet
+    assert blobstore.store(io.BytesIO(b'scan'), '.jpg') == ref
+    db.session.commit()
+    assert blobstore.collect_garbage(db.session, store)['blobs'] == 0
+    assert store.exists(blob_id)
+
+    db.session.execute(Blob.__table__.update().values(last_referenced_at=old))
+    db.session.commit()
+    assert blobstore.collect_garbage(db.session, store)['blobs'] == 1
+    assert not store.exists(blob_id)
+
+def test_gc_repairs_refcounts(client):
+    ref = blobstore.store(io.BytesIO(b'scan'), '.jpg')
+    add_line(ref)
+    db.session.execute(Blob.__table__.update().values(refcount=0))
+    db.session.commit()
+    stats = blobstore.collect_garbage(db.session, blobstore.get_store(), grace_seconds=-1)
+    assert stats['recounted'] == 1 and stats['blobs'] == 0
+    assert refcount(ref) == 1
+
+def test_upload_stores_blob_and_serves_it(client):
+    user = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    db.session.add(user)
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(user)
+    for _ in range(2):
+        rv = client.post('/upload', data={'file': (io.BytesIO(b'%PDF-1.4 scan'), 'scan.pdf')}, content_type='multipart/form-data')
+        assert rv.status_code == 200
+
+    refs = [line.image_file for line in DrugOrder.query]
+    assert len(refs) == 2 and refs[0] == refs[1]
+    assert refs[0] == hashlib.sha256(b'%PDF-1.4 scan').hexdigest() + '.pdf'
+    assert refcount(refs[0]) == 2
+
+    rv = client.get(f'/upload/{refs[0]}')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'application/pdf'
+    assert rv.data == b'%PDF-1.4 scan'
+    assert client.get('/upload/' + 'b' * 64 + '.pdf').status_code == 404
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Drug
+from catalog import drug_catalog
+
+def seed_drugs():
+    db.session.add_all([Drug(name='Ibuprofen', price=5), Drug(name='Aspirin', price='2.50')])
+    db.session.commit()
+
+def test_catalog_indexes(client):
+    seed_drugs()
+    assert [drug.name for drug in drug_catalog.all()] == ['Aspirin', 'Ibuprofen']
+    aspirin = drug_catalog.by_name('Aspirin')
+    assert drug_catalog.get(aspirin.id) == aspirin
+    assert drug_catalog.get(12345) is None and drug_catalog.by_name('Nope') is None
+
+def test_api_served_from_memory(client, statements):
+    seed_drugs()
+    client.get('/api/drugs')
+    misses = drug_catalog.misses
+
+    with statements:
+        rv = client.get('/api/drugs')
+    assert statements.count == 0
+    assert drug_catalog.misses == misses
+    assert json.loads(rv.data) == [{'id': 2, 'name': 'Aspirin', 'price': '2.50'},
+                                   {'id': 1, 'name': 'Ibuprofen', 'price': '5.00'}]
+
+    with statements:
+        rv = client.get('/api/drugs/1')
+    assert statements.count == 0
+    assert json.loads(rv.data) == {'id': 1, 'name': 'Ibuprofen', 'price': '5.00'}
+    assert client.get('/api/drugs/99').status_code == 404
+
+def test_commit_invalidates(client):
+    seed_drugs()
+    version = drug_catalog.version
+    assert drug_catalog.by_name('Aspirin').price == 2.5
+
+    drug = Drug.query.filter_by(name='Aspirin').one()
+    drug.price = 3
+    db.session.flush()
+    # Not visible until the transaction commits
+    assert drug_catalog.version == version
+    db.session.commit()
+    assert drug_catalog.version == version + 1
+    assert drug_catalog.by_name('Aspirin').price == 3
+
+    db.session.add(Drug(name='Codeine', price=9))
+    db.session.rollback()
+    assert drug_catalog.version == version + 1
+    assert drug_catalog.by_name('Codeine') is None
+
+def test_drugs_page_and_review_order(client):
+    seed_drugs()
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    order = Order(user=pharmacist)
+    db.session.add_all([pharmacist, order, DrugOrder(order=order, drug_id=1, quantity=1, date_ordered=datetime.now())])
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(pharmacist)
+
+    rv = client.get('/drugs')
+    assert rv.status_code == 200
+    assert b'Aspirin' in rv.data and b'Ibuprofen' in rv.data
+
+    rv = client.get(f'/review_order/{order.id}')
+    assert rv.status_code == 200
+    assert b'"Aspirin"' in rv.data
+    assert b"fetch('/api/drugs')" not in rv.data
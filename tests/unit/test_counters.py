@@ -0,0 +1,49 @@
+from datetime import datetime
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder
+from counters import order_counters
+
+def add_order(user, *lines):
+    order = Order(user=user)
+    db.session.add(order)
+    for approved, paid in lines:
+        db.session.add(DrugOrder(order=order, prescription_approved=approved, paid=paid, date_ordered=datetime.now()))
+    return order
+
+def seed():
+    alice = User(name='alice', email='alice@test.com', password='x', phn='1000000001', role_id=2)
+    bob = User(name='bob', email='bob@test.com', password='x', phn='1000000002', role_id=2)
+    add_order(alice, (None, False), (None, False))   # one unapproved order with two lines
+    add_order(alice, (True, False))                  # approved, awaiting payment
+    add_order(alice, (True, True))                   # approved and paid
+    add_order(alice, (False, False), (False, False)) # denied
+    add_order(bob, (None, False))
+    db.session.commit()
+    return alice, bob
+
+def test_user_counters(client):
+    alice, bob = seed()
+    assert order_counters(alice.id) == (1, 1, 1)
+    assert order_counters(bob.id) == (1, 0, 0)
+
+def test_pharmacy_counters(client):
+    seed()
+    assert order_counters().unapproved == 2
+
+def test_counters_single_statement(client, statements):
+    alice, _ = seed()
+    alice_id = alice.id
+    with statements:
+        order_counters(alice_id)
+    assert statements.count == 1
+
+def test_dashboard_shows_counters(client):
+    alice, _ = seed()
+    with client.application.test_request_context():
+        login_user(alice)
+    rv = client.get('/dashboard')
+    assert rv.status_code == 200
+    assert b'1 Prescriptions Approved & Awaiting Payment' in rv.data
+    assert b'1 Unapproved Prescriptions' in rv.data
+    assert b'1 Denied Prescriptions' in rv.data
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from flask_login import login_user
+from app import app, db
+from models import User, Drug, Order, DrugOrder
+from dashboard_queries import load_dashboard
+
+def seed_orders(per_tab=12, lines=3):
+    drugs = [Drug(name=f'Drug{i}', price=5 + i) for i in range(lines)]
+    db.session.add_all(drugs)
+    now = datetime.now()
+    n = 0
+    for approved in (None, True, False):
+        for _ in range(per_tab):
+            n += 1
+            user = User(name=f'user{n}', email=f'user{n}@test.com', password='x', phn=f'{n:010d}', role_id=2)
+            order = Order(user=user)
+            for drug in drugs:
+                db.session.add(DrugOrder(order=order, drug=drug, quantity=10, refills=1, prescription_approved=approved,
+                                         denyreason='Expired' if approved is False else None,
+                                         image_file=f'{n}.jpg', date_ordered=now - timedelta(minutes=n)))
+            db.session.add(order)
+    db.session.commit()
+
+def test_load_dashboard_rows(client):
+    seed_orders(per_tab=12)
+    tabs = load_dashboard(per_page=10)
+
+    assert len(tabs['pending']) == 10
+    assert tabs['pending'].has_next and not tabs['pending'].has_prev
+    row = tabs['pending'].items[0]
+    assert row.user_name == 'user1'
+    assert row.user_phn == '0000000001'
+    assert [line.drug_name for line in row.lines] == ['Drug0', 'Drug1', 'Drug2']
+    assert tabs['denied'].items[0].denyreason == 'Expired'
+    assert all(line.prescription_approved for line in tabs['approved'].items[0].lines)
+
+    second = load_dashboard({'pending': tabs['pending'].next_cursor}, per_page=10)['pending']
+    assert len(second) == 2
+    assert second.has_prev and not second.has_next
+
+def test_load_dashboard_does_not_lazy_load(client, statements):
+    seed_orders(per_tab=10)
+    db.session.expunge_all()
+    tabs = load_dashboard(per_page=10)
+    with statements:
+        for page in tabs.values():
+            for row in page:
+                for line in row.lines:
+                    line.drug_name
+    assert statements.count == 0
+
+def test_pharmacistdash_statement_bound(client, statements):
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    db.session.add(pharmacist)
+    db.session.commit()
+    seed_orders(per_tab=10, lines=3)
+    with client.application.test_request_context():
+        login_user(pharmacist)
+    db.session.expunge_all()
+
+    with statements:
+        rv = client.get('/pharmacistdash')
+    assert rv.status_code == 200
+    assert b'user1@test.com' in rv.data
+    # page + items/drugs for each of the three tabs, independent of page size
+    assert statements.count <= 6
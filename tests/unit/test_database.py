@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+from sqlalchemy import insert, select
+from db import db, REPLICA_BIND
+from models import Drug
+import database
+from database import read_only
+
+@pytest.fixture
+def routed_app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['DATABASE_REPLICA_URL'] = f"sqlite:///{tmp_path / 'replica.db'}"
+    database.init_app(app)
+
+    @app.route('/drugs')
+    @read_only
+    def drugs():
+        return ','.join(drug.name for drug in Drug.query.order_by(Drug.name))
+
+    @app.route('/drugs/add')
+    @read_only
+    def add_drug():
+        db.session.add(Drug(name='Added', price=1))
+        db.session.commit()
+        db.session.execute(insert(Drug).values(name='Bulk', price=2))
+        db.session.commit()
+        return 'ok'
+
+    @app.route('/drugs/primary')
+    def primary_drugs():
+        return ','.join(drug.name for drug in Drug.query.order_by(Drug.name))
+
+    with app.app_context():
+        for engine in db.engines.values():
+            db.metadata.create_all(engine)
+        # Stand-ins for the two copies of the data: the replica has not caught up yet
+        with db.engines[None].begin() as conn:
+            conn.execute(insert(Drug).values(name='Primary', price=1))
+        with db.engines[REPLICA_BIND].begin() as conn:
+            conn.execute(insert(Drug).values(name='Replica', price=1))
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    # The bind registered an (empty) metadata that the main app has no engine for
+    db.metadatas.pop(REPLICA_BIND, None)
+
+def test_read_only_views_read_from_the_replica(routed_app):
+    client = routed_app.test_client()
+    assert client.get('/drugs').data == b'Replica'
+    assert client.get('/drugs/primary').data == b'Primary'
+
+def test_writes_in_read_only_views_go_to_the_primary(routed_app):
+    client = routed_app.test_client()
+    assert client.get('/drugs/add').data == b'ok'
+    with routed_app.app_context():
+        primary = db.session.execute(select(Drug.name).order_by(Drug.name),
+                                     bind_arguments={'bind': db.engines[None]}).scalars().all()
+        replica = db.session.execute(select(Drug.name).order_by(Drug.name),
+                                     bind_arguments={'bind': db.engines[REPLICA_BIND]}).scalars().all()
+    assert primary == ['Added', 'Bulk', 'Primary']
+    assert replica == ['Replica']
+
+def test_flag_does_not_outlive_the_request(routed_app):
+    with routed_app.app_context():
+        client = routed_app.test_client()
+        client.get('/drugs')
+        assert 'read_only' not in db.session.info
+        assert client.get('/drugs/primary').data == b'Primary'
+
+def test_configuration_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'env.db'}")
+    monkeypatch.setenv('DATABASE_ENGINE_OPTIONS', '{"pool_size": 3}')
+    app = Flask(__name__)
+    database.init_app(app)
+    with app.app_context():
+        assert db.engine.url.database == str(tmp_path / 'env.db')
+        assert db.engine.pool.size() == 3
+        assert REPLICA_BIND not in db.engines
+        db.engine.dispose()
@@ -0,0 +1,73 @@
+import io
+import pytest
+from app import app, db
+import blobstore
+import file_serving
+
+DATA = bytes(range(256)) * 40
+
+def test_blob_is_immutable_with_etag(client):
+    ref = blobstore.store(io.BytesIO(DATA), '.jpg')
+    db.session.commit()
+    with app.test_request_context():
+        url = file_serving.upload_url(ref)
+    assert url == f'/upload/{ref}'
+
+    rv = client.get(url)
+    assert rv.status_code == 200
+    assert rv.data == DATA
+    assert rv.mimetype == 'image/jpeg'
+    assert 'immutable' in rv.headers['Cache-Control']
+    assert rv.headers['Cache-Control'].startswith('private')
+    assert rv.headers['ETag'] == f'"{blobstore.parse_ref(ref)}"'
+
+    rv = client.get(url, headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+def test_range_request(client):
+    ref = blobstore.store(io.BytesIO(DATA), '.pdf')
+    db.session.commit()
+    rv = client.get(f'/upload/{ref}', headers={'Range': 'bytes=100-199'})
+    assert rv.status_code == 206
+    assert rv.data == DATA[100:200]
+    assert rv.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+
+def test_legacy_file_is_immutable_only_when_versioned(client, tmp_path):
+    (tmp_path / 'scan.png').write_bytes(DATA)
+    with app.test_request_context():
+        url = file_serving.upload_url('scan.png')
+    assert url.startswith('/upload/scan.png?v=')
+
+    rv = client.get(url)
+    assert rv.status_code == 200
+    assert 'immutable' in rv.headers['Cache-Control']
+
+    rv = client.get('/upload/scan.png')
+    assert rv.data == DATA
+    assert rv.headers['Cache-Control'] == 'private, no-cache'
+
+def test_missing_and_escaping_paths_are_404(client):
+    assert client.get('/upload/' + 'a' * 64 + '.jpg').status_code == 404
+    assert client.get('/upload/nothing.png').status_code == 404
+    assert client.get('/upload/..%2Fapp.py').status_code == 404
+
+@pytest.mark.parametrize('mode, header', [('x-accel-redirect', 'X-Accel-Redirect'), ('x-sendfile', 'X-Sendfile')])
+def test_offload_hands_body_to_proxy(client, monkeypatch, mode, header):
+    monkeypatch.setitem(app.config, 'UPLOAD_OFFLOAD', mode)
+    ref = blobstore.store(io.BytesIO(DATA), '.jpg')
+    db.session.commit()
+
+    rv = client.get(f'/upload/{ref}')
+    assert rv.status_code == 200
+    assert rv.data == b''
+    assert rv.mimetype == 'image/jpeg'
+    blob_id = blobstore.parse_ref(ref)
+    if mode == 'x-accel-redirect':
+        assert rv.headers[header] == f'/protected-uploads/blobs/{blob_id[:2]}/{blob_id[2:4]}/{blob_id}'
+    else:
+        assert rv.headers[header] == blobstore.local_path(ref)
+
+    rv = client.get(f'/upload/{ref}', headers={'If-None-Match': f'"{blob_id}"'})
+    assert rv.status_code == 304
+    assert header not in rv.headers
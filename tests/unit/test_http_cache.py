@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import insert, text
+from app import app, db
+from models import User, Drug
+from catalog import drug_catalog
+from http_cache import make_etag
+
+@pytest.fixture
+def client(client):
+    db.session.add_all([Drug(name='Aspirin', price=2), Drug(name='Ibuprofen', price=5),
+                        User(name='alice', email='alice@test.com', password='x', phn='1111111111', role_id=2)])
+    db.session.commit()
+    return client
+
+# The catalog validates from memory; users read their version row
+@pytest.mark.parametrize('url, queries', [('/api/drugs', 0), ('/api/drugs/1', 0), ('/api/users', 1)])
+def test_repeat_request_is_304_without_the_view(client, statements, url, queries):
+    first = client.get(url)
+    assert first.status_code == 200 and first.data
+    etag = first.headers['ETag']
+    assert etag and not etag.startswith('W/')
+    assert 'Cache-Control' in first.headers
+
+    with statements:
+        rv = client.get(url, headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.data == b''
+    assert rv.headers['ETag'] == etag
+    assert statements.count == queries
+
+def test_drug_change_changes_etag(client):
+    etag = client.get('/api/drugs').headers['ETag']
+    drug = Drug.query.filter_by(name='Aspirin').one()
+    drug.price = 3
+    db.session.commit()
+
+    rv = client.get('/api/drugs', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+    assert b'"3.00"' in rv.data
+
+def test_user_change_changes_etag(client):
+    etag = client.get('/api/users').headers['ETag']
+    db.session.add(User(name='bob', email='bob@test.com', password='x', phn='2222222222', role_id=2))
+    db.session.commit()
+    assert client.get('/api/users', headers={'If-None-Match': etag}).status_code == 200
+
+def test_if_modified_since(client):
+    first = client.get('/api/drugs')
+    rv = client.get('/api/drugs', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert rv.status_code == 304
+
+def test_not_found_is_not_cached(client):
+    rv = client.get('/api/drugs/99')
+    assert rv.status_code == 404
+    assert 'ETag' not in rv.headers
+
+def test_users_etag_follows_writes_outside_this_session(client):
+    rv = client.get('/api/users')
+    assert b'alice' in rv.data
+    etag = rv.headers['ETag']
+    db.session.rollback()  # requests share the test's session; end its read snapshot
+    # Bulk Core inserts (manage.py seed) and other processes never reach the ORM session
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'name': 'carol', 'email': 'carol@test.com', 'password': 'x', 'phn': '3333333333'}])
+    rv = client.get('/api/users', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert b'carol' in rv.data
+    etag = rv.headers['ETag']
+    db.session.rollback()
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE users SET name = 'caroline' WHERE email = 'carol@test.com'"))
+    rv = client.get('/api/users', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert b'caroline' in rv.data
+
+def test_catalog_etag_is_the_same_in_every_process(client):
+    etag = client.get('/api/drugs').headers['ETag']
+    assert etag == '"%s"' % make_etag('/api/drugs', '', drug_catalog.digest())
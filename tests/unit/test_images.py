@@ -0,0 +1,99 @@
+import io
+import os
+from datetime import datetime
+from PIL import Image
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder
+import images
+import blobstore
+
+def scan_bytes(size=(3000, 2000), orientation=None):
+    # A camera-like JPEG with GPS and device EXIF
+    image = Image.new('RGB', size, (200, 180, 160))
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    exif[0x8825] = {1: 'N', 2: (49.0, 15.0, 0.0)}
+    if orientation:
+        exif[images.EXIF_ORIENTATION] = orientation
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=95, exif=exif)
+    return out.getvalue()
+
+def add_line(folder, filename, data):
+    with open(os.path.join(folder, filename), 'wb') as f:
+        f.write(data)
+    user = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    order = Order(user=user)
+    line = DrugOrder(order=order, image_file=filename, date_ordered=datetime.now())
+    db.session.add_all([user, order, line])
+    db.session.commit()
+    return line
+
+def test_derivatives_are_small_and_exif_free(client, tmp_path):
+    data = scan_bytes(orientation=6)
+    line = add_line(tmp_path, 'scan.jpg', data)
+
+    values = images.process_drug_order(line.id, app.config)
+    db.session.refresh(line)
+    # Orientation 6 is rotated a quarter turn, so the upright image is portrait
+    assert (line.image_width, line.image_height) == (2000, 3000)
+    assert line.image_bytes == len(data)
+    assert values['thumb_file'] == line.thumb_file
+
+    with Image.open(blobstore.local_path(line.thumb_file)) as thumb:
+        assert max(thumb.size) <= max(app.config['IMAGE_THUMBNAIL_SIZE'])
+        assert thumb.size[1] > thumb.size[0]
+        assert len(thumb.getexif()) == 0
+    with Image.open(blobstore.local_path(line.preview_file)) as preview:
+        assert max(preview.size) <= max(app.config['IMAGE_PREVIEW_SIZE'])
+        assert len(preview.getexif()) == 0
+    assert line.thumb_bytes < line.preview_bytes < len(data)
+    assert line.thumb_bytes == os.path.getsize(blobstore.local_path(line.thumb_file))
+
+def test_pdf_and_broken_files_are_skipped(client, tmp_path):
+    pdf = add_line(tmp_path, 'scan.pdf', b'%PDF-1.4')
+    assert images.process_drug_order(pdf.id, app.config) is None
+    db.session.delete(pdf)
+    db.session.commit()
+
+    broken = DrugOrder(order=Order(), image_file='broken.jpg', date_ordered=datetime.now())
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+    db.session.add(broken)
+    db.session.commit()
+    assert images.process_drug_order(broken.id, app.config) is None
+    assert broken.thumb_file is None
+
+def test_pool_processes_in_background(client, tmp_path, monkeypatch):
+    line = add_line(tmp_path, 'scan.jpg', scan_bytes(size=(800, 600)))
+    line_id = line.id
+    db.session.rollback()  # this session's transaction would hold the write lock
+    monkeypatch.setattr(app, 'testing', False)
+    pipeline = images.ImagePipeline()
+    try:
+        values = pipeline.submit(app, line_id).result(timeout=30)
+    finally:
+        pipeline.shutdown()
+    assert values['image_width'] == 800
+    db.session.rollback()  # end this session's snapshot to see the worker's commit
+    assert db.session.get(DrugOrder, line_id).thumb_file == values['thumb_file']
+
+def test_upload_then_dashboard_shows_thumbnail(client, tmp_path):
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    customer = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    db.session.add_all([pharmacist, customer])
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(customer)
+    rv = client.post('/upload', data={'file': (io.BytesIO(scan_bytes()), 'scan.jpg')}, content_type='multipart/form-data')
+    assert rv.status_code == 200
+
+    line = DrugOrder.query.one()
+    assert line.thumb_file and line.preview_file
+
+    with client.application.test_request_context():
+        login_user(pharmacist)
+    rv = client.get('/pharmacistdash')
+    page = rv.data.decode()
+    assert f'src="/upload/{line.thumb_file}"' in page
+    assert f'data-original="/upload/{line.image_file}"' in page
@@ -0,0 +1,84 @@
+import logging
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from db import db
+import database
+import instrumentation
+
+@pytest.fixture
+def instrumented(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'metrics.db'}"
+    app.config['METRICS_PATH'] = '/metrics'
+    database.init_app(app)
+    instrumentation.init_app(app)
+
+    @app.route('/three')
+    def three_queries():
+        for _ in range(3):
+            db.session.execute(text('SELECT 1'))
+        return 'ok'
+
+    @app.route('/none')
+    def no_queries():
+        return 'ok'
+
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+def server_timing(response):
+    return dict(entry.split(';', 1) for entry in response.headers.getlist('Server-Timing'))
+
+def test_server_timing_counts_the_statements_of_the_request(instrumented):
+    client = instrumented.test_client()
+    # BEGIN and the three SELECTs
+    assert 'desc="4 queries"' in server_timing(client.get('/three'))['db']
+    assert 'desc="0 queries"' in server_timing(client.get('/none'))['db']
+    assert server_timing(client.get('/none'))['app'].startswith('dur=')
+
+def test_metrics_has_latency_and_query_histograms_per_endpoint(instrumented):
+    client = instrumented.test_client()
+    client.get('/three')
+    client.get('/three')
+    client.get('/missing')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'drugs2door_request_duration_seconds_count{endpoint="three_queries"} 2' in body
+    assert 'drugs2door_request_queries_bucket{endpoint="three_queries",le="2"} 0' in body
+    assert 'drugs2door_request_queries_bucket{endpoint="three_queries",le="5"} 2' in body
+    assert 'drugs2door_request_queries_sum{endpoint="three_queries"} 8' in body
+    assert 'drugs2door_requests_total{endpoint="unmatched",status="404"} 1' in body
+    assert 'drugs2door_catalog{stat="hits"}' in body
+
+def test_slow_requests_and_queries_are_logged(instrumented, caplog):
+    instrumented.config['SLOW_REQUEST_MS'] = 0
+    with caplog.at_level(logging.WARNING, logger='instrumentation'):
+        instrumented.test_client().get('/three')
+    assert any('Slow request GET /three (three_queries)' in message for message in caplog.messages)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SLOW_QUERY_MS'] = 0
+    database.init_app(app)
+    instrumentation.init_app(app)
+    with app.app_context(), caplog.at_level(logging.WARNING, logger='instrumentation'):
+        db.session.execute(text('SELECT :marker'), {'marker': 'needle'})
+        db.session.remove()
+    assert any('SELECT ?' in message for message in caplog.messages)
+    # Parameters can be personal data: only at DEBUG
+    assert not any('needle' in message for message in caplog.messages)
+    caplog.clear()
+    with app.app_context(), caplog.at_level(logging.DEBUG, logger='instrumentation'):
+        db.session.execute(text('SELECT :marker'), {'marker': 'needle'})
+        db.session.remove()
+    assert any('needle' in record.getMessage() for record in caplog.records if record.levelno == logging.DEBUG)
+
+def test_metrics_path_is_off_by_default(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    database.init_app(app)
+    instrumentation.init_app(app)
+    assert app.test_client().get('/metrics').status_code == 404
@@ -0,0 +1,187 @@
+import socketserver
+import threading
+import pytest
+from datetime import datetime, timedelta
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Drug, EmailOutbox
+import mailer
+from mailer import enqueue_email, deliver_due, SMTPConnection, utcnow
+
+# Minimal local SMTP server standing in for the real relay
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost test smtp')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(' ')[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN')
+            elif command == 'AUTH':
+                self.server.logins += 1
+                self.reply('235 Authentication successful')
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline().decode()
+                    if chunk.strip() == '.':
+                        break
+                    data.append(chunk)
+                self.server.messages.append(''.join(data))
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def mail_config(smtp_server):
+    config = dict(app.config)
+    config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp_server.server_address[1], MAIL_USE_TLS=False,
+                  MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_TIMEOUT=5, MAIL_RETRY_BASE_SECONDS=30)
+    return config
+
+def test_enqueue_deduplicates_per_order_status(client):
+    order = Order()
+    db.session.add(order)
+    db.session.commit()
+    for _ in range(3):
+        enqueue_email('a@test.com', 'Prescription Approved', 'approved', order_id=order.id, status='approved')
+    enqueue_email('a@test.com', 'Prescription Denied', 'denied', order_id=order.id, status='denied')
+    db.session.commit()
+    assert EmailOutbox.query.count() == 2
+
+def test_deliver_batch_over_one_connection(client, smtp_server, mail_config):
+    for i in range(5):
+        enqueue_email(f'user{i}@test.com', 'Hello', f'message {i}')
+    db.session.commit()
+
+    connection = SMTPConnection(mail_config)
+    assert deliver_due(mail_config, connection) == (5, 0)
+    assert deliver_due(mail_config, connection) == (0, 0)
+    connection.close()
+
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+    assert EmailOutbox.query.filter(EmailOutbox.sent_at.is_(None)).count() == 0
+
+def test_batch_is_claimed_with_one_statement_for_the_whole_batch(client, statements):
+    for i in range(5):
+        enqueue_email(f'user{i}@test.com', 'Hello', f'message {i}')
+    db.session.commit()
+    due = [message.id for message in EmailOutbox.query]
+    db.session.rollback()
+
+    before = utcnow()
+    with statements:
+        assert mailer._claim(due, timedelta(seconds=5 * 6)) == due
+    assert sum(statement.startswith('UPDATE') for statement in statements.statements) == 1
+    assert all(message.next_attempt_at >= before + timedelta(seconds=30) for message in EmailOutbox.query)
+    # Leased rows are not due for another worker
+    assert mailer._claim(due, timedelta(seconds=30)) == []
+
+def test_failed_send_is_retried_with_backoff(client, smtp_server, mail_config):
+    enqueue_email('a@test.com', 'Hello', 'body')
+    db.session.commit()
+    broken = dict(mail_config, MAIL_PORT=1)
+
+    before = utcnow()
+    assert deliver_due(broken, SMTPConnection(broken)) == (0, 1)
+    message = EmailOutbox.query.one()
+    assert message.attempts == 1 and message.sent_at is None and message.last_error
+    assert message.next_attempt_at >= before + timedelta(seconds=30)
+
+    # Not due yet
+    assert deliver_due(mail_config, SMTPConnection(mail_config)) == (0, 0)
+
+    message.next_attempt_at = utcnow()
+    db.session.commit()
+    assert deliver_due(mail_config, SMTPConnection(mail_config)) == (1, 0)
+    assert len(smtp_server.messages) == 1
+
+def test_retry_delay_grows_and_caps():
+    config = dict(MAIL_RETRY_BASE_SECONDS=30, MAIL_RETRY_MAX_SECONDS=3600)
+    delays = [mailer.retry_delay(config, n).total_seconds() for n in range(1, 10)]
+    assert delays[:3] == [30, 60, 120]
+    assert delays[-1] == 3600
+
+def test_review_order_only_enqueues(client, smtp_server):
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    customer = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    order = Order(user=customer)
+    drug = Drug(name='Aspirin', price=1)
+    db.session.add_all([pharmacist, customer, order, drug])
+    db.session.commit()
+    for _ in range(2):
+        db.session.add(DrugOrder(order_id=order.id, date_ordered=datetime.now()))
+    db.session.commit()
+    line_ids = [item.id for item in order.items]
+    with client.application.test_request_context():
+        login_user(pharmacist)
+
+    data = {'status': 'approved'}
+    for line_id in line_ids:
+        data.update({f'drug_orders-{line_id}-name': str(drug.id), f'drug_orders-{line_id}-quantity': '2',
+                     f'drug_orders-{line_id}-refills': '0'})
+    rv = client.post(f'/review_order/{order.id}', data=data)
+    assert rv.status_code == 302
+
+    queued = EmailOutbox.query.all()
+    assert len(queued) == 1
+    assert queued[0].to_address == 'cust@test.com' and queued[0].status == 'approved'
+    assert smtp_server.messages == []
+
+def test_worker_refuses_to_start_without_credentials(client, mail_config, monkeypatch):
+    for key in ('MAIL_USERNAME', 'MAIL_PASSWORD'):
+        monkeypatch.setitem(app.config, key, mail_config[key])
+    with pytest.raises(RuntimeError):
+        mailer.start_outbox_worker(app)
+
+def test_worker_thread_drains_outbox(client, smtp_server, mail_config, monkeypatch):
+    for key in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS'):
+        monkeypatch.setitem(app.config, key, mail_config[key])
+    monkeypatch.setitem(app.config, 'MAIL_USERNAME', 'outbox@test.com')
+    monkeypatch.setitem(app.config, 'MAIL_PASSWORD', 'secret')
+    enqueue_email('a@test.com', 'Hello', 'body')
+    db.session.commit()
+
+    worker = mailer.start_outbox_worker(app, poll_seconds=0.05)
+    try:
+        for _ in range(100):
+            if smtp_server.messages:
+                break
+            threading.Event().wait(0.05)
+    finally:
+        worker.stop(timeout=5)
+    assert len(smtp_server.messages) == 1
+    assert smtp_server.logins == 1
@@ -1,10 +1,15 @@
+import os
+import tempfile
+from datetime import datetime
 import pytest
 from unittest.mock import patch, mock_open
+from sqlalchemy import create_engine, select
 from manage import import_data
 from models import User, Role, Order, DrugOrder, Drug
 import unittest
 from app import app, db
 from manage import create_random_orders, create_pharmacist
+import seeding
 from unittest.mock import patch
 
 # Mock data for the CSV files
@@ -84,8 +89,44 @@ class TestManageFunctions(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
 
-if __name__ == '__main__':
-    unittest.main()
-
+class TestSeeding(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def seeded_rows(self, name, **kwargs):
+        engine = create_engine(f"sqlite:///{os.path.join(self.tmp_dir.name, name)}")
+        db.metadata.create_all(engine)
+        totals = seeding.seed(engine, as_of=datetime(2024, 1, 1), **kwargs)
+        with engine.connect() as conn:
+            rows = {table.name: conn.execute(select(table).order_by(table.c.id)).all()
+                    for table in (User.__table__, Order.__table__, DrugOrder.__table__)}
+        engine.dispose()
+        return totals, rows
+
+    def test_seed_hashes_the_password_once_and_is_deterministic(self):
+        with patch("seeding.bcrypt.hashpw", side_effect=mock_hashpw) as hashpw:
+            totals, first = self.seeded_rows('a.db', users=25, batch_size=10, rng_seed=7)
+            _, second = self.seeded_rows('b.db', users=25, batch_size=10, rng_seed=7)
+            _, other = self.seeded_rows('c.db', users=25, batch_size=10, rng_seed=8)
+        self.assertEqual(hashpw.call_count, 3)
+        self.assertEqual(totals['users'], 25)
+        self.assertEqual(len(first['users']), 25)
+        self.assertEqual(totals['orders'], len(first['order']))
+        self.assertEqual(totals['lines'], len(first['drug_order']))
+        self.assertEqual({user.password for user in first['users']}, {'hashed_password'})
+        self.assertEqual(first, second)
+        self.assertNotEqual(first['drug_order'], other['drug_order'])
+
+    def test_seed_fills_the_order_summaries(self):
+        totals, rows = self.seeded_rows('a.db', users=10, orders_per_user=(1, 1), lines_per_order=(2, 2))
+        self.assertEqual(totals, {'users': 10, 'orders': 10, 'lines': 20})
+        for order in rows['order']:
+            self.assertEqual(order.item_count, 2)
+            self.assertIsNotNone(order.latest_date_ordered)
+        self.assertLessEqual({order.status for order in rows['order']}, {'pending', 'approved'})
 
+    def tearDown(self):
+        self.tmp_dir.cleanup()
 
+if __name__ == '__main__':
+    unittest.main()
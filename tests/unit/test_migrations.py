@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine, text
+from db import db
+import models
+import migrations
+
+def index_names(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).fetchall()
+    return {row[0] for row in rows}
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    db.metadata.create_all(engine)
+    migrations.stamp(engine)
+    yield engine
+    engine.dispose()
+
+def test_stamp_marks_head(engine):
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.head()
+    assert migrations.upgrade(engine) == []
+
+def test_downgrade_then_upgrade_indexes(engine):
+    migrations.downgrade(engine, 0)
+    assert 'ix_drug_order_approved_date' not in index_names(engine)
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == 0
+
+    applied = migrations.upgrade(engine)
+    assert applied[0] == 1
+    names = index_names(engine)
+    for name, _ in migrations.HOT_PATH_INDEXES:
+        assert name in names
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.head()
+
+def test_upgrade_to_target(engine):
+    migrations.downgrade(engine, 0)
+    assert migrations.upgrade(engine, target=1) == [1]
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == 1
+
+def test_pending_query_uses_index(engine):
+    with engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM drug_order WHERE prescription_approved IS NULL ORDER BY date_ordered DESC LIMIT 10"
+        )).fetchall()
+    assert any('ix_drug_order_approved_date' in row[-1] for row in plan)
@@ -0,0 +1,69 @@
+import io
+import os
+import pytest
+from sqlalchemy import event
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Blob
+import blobstore
+import order_service
+
+@pytest.fixture
+def customer(client):
+    user = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def test_order_and_line_are_committed_once(client, customer):
+    commits = []
+    listener = lambda connection: commits.append(connection)
+    event.listen(db.engine, 'commit', listener)
+    try:
+        line = order_service.create_prescription_order(customer.id, io.BytesIO(b'%PDF-1.4 scan'), '.pdf')
+    finally:
+        event.remove(db.engine, 'commit', listener)
+    assert len(commits) == 1
+    assert line.order.user_id == customer.id
+    assert line.prescription_approved is None
+    assert os.path.exists(blobstore.local_path(line.image_file))
+
+def test_failed_commit_leaves_no_order_and_no_file(client, customer):
+    def fail(session):
+        if not session.in_nested_transaction():
+            raise RuntimeError('disk full')
+    event.listen(db.session, 'before_commit', fail)
+    try:
+        with pytest.raises(RuntimeError):
+            order_service.create_prescription_order(customer.id, io.BytesIO(b'%PDF-1.4 lost'), '.pdf')
+    finally:
+        event.remove(db.session, 'before_commit', fail)
+
+    assert Order.query.count() == 0
+    assert DrugOrder.query.count() == 0
+    assert Blob.query.count() == 0
+    store = blobstore.get_store()
+    assert [path for _, path in store.files()] == []
+
+def test_rollback_keeps_files_that_were_already_stored(client, customer):
+    kept = order_service.create_prescription_order(customer.id, io.BytesIO(b'%PDF-1.4 same'), '.pdf')
+    def fail(session):
+        if not session.in_nested_transaction():
+            raise RuntimeError('disk full')
+    event.listen(db.session, 'before_commit', fail)
+    try:
+        with pytest.raises(RuntimeError):
+            order_service.create_prescription_order(customer.id, io.BytesIO(b'%PDF-1.4 same'), '.pdf')
+    finally:
+        event.remove(db.session, 'before_commit', fail)
+    assert os.path.exists(blobstore.local_path(kept.image_file))
+    assert DrugOrder.query.count() == 1
+
+def test_upload_form_creates_one_order(client, customer):
+    with client.application.test_request_context():
+        login_user(customer)
+    rv = client.post('/upload', data={'file': (io.BytesIO(b'%PDF-1.4 form'), 'scan.pdf')}, content_type='multipart/form-data')
+    assert rv.status_code == 200
+    line = DrugOrder.query.one()
+    assert line.order.user_id == customer.id
+    assert line.order.item_count == 1
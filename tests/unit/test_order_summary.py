@@ -0,0 +1,84 @@
+import io
+from decimal import Decimal
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from flask_login import login_user
+from app import app, db
+from models import User, Drug, Order, DrugOrder
+from order_summary import refresh_order_summaries, verify_order_summaries
+
+def make_order(lines):
+    user = User(name='customer', email='customer@test.com', password='x', phn='1111111111', role_id=2)
+    order = Order(user=user)
+    db.session.add(order)
+    for drug, quantity, approved in lines:
+        db.session.add(DrugOrder(order=order, drug=drug, quantity=quantity, prescription_approved=approved, date_ordered=datetime.now()))
+    db.session.commit()
+    return order
+
+def test_summary_follows_lines(client):
+    aspirin = Drug(name='Aspirin', price=2.50)
+    statin = Drug(name='Statin', price=10)
+    order = make_order([(aspirin, 4, None), (statin, 1, None)])
+
+    assert order.status == 'pending'
+    assert order.item_count == 2
+    assert order.total_amount == Decimal('20.00')
+    assert order.paid is False
+
+    for item in order.items:
+        item.prescription_approved = True
+    db.session.commit()
+    assert order.status == 'approved'
+
+    for item in order.items:
+        item.paid = True
+    statin.price = 12
+    db.session.commit()
+    assert order.paid is True
+    assert order.total_amount == Decimal('22.00')
+
+    order.items[0].prescription_approved = False
+    db.session.commit()
+    assert order.status == 'denied'
+
+def test_new_line_by_order_id(client):
+    order = make_order([])
+    assert order.status is None and order.item_count == 0
+    later = datetime.now() + timedelta(days=1)
+    db.session.add(DrugOrder(order_id=order.id, date_ordered=later))
+    db.session.commit()
+    assert order.item_count == 1
+    assert order.latest_date_ordered == later
+
+def test_pay_route_marks_order_paid(client):
+    order = make_order([(Drug(name='Aspirin', price=1), 1, True)])
+    rv = client.post('/pay', json={'orderId': order.items[0].id})
+    assert rv.status_code == 200
+    assert db.session.get(Order, order.id).paid is True
+
+def test_upload_creates_pending_order(client):
+    user = User(name='uploader', email='uploader@test.com', password='x', phn='2222222222', role_id=2)
+    db.session.add(user)
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(user)
+    rv = client.post('/upload', data={'file': (io.BytesIO(b'abc'), 'scan.jpg')}, content_type='multipart/form-data')
+    assert rv.status_code == 200
+    order = Order.query.filter_by(user_id=user.id).one()
+    assert order.status == 'pending'
+    assert order.item_count == 1
+
+def test_verify_and_backfill(client):
+    order = make_order([(Drug(name='Aspirin', price=3), 2, None)])
+    db.session.execute(text('UPDATE "order" SET status = NULL, total_amount = 0, item_count = 0'))
+    db.session.commit()
+
+    mismatches = verify_order_summaries(db.session.connection())
+    assert {column for _, column, _, _ in mismatches} == {'status', 'total_amount', 'item_count'}
+
+    refresh_order_summaries(db.session.connection())
+    db.session.commit()
+    assert verify_order_summaries(db.session.connection()) == []
+    db.session.refresh(order)
+    assert order.total_amount == Decimal('6.00')
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder
+from pagination import keyset_paginate, encode_cursor, decode_cursor
+
+def seed_orders(count, user=None):
+    user = user or User(name='customer', email='customer@test.com', password='x', phn='1111111111', role_id=2)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        order = Order(user=user)
+        # Pairs of orders share a timestamp so the id tiebreaker matters
+        db.session.add(DrugOrder(order=order, date_ordered=start + timedelta(hours=i // 2)))
+        db.session.add(order)
+    db.session.commit()
+    return user
+
+def order_ids(page):
+    return [order.id for order in page]
+
+def paginate(cursor=None, per_page=4):
+    return keyset_paginate(Order.query, [Order.latest_date_ordered, Order.id], cursor=cursor, per_page=per_page)
+
+def test_cursor_round_trip():
+    when = datetime(2024, 5, 1, 12, 30)
+    token = encode_cursor('next', [when, 7], 3)
+    assert decode_cursor(token) == ('next', [when, 7], 3)
+    assert decode_cursor('not-a-cursor') is None
+    assert decode_cursor(None) is None
+
+# Well-formed tokens whose key does not fit the listing's sort columns
+MISFIT_CURSORS = [
+    encode_cursor('next', [1], 2),
+    encode_cursor('next', [datetime(2024, 1, 1), 7, 3], 2),
+    encode_cursor('next', ['2024-01-01T00:00:00', 7], 2),
+    encode_cursor('next', [datetime(2024, 1, 1), 'seven'], 2),
+    encode_cursor('next', [datetime(2024, 1, 1), True], 2),
+]
+
+def test_misfit_cursor_gives_the_first_page(client):
+    seed_orders(6)
+    first = order_ids(paginate())
+    for cursor in MISFIT_CURSORS:
+        page = paginate(cursor)
+        assert order_ids(page) == first and page.number == 1
+
+def test_misfit_cursor_on_every_listing(client):
+    user = seed_orders(6)
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    db.session.add(pharmacist)
+    db.session.commit()
+    for cursor in MISFIT_CURSORS:
+        rv = client.get(f'/api/users?limit=10&cursor={cursor}')
+        assert rv.status_code == 200
+        assert [row['id'] for row in rv.get_json()] == [user.id, pharmacist.id]
+        with client.application.test_request_context():
+            login_user(pharmacist)
+        assert client.get(f'/pharmacistdash?cursor_pending={cursor}').status_code == 200
+        with client.application.test_request_context():
+            login_user(user)
+        rv = client.get(f'/orders?cursor={cursor}')
+        assert rv.status_code == 200 and b'Page 1' in rv.data
+
+def test_walk_forward_and_back(client):
+    seed_orders(10)
+    expected = [o.id for o in Order.query.order_by(Order.latest_date_ordered.desc(), Order.id.desc())]
+
+    first = paginate()
+    assert order_ids(first) == expected[:4]
+    assert first.number == 1 and not first.has_prev and first.has_next
+
+    second = paginate(first.next_cursor)
+    assert order_ids(second) == expected[4:8]
+    assert second.number == 2 and second.has_prev and second.has_next
+
+    third = paginate(second.next_cursor)
+    assert order_ids(third) == expected[8:]
+    assert not third.has_next
+
+    back = paginate(third.prev_cursor)
+    assert order_ids(back) == expected[4:8]
+    assert back.number == 2 and back.has_next
+
+    start = paginate(back.prev_cursor)
+    assert order_ids(start) == expected[:4]
+    assert not start.has_prev
+
+def test_deep_page_is_single_query(client, statements):
+    seed_orders(50)
+    page = paginate(per_page=5)
+    for _ in range(8):
+        page = paginate(page.next_cursor, per_page=5)
+    with statements:
+        paginate(page.next_cursor, per_page=5)
+    assert statements.count == 1
+    statement, parameters = statements.statements[0], statements.parameters[0]
+    # Seeks straight to the boundary key instead of skipping 45 rows
+    assert 'ORDER BY' in statement and parameters[-1] == 0
+
+def test_orders_route_pages(client):
+    user = seed_orders(25)
+    with client.application.test_request_context():
+        login_user(user)
+    rv = client.get('/orders')
+    assert rv.status_code == 200
+    assert b'Page 1' in rv.data
+    assert b'cursor=' in rv.data
@@ -0,0 +1,69 @@
+import pytest
+from app import app, db
+from models import User
+import passwords
+from passwords import PasswordHasher, calibrate, rounds_of
+
+@pytest.fixture
+def client(client, monkeypatch):
+    # Cheap hashes, and a hasher of our own so its limits start fresh
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_ROUNDS', 4)
+    monkeypatch.setattr(passwords, 'password_hasher', PasswordHasher())
+    return client
+
+@pytest.fixture
+def customer(client):
+    user = User(name='Cust', email='cust@test.com', password=passwords.hash_password('password'), phn='1111111111', role_id=2)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def test_calibrate_stays_within_bounds():
+    assert calibrate(0.001, minimum=4, maximum=8) == 4
+    assert calibrate(10 ** 9, minimum=4, maximum=8) == 8
+
+def test_hash_uses_the_configured_cost(client):
+    hashed = passwords.hash_password('secret')
+    assert rounds_of(hashed) == 4
+    assert passwords.check_password('secret', hashed)
+    assert not passwords.check_password('wrong', hashed)
+    assert not passwords.check_password('secret', None)
+    assert not passwords.check_password('secret', 'not a bcrypt hash')
+
+def test_login_rehashes_when_the_cost_changes(client, customer, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_ROUNDS', 5)
+    rv = client.post('/login', data={'email': 'cust@test.com', 'password': 'password'})
+    assert rv.status_code == 302
+    db.session.refresh(customer)
+    assert rounds_of(customer.password) == 5
+    assert passwords.check_password('password', customer.password)
+
+def test_login_never_lowers_the_cost(client, customer, monkeypatch):
+    # A worker configured with a higher cost hashed it
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_ROUNDS', 5)
+    customer.password = passwords.hash_password('password')
+    db.session.commit()
+    stored = customer.password
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_ROUNDS', 4)
+    assert not passwords.needs_rehash(stored)
+    rv = client.post('/login', data={'email': 'cust@test.com', 'password': 'password'})
+    assert rv.status_code == 302
+    db.session.refresh(customer)
+    assert customer.password == stored
+
+def test_login_fails_fast_when_hashing_is_saturated(client, customer, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_MAX_PENDING', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_RETRY_AFTER', 3)
+    rv = client.post('/login', data={'email': 'cust@test.com', 'password': 'password'})
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == '3'
+
+def test_hashing_runs_on_the_process_pool():
+    config = dict(passwords.DEFAULT_CONFIG, PASSWORD_HASH_ROUNDS=4, PASSWORD_HASH_WORKERS=1)
+    hasher = PasswordHasher()
+    try:
+        hashed = hasher.hash('secret', config)
+        assert hasher.check('secret', hashed, config)
+        assert hasher._executor is not None
+    finally:
+        hasher.shutdown()
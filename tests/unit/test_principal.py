@@ -0,0 +1,80 @@
+import pytest
+from app import app, db
+from extensions import bcrypt
+from models import User, Order
+import principal
+
+# No app context is held around the requests: Flask-Login keeps the loaded
+# user on `g`, which would then outlive a request
+@pytest.fixture
+def client(database):
+    return app.test_client()
+
+@pytest.fixture
+def customer(client):
+    with app.app_context():
+        user = User(name='Cust', email='cust@test.com', password=bcrypt.generate_password_hash('password').decode(),
+                    phn='1111111111', phone='604-111-1111', role_id=2)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return user_id
+
+@pytest.fixture
+def user_queries(statements):
+    with statements:
+        yield statements
+
+def from_users(statements):
+    return [statement for statement in statements.statements if 'FROM users' in statement]
+
+def test_fresh_principal_skips_the_users_table(client, customer, user_queries):
+    assert client.get('/dashboard').status_code == 200
+    assert len(from_users(user_queries)) == 1  # first request: fields read and cached
+    rv = client.get('/dashboard')
+    assert rv.status_code == 200
+    assert b'Welcome, Cust!' in rv.data
+    assert len(from_users(user_queries)) == 1
+    with client.session_transaction() as session:
+        assert 'password' not in session[principal.SESSION_KEY]
+
+def test_expired_principal_is_reloaded(client, customer, user_queries, monkeypatch):
+    client.get('/dashboard')
+    monkeypatch.setitem(app.config, 'PRINCIPAL_TTL', 0)
+    client.get('/dashboard')
+    assert len(from_users(user_queries)) == 2
+
+def test_deleted_user_is_logged_out_once_the_principal_expires(client, customer, monkeypatch):
+    client.get('/dashboard')
+    with app.app_context():
+        db.session.delete(db.session.get(User, customer))
+        db.session.commit()
+    monkeypatch.setitem(app.config, 'PRINCIPAL_TTL', 0)
+    rv = client.get('/dashboard')
+    assert rv.status_code == 302
+
+def test_userdetails_update_drops_the_cached_principal(client, customer, user_queries):
+    client.get('/dashboard')
+    rv = client.post('/userdetails', data={'email': 'cust@test.com', 'name': 'Cust', 'address': '1 Main St',
+                                          'phone': '6042222222', 'phn': '1111111111', 'current_password': 'password',
+                                          'new_password': 'Newpassword1!', 'confirm_password': 'Newpassword1!'})
+    assert rv.status_code == 302
+    with client.session_transaction() as session:
+        assert principal.SESSION_KEY not in session
+    with app.app_context():
+        assert db.session.get(User, customer).phone == '604-222-2222'
+
+def test_principal_loads_other_attributes_lazily(client, customer):
+    with app.app_context():
+        db.session.add(Order(user_id=customer))
+        db.session.commit()
+        current = principal.Principal(customer, 'Cust', 'cust@test.com', 2)
+        assert current.get_id() == str(customer)
+        assert current.is_authenticated and current.is_active and not current.is_anonymous
+        assert [order.user_id for order in current.orders] == [customer]
+        assert current.address is None
+        with pytest.raises(AttributeError):
+            current.nickname = 'C'
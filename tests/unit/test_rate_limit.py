@@ -0,0 +1,66 @@
+import pytest
+from app import app, db
+from rate_limit import MemoryStore, SQLiteStore, _sliding_window
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATELIMIT_RULES', {'login': {'ip': (4, 60), 'account': (2, 60)},
+                                                        'pay': {'ip': (1, 60)},
+                                                        'register': {'ip': (1, 3600)}})
+    monkeypatch.setitem(app.extensions, 'rate_limit', MemoryStore(100))
+    return client
+
+def hits(store, key, count, now):
+    return [store.hit(key, 3, 60, now) for _ in range(count)]
+
+def test_sliding_window_weights_the_previous_window():
+    store = MemoryStore(10)
+    assert hits(store, 'k', 4, now=600) == [0, 0, 0, 60]
+    # Halfway through the next window, half of the previous three still count,
+    # and the third request must wait until less than one of them does
+    assert hits(store, 'k', 3, now=690) == [0, 0, 10]
+    assert _sliding_window(0, 0, 0, 3, 60, 600) == ((600, 1, 0), 0)
+
+def test_memory_store_evicts_least_recently_used_keys():
+    store = MemoryStore(2)
+    hits(store, 'a', 3, now=0)
+    hits(store, 'b', 1, now=0)
+    store.hit('c', 3, 60, now=0)
+    assert list(store._counters) == ['b', 'c']
+    assert store.hit('a', 3, 60, now=0) == 0
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    first, second = SQLiteStore(str(tmp_path / 'rl.db')), SQLiteStore(str(tmp_path / 'rl.db'))
+    assert hits(first, 'k', 2, now=600) == [0, 0]
+    assert hits(second, 'k', 2, now=610) == [0, 50]
+
+def test_login_is_rejected_before_any_query(client, statements):
+    for _ in range(2):
+        assert client.post('/login', data={'email': 'who@test.com', 'password': 'x'}).status_code == 200
+    with statements:
+        rv = client.post('/login', data={'email': 'WHO@test.com', 'password': 'x'})
+    assert rv.status_code == 429
+    assert int(rv.headers['Retry-After']) > 0
+    assert statements.count == 0
+    # Another account from the same address still gets through, until the address runs out
+    assert client.post('/login', data={'email': 'other@test.com', 'password': 'x'}).status_code == 200
+    assert client.post('/login', data={'email': 'third@test.com', 'password': 'x'}).status_code == 429
+    # Showing the form is not counted
+    assert client.get('/login').status_code == 200
+
+def test_json_endpoints_get_a_json_rejection(client):
+    client.post('/pay', json={})
+    rv = client.post('/pay', json={})
+    assert rv.status_code == 429
+    assert rv.get_json()['success'] is False
+    # /pay and /payrefill share the scope
+    assert client.post('/payrefill', json={}).status_code == 429
+
+def test_registration_counts_only_valid_submissions(client):
+    for _ in range(3):
+        assert client.post('/register', data={'name': 'New', 'email': 'not-an-email'}).status_code == 200
+    form = {'name': 'New Person', 'email': 'new@test.com', 'phn': '1234567890',
+            'password': 'passw0rd!', 'confirm_password': 'passw0rd!'}
+    assert client.post('/register', data=form).status_code == 302
+    assert client.post('/register', data=dict(form, email='next@test.com')).status_code == 429
@@ -0,0 +1,125 @@
+import io
+import os
+import time
+import pytest
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Blob
+import blobstore
+import resumable_upload
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_CHUNK_BYTES', 1000)
+    return client
+
+@pytest.fixture
+def customer(client):
+    user = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    db.session.add(user)
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(user)
+    return user
+
+SCAN = b'%PDF-1.4\n' + bytes(range(256)) * 10
+
+def begin(client, filename='scan.pdf', size=len(SCAN)):
+    return client.post('/api/uploads', json={'filename': filename, 'size': size})
+
+def put(client, upload_id, offset, data):
+    return client.put(f'/api/uploads/{upload_id}', data=data, headers={'Upload-Offset': str(offset)})
+
+def test_chunked_upload_resumes_and_creates_order(client, customer):
+    rv = begin(client)
+    assert rv.status_code == 201
+    upload = rv.get_json()
+    assert upload['offset'] == 0 and upload['chunk_size'] == 1000
+    assert rv.headers['Location'] == f"/api/uploads/{upload['upload_id']}"
+    upload_id = upload['upload_id']
+
+    assert put(client, upload_id, 0, SCAN[:1000]).get_json()['offset'] == 1000
+    # A chunk sent at a stale offset is refused and tells the client where to resume
+    rv = put(client, upload_id, 0, SCAN[:1000])
+    assert rv.status_code == 409
+    assert rv.get_json()['offset'] == 1000
+    assert client.get(f'/api/uploads/{upload_id}').get_json()['offset'] == 1000
+
+    # Completing early is refused
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 409
+
+    offset = 1000
+    while offset < len(SCAN):
+        offset = put(client, upload_id, offset, SCAN[offset:offset + 1000]).get_json()['offset']
+    assert offset == len(SCAN)
+
+    rv = client.post(f'/api/uploads/{upload_id}/complete')
+    assert rv.status_code == 201
+    result = rv.get_json()
+    line = db.session.get(DrugOrder, result['drug_order_id'])
+    assert line.order.user_id == customer.id
+    assert line.prescription_approved is None
+    assert result['image_file'] == line.image_file
+    with open(blobstore.local_path(line.image_file), 'rb') as f:
+        assert f.read() == SCAN
+    assert db.session.get(Blob, blobstore.parse_ref(line.image_file)).refcount == 1
+    assert os.listdir(resumable_upload.partial_folder()) == []
+
+    # The upload is gone once it has become an order
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 404
+    assert Order.query.count() == 1
+
+def test_type_and_size_are_checked_while_streaming(client, customer):
+    assert begin(client, filename='notes.txt').status_code == 415
+    assert begin(client, size=app.config['UPLOAD_MAX_BYTES'] + 1).status_code == 413
+    assert begin(client, size='big').status_code == 400
+
+    upload_id = begin(client, filename='scan.png').get_json()['upload_id']
+    rv = put(client, upload_id, 0, SCAN[:500])
+    assert rv.status_code == 415
+    # The upload is discarded on the first bytes that give it away
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+    upload_id = begin(client, size=1500).get_json()['upload_id']
+    assert put(client, upload_id, 0, SCAN[:1001]).status_code == 413
+    assert put(client, upload_id, 0, SCAN[:1000]).status_code == 200
+    assert put(client, upload_id, 1000, SCAN[:600]).status_code == 413
+    assert client.get(f'/api/uploads/{upload_id}').get_json()['offset'] == 1000
+
+def test_chunk_is_streamed_to_disk(client, customer, monkeypatch):
+    upload_id = begin(client).get_json()['upload_id']
+    reads = []
+    stream = io.BytesIO(SCAN[:1000])
+    original = stream.read
+    monkeypatch.setattr(blobstore, 'CHUNK_SIZE', 64)
+    monkeypatch.setattr(stream, 'read', lambda size: reads.append(size) or original(size))
+    with app.test_request_context():
+        assert resumable_upload.write_chunk(upload_id, customer.id, 0, stream) == 1000
+    assert max(reads) == 64
+
+def test_uploads_are_private_to_their_owner(client, customer):
+    upload_id = begin(client).get_json()['upload_id']
+    other = User(name='other', email='other@test.com', password='x', phn='2222222222', role_id=2)
+    db.session.add(other)
+    db.session.commit()
+    with client.application.test_request_context():
+        login_user(other)
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert put(client, upload_id, 0, SCAN[:1000]).status_code == 404
+    assert client.get('/api/uploads/../../app.py').status_code == 404
+
+def test_cancel_and_expire(client, customer):
+    upload_id = begin(client).get_json()['upload_id']
+    assert client.delete(f'/api/uploads/{upload_id}').status_code == 200
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+    begin(client)
+    assert resumable_upload.expire(app.config) == 0
+    assert resumable_upload.expire(app.config, now=time.time() + app.config['UPLOAD_SESSION_TTL'] + 1) == 1
+    assert os.listdir(resumable_upload.partial_folder()) == []
+
+def test_oversized_request_is_rejected(client, customer, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 100)
+    upload_id = begin(client).get_json()['upload_id']
+    rv = put(client, upload_id, 0, SCAN[:500])
+    assert rv.status_code == 413
@@ -0,0 +1,168 @@
+from datetime import datetime
+from flask_login import login_user
+from app import app, db
+from models import User, Order, DrugOrder, Drug, EmailOutbox
+from catalog import drug_catalog
+
+def seed(count, lines_per_order=2):
+    pharmacist = User(name='pharm', email='pharm@test.com', password='x', phn='9999999999', role_id=1)
+    customer = User(name='cust', email='cust@test.com', password='x', phn='1111111111', role_id=2)
+    drug = Drug(name='Aspirin', price=2)
+    orders = [Order(user=customer) for _ in range(count)]
+    for order in orders:
+        for _ in range(lines_per_order):
+            db.session.add(DrugOrder(order=order, drug=drug, quantity=1, date_ordered=datetime.now()))
+    db.session.add_all([pharmacist, customer, drug] + orders)
+    db.session.commit()
+    return pharmacist, customer, drug, orders
+
+def login(client, user):
+    with client.application.test_request_context():
+        login_user(user)
+
+def test_bulk_approve_many_orders(client, statements):
+    pharmacist, _, _, orders = seed(20)
+    order_ids = [order.id for order in orders]
+    login(client, pharmacist)
+
+    with statements:
+        rv = client.post('/api/review/bulk', json=[{'order_id': order_id, 'decision': 'approve'} for order_id in order_ids])
+
+    assert rv.status_code == 200
+    assert rv.json['success']
+    assert [result['order_id'] for result in rv.json['results']] == order_ids
+    assert all(result['updated'] == 2 for result in rv.json['results'])
+    assert DrugOrder.query.filter(DrugOrder.prescription_approved.is_(True)).count() == 40
+    assert {order.status for order in Order.query} == {'approved'}
+    assert EmailOutbox.query.count() == 20
+    # Orders with their users, their lines, the outbox rows, one INSERT of the
+    # emails, one bulk UPDATE for all 40 lines and the order summaries
+    assert statements.count == 6
+    assert sum(statement.startswith('UPDATE drug_order') for statement in statements.statements) == 1
+    assert sum('email_outbox' in statement for statement in statements.statements) == 2
+
+def test_bulk_requeues_existing_emails_with_one_lookup(client):
+    pharmacist, _, _, orders = seed(3)
+    order_ids = [order.id for order in orders]
+    login(client, pharmacist)
+    client.post('/api/review/bulk', json=[{'order_id': order_id, 'decision': 'approve'} for order_id in order_ids[:2]])
+    EmailOutbox.query.filter_by(order_id=order_ids[0]).update({'sent_at': datetime.now()})
+    db.session.commit()
+
+    rv = client.post('/api/review/bulk', json=[{'order_id': order_id, 'decision': 'deny', 'reason': 'Expired'}
+                                               for order_id in order_ids])
+    assert rv.json['success']
+    rv = client.post('/api/review/bulk', json=[{'order_id': order_id, 'decision': 'approve'} for order_id in order_ids])
+    assert rv.json['success']
+    db.session.expire_all()
+    emails = EmailOutbox.query.order_by(EmailOutbox.order_id, EmailOutbox.status).all()
+    assert [(email.order_id, email.status) for email in emails] == [
+        (order_id, status) for order_id in order_ids for status in ('approved', 'denied')]
+    # The already-sent approval of the first order is queued again
+    assert all(email.sent_at is None for email in emails if email.status == 'approved')
+
+def test_bulk_deny_edits_and_adds_lines(client):
+    pharmacist, _, drug, orders = seed(1)
+    order = orders[0]
+    line_ids = [item.id for item in order.items]
+    other = Drug(name='Ibuprofen', price=5)
+    db.session.add(other)
+    db.session.commit()
+    login(client, pharmacist)
+
+    rv = client.post('/api/review/bulk', json={'decisions': [{
+        'order_id': order.id, 'decision': 'deny', 'reason': 'Expired',
+        'items': [{'id': line_ids[0], 'quantity': 3}, {'drug': 'Ibuprofen', 'quantity': 2}],
+    }]})
+    assert rv.status_code == 200
+    assert rv.json['results'][0] == {'order_id': order.id, 'success': True, 'status': 'denied', 'updated': 1, 'created': 1}
+
+    denied = DrugOrder.query.filter_by(order_id=order.id, prescription_approved=False).all()
+    assert sorted(line.quantity for line in denied) == [2, 3]
+    assert {line.denyreason for line in denied} == {'Expired'}
+    assert db.session.get(Order, order.id).item_count == 3
+    assert EmailOutbox.query.one().status == 'denied'
+
+def test_bulk_reports_per_order_errors(client):
+    pharmacist, _, _, orders = seed(2)
+    login(client, pharmacist)
+    rv = client.post('/api/review/bulk', json=[
+        {'order_id': orders[0].id, 'decision': 'approve'},
+        {'order_id': 9999, 'decision': 'approve'},
+        {'order_id': orders[1].id, 'decision': 'deny'},
+        {'order_id': orders[1].id, 'decision': 'maybe'},
+        {'order_id': orders[1].id, 'decision': 'approve', 'items': [{'drug': 'Nonexistent'}]},
+    ])
+    assert rv.status_code == 200
+    results = rv.json['results']
+    assert not rv.json['success']
+    assert [result['success'] for result in results] == [True, False, False, False, False]
+    assert results[1]['error'] == 'Order not found'
+    # The valid decision is still applied
+    assert db.session.get(Order, orders[0].id).status == 'approved'
+    assert db.session.get(Order, orders[1].id).status == 'pending'
+
+def test_bulk_requires_pharmacist(client):
+    _, customer, _, orders = seed(1)
+    login(client, customer)
+    rv = client.post('/api/review/bulk', json=[{'order_id': orders[0].id, 'decision': 'approve'}])
+    assert rv.status_code == 403
+    assert db.session.get(Order, orders[0].id).status == 'pending'
+
+def test_bulk_rejects_bad_payload(client):
+    pharmacist, _, _, _ = seed(1)
+    login(client, pharmacist)
+    assert client.post('/api/review/bulk', json={'nope': 1}).status_code == 400
+    assert client.post('/api/review/bulk', json=[]).status_code == 400
+
+def review_form(lines, drug, status='approved'):
+    data = {'status': status}
+    for line_id in lines:
+        data.update({f'drug_orders-{line_id}-name': drug.name, f'drug_orders-{line_id}-quantity': '2',
+                     f'drug_orders-{line_id}-refills': ''})
+    return data
+
+def test_review_order_statements_independent_of_line_count(client, statements):
+    pharmacist, _, drug, orders = seed(2, lines_per_order=1)
+    small = orders[0]
+    large = orders[1]
+    for _ in range(29):
+        db.session.add(DrugOrder(order=large, drug=drug, quantity=1, date_ordered=datetime.now()))
+    db.session.commit()
+    small_form = review_form([item.id for item in small.items], drug)
+    large_form = review_form([item.id for item in large.items], drug)
+    small_id, large_id = small.id, large.id
+    login(client, pharmacist)
+
+    # Start both requests from a cold session and a warm catalog so only the review itself differs
+    drug_catalog.all()
+    db.session.rollback()
+    with statements:
+        client.post(f'/review_order/{small_id}', data=small_form)
+    small_count = statements.count
+    db.session.rollback()
+    with statements:
+        client.post(f'/review_order/{large_id}', data=large_form)
+    assert statements.count == small_count
+    assert DrugOrder.query.filter_by(order_id=large_id, prescription_approved=True, quantity=2).count() == 30
+
+def test_review_order_new_line_does_not_touch_other_orders(client):
+    pharmacist, _, drug, orders = seed(2, lines_per_order=1)
+    other_line = orders[0].items[0]
+    target = orders[1]
+    login(client, pharmacist)
+
+    # New lines are posted with a small counter that can collide with another order's line id
+    rv = client.post(f'/review_order/{target.id}', data=review_form([other_line.id], drug))
+    assert rv.status_code == 302
+    assert db.session.get(DrugOrder, other_line.id).prescription_approved is None
+    assert DrugOrder.query.filter_by(order_id=target.id).count() == 2
+
+def test_review_order_deny_without_reason(client):
+    pharmacist, _, drug, orders = seed(1, lines_per_order=1)
+    order = orders[0]
+    login(client, pharmacist)
+    rv = client.post(f'/review_order/{order.id}', data=review_form([order.items[0].id], drug, status='denied'))
+    assert rv.status_code == 302
+    assert db.session.get(Order, order.id).status == 'pending'
+    assert EmailOutbox.query.count() == 0
@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from app import app, db
+import sqlite_profile
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}", **sqlite_profile.ENGINE_OPTIONS)
+    sqlite_profile.apply(engine, sqlite_profile.DEFAULT_CONFIG)
+    yield engine
+    engine.dispose()
+
+def pragma(connection, name):
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+def test_pragmas_are_set_on_connect(engine):
+    with engine.connect() as connection:
+        assert pragma(connection, 'journal_mode') == 'wal'
+        assert pragma(connection, 'synchronous') == 1  # NORMAL
+        assert pragma(connection, 'busy_timeout') == 5000
+        assert pragma(connection, 'cache_size') == -64 * 1024
+        assert pragma(connection, 'temp_store') == 2  # MEMORY
+        assert pragma(connection, 'foreign_keys') == 1
+
+def test_app_engine_uses_the_profile():
+    with app.app_context():
+        assert db.engine.pool.size() == sqlite_profile.ENGINE_OPTIONS['pool_size']
+        with db.engine.connect() as connection:
+            assert pragma(connection, 'journal_mode') == 'wal'
+
+def test_savepoint_rollback_keeps_the_outer_transaction(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+    with Session(engine) as session:
+        session.execute(text("SELECT 1"))
+        with session.begin_nested():
+            session.execute(text("INSERT INTO t VALUES (1)"))
+        session.rollback()
+        # pysqlite's own BEGIN handling would have committed the row at RELEASE
+        assert session.execute(text("SELECT count(*) FROM t")).scalar() == 0
+
+def test_reader_does_not_block_writer(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+    with engine.connect().execution_options(sqlite_begin='DEFERRED') as reader:
+        reader.begin()
+        reader.exec_driver_sql("SELECT count(*) FROM t").scalar()
+        errors = []
+        def write():
+            try:
+                with engine.begin() as writer:
+                    writer.exec_driver_sql("INSERT INTO t VALUES (1)")
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join(10)
+        assert errors == []
+        # The open read transaction keeps its snapshot
+        assert reader.exec_driver_sql("SELECT count(*) FROM t").scalar() == 0
+        reader.rollback()
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM t").scalar() == 1
+
+def test_read_then_write_transactions_wait_their_turn(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+    errors = []
+    def read_then_write():
+        try:
+            with engine.begin() as connection:
+                connection.exec_driver_sql("SELECT count(*) FROM t").scalar()
+                connection.exec_driver_sql("INSERT INTO t VALUES (2)")
+        except Exception as e:
+            errors.append(e)
+    with engine.connect() as first:
+        first.begin()
+        first.exec_driver_sql("SELECT count(*) FROM t").scalar()
+        # With a deferred BEGIN both would read, and whichever wrote second
+        # would fail at once with "database is locked"
+        thread = threading.Thread(target=read_then_write)
+        thread.start()
+        time.sleep(0.2)
+        first.exec_driver_sql("INSERT INTO t VALUES (1)")
+        first.commit()
+    thread.join(10)
+    assert errors == []
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM t").scalar() == 2
+
+def test_reading_requests_begin_deferred(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    for method in ('GET', 'POST'):
+        with app.test_request_context(method=method), engine.begin() as connection:
+            connection.exec_driver_sql("SELECT count(*) FROM t")
+    assert [s for s in statements if s.startswith('BEGIN')] == ['BEGIN', 'BEGIN IMMEDIATE']
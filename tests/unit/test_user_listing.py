@@ -0,0 +1,61 @@
+import json
+import re
+import pytest
+from app import app, db
+from models import User
+import user_listing
+
+@pytest.fixture
+def client(client):
+    # Duplicate names so the id tiebreaker matters
+    db.session.add_all([User(name=f'user{i // 2:03d}', email=f'u{i}@test.com', password='secret',
+                             phn=f'{i:010d}', phone=f'555{i:04d}', role_id=2) for i in range(25)])
+    db.session.commit()
+    return client
+
+def expected_users():
+    return [{'id': u.id, 'name': u.name, 'phone': u.phone} for u in User.query.order_by(User.name, User.id)]
+
+def next_link(response):
+    match = re.search(r'<([^>]+)>; rel="next"', response.headers.get('Link', ''))
+    return match.group(1) if match else None
+
+def test_default_streams_full_array(client):
+    rv = client.get('/api/users')
+    assert rv.status_code == 200
+    assert rv.is_streamed
+    assert json.loads(rv.data) == expected_users()
+
+def test_projection_selects_only_requested_columns(client, statements):
+    with statements:
+        rv = client.get('/api/users?fields=name')
+    assert json.loads(rv.data)[0] == {'name': 'user000'}
+    select = statements.statements[0].split('FROM')[0]
+    assert 'phone' not in select and 'password' not in select and 'email' not in select
+
+def test_unknown_field_rejected(client):
+    rv = client.get('/api/users?fields=name,password')
+    assert rv.status_code == 400
+
+def test_ndjson(client):
+    rv = client.get('/api/users?format=ndjson&fields=id')
+    assert rv.mimetype == 'application/x-ndjson'
+    lines = rv.data.decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{'id': user['id']} for user in expected_users()]
+
+def test_pages_follow_link_header(client):
+    collected = []
+    url = '/api/users?limit=10'
+    while url:
+        rv = client.get(url)
+        assert rv.status_code == 200
+        page = json.loads(rv.data)
+        assert len(page) <= 10
+        collected.extend(page)
+        url = next_link(rv)
+    assert collected == expected_users()
+
+def test_bad_limit(client):
+    assert client.get('/api/users?limit=0').status_code == 400
+    assert client.get(f'/api/users?limit={user_listing.MAX_LIMIT + 1}').status_code == 400
+    assert client.get('/api/users?limit=abc').status_code == 400
@@ -0,0 +1,81 @@
+import json
+from sqlalchemy import select
+from db import db
+from models import User
+from pagination import keyset_paginate
+
+# Row sources and serializers for /api/users.
+#
+# Only the requested columns are selected (never whole User entities), and the
+# full listing is read through a server-side cursor in batches of YIELD_PER
+# rows and written out as it is read, so memory stays flat however many users
+# there are. Pages use keyset pagination on (name, id).
+
+# Columns clients may ask for with ?fields=; this endpoint is public, so
+# nothing beyond what it always returned
+USER_FIELDS = {
+    'id': User.id,
+    'name': User.name,
+    'phone': User.phone,
+}
+DEFAULT_FIELDS = ('id', 'name', 'phone')
+SORT_COLUMNS = (User.name, User.id)
+
+YIELD_PER = 1000
+MAX_LIMIT = 1000
+
+
+def parse_fields(value):
+    """
+    Returns the requested field names in order, or raises ValueError for an
+    unknown one.
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in USER_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(USER_FIELDS)}")
+    return fields
+
+
+def _columns(fields):
+    # The sort key is always selected so pages can build their cursors
+    columns = [USER_FIELDS[name] for name in fields]
+    columns += [column for column in SORT_COLUMNS if column.key not in fields]
+    return columns
+
+
+def _project(rows, fields):
+    for row in rows:
+        yield {name: getattr(row, name) for name in fields}
+
+
+def stream_users(fields):
+    """
+    Every user, ordered by name, as dicts of `fields`, read in batches from a
+    server-side cursor.
+    """
+    statement = select(*_columns(fields)).order_by(*SORT_COLUMNS).execution_options(yield_per=YIELD_PER)
+    return _project(db.session.execute(statement), fields)
+
+
+def users_page(fields, cursor=None, limit=100):
+    """
+    One KeysetPage of users as dicts of `fields`.
+    """
+    query = db.session.query(*_columns(fields))
+    page = keyset_paginate(query, list(SORT_COLUMNS), cursor=cursor, per_page=limit, descending=False)
+    return page.map(lambda row: {name: getattr(row, name) for name in fields})
+
+
+def json_array(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row, separators=(',', ':'))
+    yield ']'
+
+
+def ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, separators=(',', ':')) + '\n'